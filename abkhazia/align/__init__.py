@@ -14,3 +14,4 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 
 from abkhazia.align.align import Align, AlignNoLattice
+from abkhazia.align.alignment_columns import AlignmentColumns
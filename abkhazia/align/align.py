@@ -30,9 +30,15 @@ two alignment recipes, the Align recipe seems to add more silences.
 
 """
 
+import bisect
+import collections
 import gzip
+import heapq
 import os
+import re
 import shutil
+
+import joblib
 import numpy as np
 
 import abkhazia.utils as utils
@@ -40,6 +46,7 @@ import abkhazia.abstract_recipe as abstract_recipe
 
 from abkhazia.language import check_language_model, read_int2phone
 from abkhazia.features import Features
+from abkhazia.align.alignment_columns import AlignmentColumns
 
 
 # TODO check alignment: which utt have been transcribed, have silence
@@ -66,9 +73,22 @@ class Align(abstract_recipe.AbstractRecipe):
         self.acoustic_scale = 0.1
         self.with_posteriors = False
 
+        # format of the alignment file, 'text' for alignment.txt or
+        # 'npz' for alignment.npz (see AlignmentColumns)
+        self.format = 'text'
+
+        # when the phones of an utterance do not match its words, align
+        # the words by minimum edit distance (see align_words)
+        self.words_fallback = False
+
+        # the lexicon pronunciations as lists of phones, see
+        # _align_utterance
+        self._pronunciations = None
+
     def check_parameters(self):
         super(Align, self).check_parameters()
         self._check_level()
+        self._check_format()
         self._check_with_posteriors()
         self._check_acoustic_scale()
 
@@ -102,20 +122,51 @@ class Align(abstract_recipe.AbstractRecipe):
             self._post_to_phones()
 
     def export(self):
+        """Write the alignment to output_dir/alignment.{txt, npz}
+
+        The Kaldi results of each alignment job are decoded to phones
+        in parallel, each job to its own temporary file sorted by
+        utterance. Those files are then merged and streamed to the
+        alignment file, so the memory used is bounded by the largest
+        job. The words are aligned on the phones during the merge. In
+        'npz' format, the merged lines are stored as AlignmentColumns
+        instead of being written as text.
+
+        """
         int2phone = read_int2phone(self.lm_dir)
-        ali = self._read_result_utts('ali')
-        post = self._read_result_utts('post') if self.with_posteriors else None
 
-        # retrieve the export function according to `level`
-        func = {'phones': self._export_phones,
-                'words': self._export_words,
-                'both': self._export_phones_and_words}[self.level]
-        aligned = func(int2phone, ali, post)
+        # decode each job in its own process
+        jobs = self._result_files()
+        self.log.debug('exporting alignment from %s jobs', len(jobs))
+        shards = joblib.Parallel(n_jobs=self.njobs)(
+            joblib.delayed(_export_job)(ali, post, int2phone, shard)
+            for ali, post, shard in jobs)
 
-        # write it to the target file
-        target = os.path.join(self.output_dir, 'alignment.txt')
-        with utils.open_utf8(target, 'w') as out:
-            out.write('\n'.join(line.strip() for line in aligned) + '\n')
+        # merge the sorted shards by utterance
+        files = [utils.open_utf8(shard, 'r') for shard in shards]
+        try:
+            phones = heapq.merge(*files, key=lambda l: l.split(' ', 1)[0])
+
+            # retrieve the export function according to `level`
+            func = {'phones': lambda lines: lines,
+                    'words': self._export_words,
+                    'both': self._export_phones_and_words}[self.level]
+
+            # write it to the target file
+            if self.format == 'npz':
+                AlignmentColumns.from_lines(
+                    func(phones), level=self.level,
+                    posteriors=self.with_posteriors).save(
+                        os.path.join(self.output_dir, 'alignment.npz'))
+            else:
+                target = os.path.join(self.output_dir, 'alignment.txt')
+                with utils.open_utf8(target, 'w') as out:
+                    for line in func(phones):
+                        out.write(line.strip() + '\n')
+        finally:
+            for shard, fin in zip(shards, files):
+                fin.close()
+                os.remove(shard)
 
         super(Align, self).export()
 
@@ -125,6 +176,12 @@ class Align(abstract_recipe.AbstractRecipe):
             raise IOError("alignment level must be in 'phones', 'words' or "
                           "'both', it is '{}'".format(self.level))
 
+    def _check_format(self):
+        """Raise IOError on bad alignment format"""
+        if self.format not in ['text', 'npz']:
+            raise IOError("alignment format must be in 'text' or 'npz', "
+                          "it is '{}'".format(self.format))
+
     def _check_with_posteriors(self):
         """Force with_posteriors to False if it's not a bool"""
         if not isinstance(self.with_posteriors, bool):
@@ -237,74 +294,73 @@ class Align(abstract_recipe.AbstractRecipe):
                 self.acoustic_scale,
                 os.path.join(self._target_dir(), 'final.mdl')))
 
-    def _read_result_utts(self, start):
-        """Read kaldi output files as utt_ids indexed dict
+    def _result_files(self):
+        """Return the Kaldi results to export, as a list of jobs
 
-        read from _target_dir/start.*.gz, return a dict[utt-id] ->
-        file content.
+        Each job is a tuple (ali, post, shard) with ali the path to
+        _target_dir/ali.JOB.gz, post the path to the corresponding
+        posteriors file (or None if with_posteriors is False) and
+        shard the temporary file where to export the job.
 
         """
         path = self._target_dir()
-        data = []
-        for _file in sorted(
-                [os.path.join(path, f) for f in os.listdir(path)
-                 if f.startswith(start)]):
-            data += [l.decode() for l in gzip.open(_file, 'r')]
+        jobs = sorted(
+            int(m.group(1)) for m in
+            (re.match(r'^ali\.([0-9]+)\.gz$', f) for f in os.listdir(path))
+            if m)
+
+        return [(os.path.join(path, 'ali.{}.gz'.format(job)),
+                 os.path.join(path, 'post.{}.gz'.format(job))
+                 if self.with_posteriors else None,
+                 os.path.join(path, 'export.{}.txt'.format(job)))
+                for job in jobs]
+
+    @staticmethod
+    def _read_result_file(path):
+        """Read a kaldi output file as an utt_ids indexed dict
+
+        read from the gzip file `path`, return a dict[utt-id] -> file
+        content.
 
-        return {line[0]: ' '.join(line[1:]) for line in
-                (l.replace('[', '').replace(']', '').split() for l in data)}
+        """
+        with gzip.open(path, 'rt') as fin:
+            return {line[0]: ' '.join(line[1:]) for line in
+                    (l.replace('[', '').replace(']', '').split()
+                     for l in fin)}
 
     @staticmethod
     def _read_alignment(
             phonemap, ali, post,
             first_frame_center_time=.0125,
             frame_width=0.025, frame_spacing=0.01):
-        """Tokenize raw kaldi alignment output"""
-        for utt_id, line in ali.items():
-            start = first_frame_center_time - frame_width / 2.0
-            current_frame_center_time = first_frame_center_time
-
-            if post:
-                utt_post = [float(p) for p in post[utt_id].split()]
-
-            pairs = line.strip().split(' ; ')
-            nb_pairs = len(pairs)
-            for i, pair in enumerate(pairs):
-                code, nframes = pair.split(' ')
-                nframes = int(nframes)
-                if i == nb_pairs - 1:
-                    # last phone
-                    stop = (current_frame_center_time
-                            + frame_spacing * (nframes - 1.0)
-                            + frame_width / 2.0)
-                    current_frame_center_time = None
-                else:
-                    stop = (current_frame_center_time
-                            + frame_spacing * (nframes - 0.5))
-                    current_frame_center_time = stop + 0.5 * frame_spacing
-
-                if post:
-                    mpost = sum(utt_post[:nframes]) / nframes
-                    utt_post = utt_post[nframes:]
-                    yield (
-                        utt_id,
-                        '{:.4f}'.format(start),
-                        '{:.4f}'.format(stop),
-                        '{:.4f}'.format(mpost),
-                        phonemap[code])
-                else:
-                    yield (
-                        utt_id,
-                        '{:.4f}'.format(start),
-                        '{:.4f}'.format(stop),
-                        phonemap[code])
-
-                start = stop
+        """Tokenize raw kaldi alignment output
+
+        Return an iterator on (utt_id, start, stop, [posterior,]
+        phone) tuples of str, see decode_alignment.
+
+        """
+        utt_ids, codes, start, stop, mpost = decode_alignment(
+            ali, post,
+            first_frame_center_time=first_frame_center_time,
+            frame_width=frame_width, frame_spacing=frame_spacing)
+
+        # format the times and posteriors by columns
+        columns = [utt_ids,
+                   np.char.mod('%.4f', start).tolist(),
+                   np.char.mod('%.4f', stop).tolist()]
+        if mpost is not None:
+            columns.append(np.char.mod('%.4f', mpost).tolist())
+        columns.append([phonemap[code] for code in codes])
+        return zip(*columns)
 
     @staticmethod
     def _read_splited(path):
-        """Read lines from a file, each line being striped and split"""
-        lines = path if isinstance(path, list) else utils.open_utf8(path, 'r')
+        """Read lines from a file, each line being striped and split
+
+        `path` is a filename or any iterable on lines.
+
+        """
+        lines = utils.open_utf8(path, 'r') if isinstance(path, str) else path
         return (l.strip().split() for l in lines)
 
     @classmethod
@@ -322,100 +378,90 @@ class Align(abstract_recipe.AbstractRecipe):
                 alignment = [' '.join(line)]
             else:
                 alignment.append(' '.join(line))
-        yield utt_id, alignment
-
-    def _read_words(self, path):
-        """Yield words alignement from a 'phone and words' alignment file"""
-        word = None
-        start = 0
-        stop = 0
-        for utt_id, alignment in self._read_utts(path):
-            for line in self._read_splited(alignment):
-                phone = line[3]
-                if len(line) == 5:  # new word
-                    if word is not None:
-                        yield ' '.join([utt_id, start, stop, word])
-                    word = line[4]
-                    # utt_id = line[0]
-                    start = line[1]
-                    stop = line[2]
-                elif (phone in self.corpus.silences): 
-                    # Don't count SIL as part of the word
-                    continue
-                else:  # word continues
-                    stop = line[2]
-
-            if word is not None:
-                yield ' '.join([utt_id, start, stop, word])
-                word = None
-
-    def _export_phones(self, int2phone, ali, post):
-        """Export alignment at phone level"""
-        return [' '.join(seq) for seq
-                in self._read_alignment(int2phone, ali, post)]
-
-    def _export_phones_and_words(self, int2phones, ali, post):
-        """Export alignment at both phone and word levels"""
-        phones_alignment = self._export_phones(int2phones, ali, post)
-
-        # align the words on the phones, utterance by utterance
-        alignment = []
-        for utt_id, utt_align in self._read_utts(phones_alignment):
-            alignment += self._align_utterance(utt_id, utt_align)
-        return alignment
-
-    def _align_utterance(self, utt_id, utt_align):
-        # the words we have to align in the utterance
-        words = self.corpus.text[utt_id].strip().split()
-
-        # align the utterance word by word
-        index = 0
-        for word in words:
-            try:
-                utt_align, index = self._align_word(word, utt_align, index)
-            except IndexError:
-                self.log.warning(
-                    f'failed to align words from phones on utterance {utt_id}: '
-                    f'phones dont match word')
-            except KeyError as err:
-                self.log.warning(
-                    f'failed to align words from phones on utterance {utt_id}: '
-                    f'{str(err)}')
+        if utt_id is not None:
+            yield utt_id, alignment
 
+    def _export_phones_and_words(self, phones):
+        """Export alignment at both phone and word levels
 
-        return utt_align
+        `phones` is an iterable on the lines of a phone level
+        alignment, grouped by utterance. The words are appended to the
+        line of their first phone.
 
-    def _align_word(self, word, alignment, index):
-        # the word cut in phones
-        try:
-            phones = self.corpus.lexicon[word].strip().split()
-        except KeyError:
-            raise KeyError(f'out-of-vocabulary word: {word}')
+        """
+        for _, rows, words in self._align_utterances(phones):
+            for word, first, _ in words:
+                rows[first].append(word)
+            for row in rows:
+                yield ' '.join(row)
 
-        for n, phone in enumerate(phones):
-            index = self._align_phone(phone, alignment, index)
-            if n == 0:
-                alignment[index] += f' {word}'
+    def _export_words(self, phones):
+        """Export alignment at word level only
 
-        # go to next phone, in case next word starts with same
-        # phone
-        index += 1
+        A word spans from its first phone up to the last non-silence
+        phone before the next word.
 
-        return alignment, index
+        """
+        for utt_id, rows, words in self._align_utterances(phones):
+            for word, first, last in words:
+                yield ' '.join((utt_id, rows[first][1], rows[last][2], word))
 
-    @staticmethod
-    def _align_phone(phone, alignment, index):
-        current_phone = alignment[index].strip().split()[-1]
+    def _align_utterances(self, phones):
+        """Yield (utt_id, rows, words) from a phone level alignment
+
+        rows are the tokenized lines of the utterance and words the
+        (word, first, last) records returned by _align_utterance.
+
+        """
+        for utt_id, utt_align in self._read_utts(phones):
+            rows = [line.split() for line in utt_align]
+            yield utt_id, rows, self._align_utterance(utt_id, rows)
+
+    def _align_utterance(self, utt_id, rows):
+        """Return the words of `utt_id` aligned on the phones in `rows`
 
-        while phone != current_phone:
-            index += 1
-            current_phone = alignment[index].strip().split()[-1]
-        return index
+        Return a list of (word, first, last) where first is the index
+        in `rows` of the word first phone and last the index of the
+        last phone of the word, trailing silences excluded. The words
+        that cannot be aligned are ignored with a warning.
 
-    def _export_words(self, int2phone, ali, post):
-        """Export alignment at word level only"""
-        return [w for w in self._read_words(
-            self._export_phones_and_words(int2phone, ali, post))]
+        """
+        if self._pronunciations is None:
+            self._pronunciations = {
+                word: pron.split()
+                for word, pron in self.corpus.lexicon.items()}
+
+        words = self.corpus.text[utt_id].split()
+        phones = [row[-1] for row in rows]
+        firsts = align_words(
+            phones, [self._pronunciations.get(word) for word in words],
+            silences=self.corpus.silences, fallback=self.words_fallback)
+
+        aligned = []
+        for word, first in zip(words, firsts):
+            if word not in self._pronunciations:
+                self.log.warning(
+                    f'failed to align words from phones on utterance '
+                    f'{utt_id}: out-of-vocabulary word: {word}')
+            elif first is None:
+                self.log.warning(
+                    f'failed to align words from phones on utterance '
+                    f'{utt_id}: phones dont match word {word}')
+            else:
+                aligned.append((word, first))
+
+        # a word stops at its last non-silence phone before the next
+        # word
+        silences = set(self.corpus.silences)
+        bounds = [first for _, first in aligned[1:]] + [len(rows)]
+        words = []
+        for (word, first), bound in zip(aligned, bounds):
+            last = first
+            for index in range(first + 1, bound):
+                if phones[index] not in silences:
+                    last = index
+            words.append((word, first, last))
+        return words
 
 
 class AlignNoLattice(Align):
@@ -443,6 +489,206 @@ class AlignNoLattice(Align):
         self._ali_to_phones()
 
 
+def align_words(phones, pronunciations, silences=(), fallback=False):
+    """Align words on the phones of an utterance
+
+    phones (list): the aligned phones of the utterance
+
+    pronunciations (list): the words of the utterance, each one given
+      as its list of phones (None for unknown words)
+
+    silences (list): the silence phones, that the alignment may
+      insert between the words
+
+    fallback (bool): when True and some words cannot be aligned, the
+      utterance is aligned by minimum edit distance instead (see
+      _edit_alignment)
+
+    Return the list of the indices in `phones` of the first phone of
+    each word, or None for the words that cannot be aligned.
+
+    The alignment is done in a single left to right pass: each phone
+    of a word is matched to the next occurrence of that phone in
+    `phones`. A word with a phone not found is not aligned and the
+    next word is searched from where it started.
+
+    """
+    # positions of each phone, to find its next occurrence by
+    # bisection
+    positions = collections.defaultdict(list)
+    for index, phone in enumerate(phones):
+        positions[phone].append(index)
+
+    def _next(phone, index):
+        pos = positions.get(phone, [])
+        i = bisect.bisect_left(pos, index)
+        return pos[i] if i < len(pos) else None
+
+    firsts = []
+    index = 0
+    for pron in pronunciations:
+        first, current = None, index
+        for phone in pron or []:
+            current = _next(phone, current)
+            if current is None:
+                first = None
+                break
+            if first is None:
+                first = current
+            current += 1
+
+        firsts.append(first)
+        if first is not None:
+            index = current
+
+    if not fallback or all(
+            f is not None for f, p in zip(firsts, pronunciations) if p):
+        return firsts
+
+    # edit distance alignment of the words phones on the aligned ones
+    ref = [phone for pron in pronunciations for phone in pron or []]
+    matched = _edit_alignment(ref, phones, set(silences))
+
+    firsts = []
+    offset = 0
+    for pron in pronunciations:
+        size = len(pron or [])
+        word = [m for m in matched[offset:offset+size] if m is not None]
+        firsts.append(word[0] if word else None)
+        offset += size
+    return firsts
+
+
+def _edit_alignment(ref, hyp, silences):
+    """Align the phones `ref` on `hyp` by minimum edit distance
+
+    Substituting, deleting or inserting a phone costs 1, except the
+    insertion of a silence from `hyp`, which is free. Return a list
+    giving for each phone of `ref` the index of the phone of `hyp` it
+    is matched or substituted to, or None if it is deleted.
+
+    The cost matrix is computed row by row with numpy, the insertions
+    within a row being a cumulative minimum.
+
+    """
+    vocab = {}
+    ref_ids = np.asarray(
+        [vocab.setdefault(p, len(vocab)) for p in ref], dtype=np.int64)
+    hyp_ids = np.asarray(
+        [vocab.setdefault(p, len(vocab)) for p in hyp], dtype=np.int64)
+
+    # cumulated cost of the insertions from hyp
+    cumins = np.zeros(len(hyp) + 1, dtype=np.int64)
+    np.cumsum([p not in silences for p in hyp], out=cumins[1:])
+
+    cost = np.empty((len(ref) + 1, len(hyp) + 1), dtype=np.int64)
+    cost[0] = cumins
+    for i in range(1, len(ref) + 1):
+        # deletion or substitution, then insertions
+        best = cost[i-1] + 1
+        np.minimum(
+            best[1:], cost[i-1, :-1] + (hyp_ids != ref_ids[i-1]),
+            out=best[1:])
+        cost[i] = cumins + np.minimum.accumulate(best - cumins)
+
+    # backtrack the best path
+    matched = [None] * len(ref)
+    i, j = len(ref), len(hyp)
+    while i > 0:
+        if j > 0 and cost[i, j] == (
+                cost[i-1, j-1] + (hyp_ids[j-1] != ref_ids[i-1])):
+            i, j = i - 1, j - 1
+            matched[i] = j
+        elif cost[i, j] == cost[i-1, j] + 1:
+            i -= 1
+        else:
+            j -= 1
+    return matched
+
+
+def _export_job(ali, post, phonemap, output):
+    """Export the phones alignment of a Kaldi job to a text file
+
+    ali and post are the Kaldi results files of the job (post is
+    None to export without posteriors). The utterances are sorted in
+    `output`. Return `output`.
+
+    """
+    ali = Align._read_result_file(ali)
+    ali = {utt: ali[utt] for utt in sorted(ali)}
+    post = None if post is None else Align._read_result_file(post)
+
+    with utils.open_utf8(output, 'w') as out:
+        for seq in Align._read_alignment(phonemap, ali, post):
+            out.write(' '.join(seq) + '\n')
+    return output
+
+
+def decode_alignment(
+        ali, post=None, first_frame_center_time=.0125,
+        frame_width=0.025, frame_spacing=0.01):
+    """Decode raw Kaldi alignments into columns of phones
+
+    ali (dict): utterances mapped to the output of 'ali-to-phones
+      --write-lengths' (without the utterance id), as 'code nframes ;
+      code nframes ; ...'
+
+    post (dict): utterances mapped to their frame posteriors, as
+      space-separated floats, optional
+
+    Return (utt_ids, codes, start, stop, posterior) with one entry
+    per aligned phone: utt_ids and codes are lists of str, start and
+    stop are numpy arrays of the phones timestamps in seconds and
+    posterior is an array of the phones mean posteriors (or None if
+    `post` is None). The phones are in the order of `ali`.
+
+    The phones boundaries are at the middle of the frames between two
+    frames centers. The first phone of an utterance starts at the
+    beginning of its first frame and the last one stops at the end of
+    its last frame. All the utterances are decoded at once, in a few
+    numpy operations.
+
+    """
+    codes, nframes, counts = [], [], []
+    for line in ali.values():
+        tokens = line.replace(';', ' ').split()
+        codes += tokens[0::2]
+        nframes += tokens[1::2]
+        counts.append(len(tokens) // 2)
+    nframes = np.asarray(nframes, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    # first and last phones of each utterance, and the index of the
+    # first frame following each phone, counted from the utterance
+    # start
+    last = np.cumsum(counts) - 1
+    first = last - counts + 1
+    ends = np.cumsum(nframes)
+    offsets = ends[first[counts > 0]] - nframes[first[counts > 0]]
+    local_ends = ends - np.repeat(offsets, counts[counts > 0])
+
+    stop = first_frame_center_time + frame_spacing * (local_ends - 0.5)
+    last = last[counts > 0]
+    stop[last] = (first_frame_center_time
+                  + frame_spacing * (local_ends[last] - 1.0)
+                  + frame_width / 2.0)
+
+    start = np.empty_like(stop)
+    start[1:] = stop[:-1]
+    start[first[counts > 0]] = first_frame_center_time - frame_width / 2.0
+
+    mpost = None
+    if post is not None:
+        frames = np.fromstring(
+            ' '.join(post[utt] for utt in ali), dtype=np.float64, sep=' ')
+        mpost = (np.add.reduceat(frames, ends - nframes) / nframes
+                 if len(nframes) else np.zeros((0,)))
+
+    utt_ids = [utt for utt, count in zip(ali, counts.tolist())
+               for _ in range(count)]
+    return utt_ids, codes, start, stop, mpost
+
+
 def utterances_posterior_scoring(alignment_file, score_fun=np.prod):
     """Estimate a score for each utterance based on posteriograms
 
@@ -452,13 +698,29 @@ def utterances_posterior_scoring(alignment_file, score_fun=np.prod):
     :param alignmement_file: The path to an alignment file with
       posteriors.  Each line in the must must be: "utt-id tstart tstop
       posterior phone [word]", we consider only column 1 and column 4.
+      The alignment can also be in columnar format (see
+      AlignmentColumns).
 
     :param score_fun: any function (list of floats) -> float
 
     :return: a generator of (utt-id, score) returning the obtained
       score for each utterance defined in the alignment file.
 
+    :raise: IOError if a columnar alignment has no posteriors.
+
     """
+    if AlignmentColumns.is_columns(alignment_file):
+        alignment = AlignmentColumns.load(alignment_file)
+        if alignment.posterior is None:
+            raise IOError(
+                'no posteriors in alignment {}'.format(alignment_file))
+
+        posteriors = alignment.rounded('posterior')
+        for utt in alignment.utts:
+            yield utt, score_fun(
+                posteriors[alignment.rows(utt)].tolist())
+        return
+
     for utt, alignment in Align._read_utts(alignment_file):
         posteriors = [float(line.split(' ')[3]) for line in alignment]
         yield utt, score_fun(posteriors)
@@ -525,7 +787,8 @@ def convert_alignment_to_kaldi_format(
     Parameters
     ----------
     input_ali_file : file
-        The original alignment file in abkhazia format
+        The original alignment file in abkhazia format, as text or in
+        columnar format (see AlignmentColumns)
     lang_dir : dircetory
         The 'lang' directory asgenerated by Kaldi's prep_lang.sh script
     wpd : bool, optional
@@ -559,8 +822,11 @@ def convert_alignment_to_kaldi_format(
 
     log.debug('... loading %s', input_ali_file)
     # for each utterance, a list of lists [tstart, tstop, phone, [word]]
-    alignment = {utt: [a.split(' ')[1:] for a in ali]
-                 for utt, ali in Align._read_utts(input_ali_file)}
+    if AlignmentColumns.is_columns(input_ali_file):
+        alignment = dict(AlignmentColumns.load(input_ali_file).utterances())
+    else:
+        alignment = {utt: [a.split(' ')[1:] for a in ali]
+                     for utt, ali in Align._read_utts(input_ali_file)}
 
     # if needed, convert the alignment phones to position dependent
     # ones (we append _B, _I, _E or _S to each phone)
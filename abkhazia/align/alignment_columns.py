@@ -0,0 +1,262 @@
+# Copyright 2016-2018 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the AlignmentColumns class, a binary storage for alignments"""
+
+import array
+
+import numpy as np
+
+import abkhazia.utils as utils
+
+
+class AlignmentColumns(object):
+    """Columnar storage of an alignment
+
+    The text alignment has one line per row 'utt-id tstart tstop
+    [posterior] phone [word]' (or 'utt-id tstart tstop word' at words
+    level). Here the rows are stored as numpy columns and the
+    utterances, phones and words are interned in lists mapping ids to
+    str:
+
+    - the rows of utterance i are utt_indptr[i] to utt_indptr[i+1]
+    - row r spans from start[r] to stop[r] (float32, in seconds)
+    - its posterior is posterior[r] (float32), if any
+    - its phone is phones[phone[r]], if any (not at words level)
+    - its word is words[word[r]], or no word if word[r] is -1 (None
+      at phones level)
+
+    The columns are saved to a numpy .npz file (see save and load).
+    The times are relative to the utterances, so they keep the 4
+    decimals of the text format for utterances shorter than 1024
+    seconds.
+
+    """
+    extension = '.npz'
+    """extension of the alignment files in columnar format"""
+
+    decimals = 4
+    """number of decimals of the times and posteriors in text format"""
+
+    def __init__(self, utts, phones, words, utt_indptr,
+                 start, stop, posterior=None, phone=None, word=None):
+        self.utts = utts
+        self.phones = phones
+        self.words = words
+
+        self.utt_indptr = utt_indptr
+        self.start = start
+        self.stop = stop
+        self.posterior = posterior
+        self.phone = phone
+        self.word = word
+
+        self.utt_index = {utt: i for i, utt in enumerate(utts)}
+
+    @classmethod
+    def is_columns(cls, path):
+        """Return True if `path` is an alignment in columnar format"""
+        return path.endswith(cls.extension)
+
+    @classmethod
+    def from_lines(cls, lines, level='both', posteriors=False):
+        """Return the columns parsed from text alignment `lines`
+
+        level (str): the alignment level, 'phones', 'words' or 'both'
+
+        posteriors (bool): True if the lines have a posterior column
+
+        Raise IOError if the lines are not grouped by utterance.
+
+        """
+        utts, utt_indptr = [], array.array('q', [0])
+        start, stop = array.array('f'), array.array('f')
+        posterior = array.array('f') if posteriors else None
+        phone = array.array('i') if level != 'words' else None
+        word = array.array('i') if level != 'phones' else None
+        phones, words = {}, {}
+
+        # index of the phone (or word at words level) column
+        column = 4 if posteriors else 3
+        for line in lines:
+            fields = line.split()
+            if not utts or fields[0] != utts[-1]:
+                if utts:
+                    utt_indptr.append(len(start))
+                utts.append(fields[0])
+
+            start.append(float(fields[1]))
+            stop.append(float(fields[2]))
+            if posteriors:
+                posterior.append(float(fields[3]))
+
+            if level == 'words':
+                word.append(words.setdefault(fields[column], len(words)))
+                continue
+
+            phone.append(phones.setdefault(fields[column], len(phones)))
+            if level == 'both':
+                word.append(
+                    words.setdefault(fields[column+1], len(words))
+                    if len(fields) > column + 1 else -1)
+
+        if utts:
+            utt_indptr.append(len(start))
+        if len(set(utts)) != len(utts):
+            raise IOError('alignment is not grouped by utterance')
+
+        def _array(values, dtype):
+            return None if values is None else np.frombuffer(
+                values, dtype=dtype).copy()
+
+        return cls(
+            utts, list(phones.keys()), list(words.keys()),
+            _array(utt_indptr, np.int64),
+            _array(start, np.float32), _array(stop, np.float32),
+            posterior=_array(posterior, np.float32),
+            phone=_array(phone, np.int32), word=_array(word, np.int32))
+
+    @classmethod
+    def read(cls, path, level='both', posteriors=False):
+        """Return the alignment in `path`, in text or columnar format
+
+        `level` and `posteriors` describe the columns of a text
+        alignment (see from_lines), they are ignored for a columnar
+        one.
+
+        """
+        if cls.is_columns(path):
+            return cls.load(path)
+        with utils.open_utf8(path, 'r') as fin:
+            return cls.from_lines(fin, level=level, posteriors=posteriors)
+
+    @classmethod
+    def load(cls, path):
+        """Return the columns saved in the .npz file `path`
+
+        Raise IOError if `path` is not an alignment in columnar format.
+
+        """
+        try:
+            data = np.load(path, allow_pickle=False)
+        except ValueError:
+            raise IOError('{} is not an alignment file'.format(path))
+
+        with data:
+            if 'utt_indptr' not in data.files:
+                raise IOError('{} is not an alignment file'.format(path))
+
+            def _get(name):
+                return data[name] if name in data.files else None
+
+            return cls(
+                data['utts'].tolist(), data['phones'].tolist(),
+                data['words'].tolist(), data['utt_indptr'],
+                data['start'], data['stop'],
+                posterior=_get('posterior'), phone=_get('phone'),
+                word=_get('word'))
+
+    def save(self, path):
+        """Save the columns to the .npz file `path`"""
+        columns = {
+            'utts': np.asarray(self.utts, dtype=str),
+            'phones': np.asarray(self.phones, dtype=str),
+            'words': np.asarray(self.words, dtype=str),
+            'utt_indptr': self.utt_indptr,
+            'start': self.start,
+            'stop': self.stop}
+        for name in ('posterior', 'phone', 'word'):
+            if getattr(self, name) is not None:
+                columns[name] = getattr(self, name)
+
+        # np.savez appends .npz to a filename, give it a file
+        with open(path, 'wb') as fout:
+            np.savez(fout, **columns)
+
+    def __len__(self):
+        return len(self.start)
+
+    def rows(self, utt):
+        """Return the slice of rows of the utterance `utt`
+
+        Raise KeyError if `utt` is not in the alignment.
+
+        """
+        i = self.utt_index[utt]
+        return slice(self.utt_indptr[i], self.utt_indptr[i+1])
+
+    def rounded(self, name):
+        """Return a float column as float64 rounded to the text precision
+
+        `name` is 'start', 'stop' or 'posterior'. The values are the
+        ones read from a text alignment, before their conversion to
+        float32.
+
+        """
+        return np.round(getattr(self, name).astype(np.float64), self.decimals)
+
+    def formatted(self, name):
+        """Return a float column as a list of str in text format
+
+        The times are multiples of the frame shift and the posteriors
+        have few decimals, so each distinct value is formatted once.
+
+        """
+        values, inverse = np.unique(getattr(self, name), return_inverse=True)
+        fmt = '{{:.{}f}}'.format(self.decimals).format
+        strings = [fmt(v) for v in values.astype(np.float64).tolist()]
+        return [strings[i] for i in inverse.ravel().tolist()]
+
+    def utterances(self):
+        """Yield (utt-id, rows) for each utterance in the alignment
+
+        The rows are lists of str [tstart, tstop, phone, [word]], or
+        [tstart, tstop, word] at words level. The posteriors are not
+        included.
+
+        """
+        columns = [self.formatted('start'), self.formatted('stop')]
+        if self.phone is not None:
+            columns.append([self.phones[p] for p in self.phone.tolist()])
+        word = (None if self.word is None
+                else [self.words[w] if w >= 0 else None
+                      for w in self.word.tolist()])
+
+        indptr = self.utt_indptr.tolist()
+        for utt, begin, end in zip(self.utts, indptr[:-1], indptr[1:]):
+            rows = [list(row) for row in zip(
+                *(column[begin:end] for column in columns))]
+            if word is not None:
+                for row, w in zip(rows, word[begin:end]):
+                    if w is not None:
+                        row.append(w)
+            yield utt, rows
+
+    def lines(self):
+        """Yield the alignment rows as lines in text format"""
+        posterior = (None if self.posterior is None
+                     else self.formatted('posterior'))
+        r = 0
+        for utt, rows in self.utterances():
+            for row in rows:
+                if posterior is not None:
+                    row.insert(2, posterior[r])
+                yield ' '.join([utt] + row)
+                r += 1
+
+    def write_text(self, path):
+        """Write the alignment to `path` in text format"""
+        with utils.open_utf8(path, 'w') as out:
+            for line in self.lines():
+                out.write(line + '\n')
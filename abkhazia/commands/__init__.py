@@ -20,17 +20,48 @@ Note that this package contains only the code related to abkhazia
 execution from a terminal. It defines argument parsers and delegates
 the processing to modules in abkhazia.prepare or abkhazia.kaldi
 
+The command modules import the heavy parts of abkhazia (numpy,
+joblib, h5features, ...), so they are imported only when one of their
+classes is accessed (see command_class).
+
 """
 
+import importlib
+
 from abkhazia.commands.abstract_command import AbstractCommand
-from abkhazia.commands.abkhazia_acoustic import AbkhaziaAcoustic
-from abkhazia.commands.abkhazia_align import AbkhaziaAlign
-from abkhazia.commands.abkhazia_language import AbkhaziaLanguage
-from abkhazia.commands.abkhazia_decode import AbkhaziaDecode
-from abkhazia.commands.abkhazia_prepare import AbkhaziaPrepare
-from abkhazia.commands.abkhazia_split import AbkhaziaSplit
-from abkhazia.commands.abkhazia_plot import AbkhaziaPlot
-from abkhazia.commands.abkhazia_features import AbkhaziaFeatures
-from abkhazia.commands.abkhazia_merge_wavs import AbkhaziaMergeWavs
-from abkhazia.commands.abkhazia_filter import AbkhaziaFilter
-from abkhazia.commands.abkhazia_validate import AbkhaziaValidate
+
+
+commands = [
+    ('validate', 'abkhazia_validate', 'AbkhaziaValidate'),
+    ('prepare', 'abkhazia_prepare', 'AbkhaziaPrepare'),
+    ('split', 'abkhazia_split', 'AbkhaziaSplit'),
+    ('merge_wavs', 'abkhazia_merge_wavs', 'AbkhaziaMergeWavs'),
+    ('plot', 'abkhazia_plot', 'AbkhaziaPlot'),
+    ('filter', 'abkhazia_filter', 'AbkhaziaFilter'),
+    ('features', 'abkhazia_features', 'AbkhaziaFeatures'),
+    ('language', 'abkhazia_language', 'AbkhaziaLanguage'),
+    ('acoustic', 'abkhazia_acoustic', 'AbkhaziaAcoustic'),
+    ('align', 'abkhazia_align', 'AbkhaziaAlign'),
+    ('decode', 'abkhazia_decode', 'AbkhaziaDecode')]
+"""The abkhazia commands as (name, module, class), in display order"""
+
+
+def command_class(name):
+    """Return the class of the command `name`, importing its module
+
+    Raise KeyError if `name` is not an abkhazia command.
+
+    """
+    _, module, cls = {c[0]: c for c in commands}[name]
+    return getattr(importlib.import_module(
+        'abkhazia.commands.' + module), cls)
+
+
+def __getattr__(attr):
+    # lazy access to the command classes, as in 'from abkhazia.commands
+    # import AbkhaziaValidate'
+    for name, _, cls in commands:
+        if cls == attr:
+            return command_class(name)
+    raise AttributeError(
+        'module {} has no attribute {}'.format(__name__, attr))
@@ -67,6 +67,18 @@ class AbkhaziaAlign(AbstractKaldiCommand):
             '--words-only', action='store_true',
             help='do not write phones in the final alignment file, only words')
 
+        parser.add_argument(
+            '--format', choices=['text', 'npz'], default='text',
+            help='''format of the alignment file, 'text' writes
+            alignment.txt, 'npz' writes alignment.npz, a binary columnar
+            storage much faster to load, default is %(default)s''')
+
+        parser.add_argument(
+            '--words-fallback', action='store_true',
+            help='''when the aligned phones of an utterance do not match
+            its pronunciation, align the words by minimum edit distance
+            instead of dropping them''')
+
         dir_group.add_argument(
             '-l', '--language-model', metavar='<lm-dir>', default=None,
             help='''the language model recipe directory, data is read from
@@ -127,6 +139,8 @@ class AbkhaziaAlign(AbstractKaldiCommand):
         recipe.njobs = args.njobs
         recipe.level = level
         recipe.with_posteriors = args.post
+        recipe.words_fallback = args.words_fallback
+        recipe.format = args.format
         recipe.acoustic_scale = args.acoustic_scale
         recipe.lm_dir = lang
         recipe.feat_dir = feat
@@ -121,7 +121,8 @@ class _FeatBase(AbstractKaldiCommand):
             recipe.log.info('exporting Kaldi ark features to h5features...')
             kaldi.scp_to_h5f(
                 os.path.join(recipe.output_dir, 'feats.scp'),
-                os.path.join(recipe.output_dir, 'feats.h5f'))
+                os.path.join(recipe.output_dir, 'feats.h5f'),
+                njobs=args.njobs, log=recipe.log)
 
 
 class _FeatMfcc(_FeatBase):
@@ -61,6 +61,11 @@ class AbkhaziaFilter(AbstractCoreCommand):
             wav_files, and the segments updated accordingly. If trim==False,
             the segments file, text file, and utt2spk file will be updated,
             but the wav will still contain the unwanted utterances.''')
+        group.add_argument(
+            '-j', '--njobs', type=int, default=utils.default_njobs(),
+            metavar='<njobs>',
+            help='number of wavs to trim in parallel. '
+            'Default is to launch %(default)s jobs.')
         group.add_argument(
             '--THCHS30', action='store_true',
             help='''Set to true if treating the THCHS30 corpus, to avoid
@@ -89,10 +94,10 @@ class AbkhaziaFilter(AbstractCoreCommand):
 
         if args.trim:
             print("trimming utterances")
+            subcorpus.trim(
+                    corpus_dir, output_dir,
+                    args.function, not_kept_utterances, njobs=args.njobs)
             subcorpus.save(
                     os.path.join(
                         output_dir, args.function, 'data'),
                     no_wavs=True, copy_wavs=False)
-            subcorpus.trim(
-                    corpus_dir, output_dir,
-                    args.function, not_kept_utterances)
@@ -28,38 +28,12 @@ import argcomplete
 import argparse
 
 import abkhazia.utils as utils
+import abkhazia.commands as commands
 from abkhazia import __version__
-from abkhazia.commands import (
-    AbkhaziaValidate,
-    AbkhaziaPrepare,
-    AbkhaziaFeatures,
-    AbkhaziaSplit,
-    AbkhaziaMergeWavs,
-    AbkhaziaPlot,
-    AbkhaziaFilter,
-    AbkhaziaLanguage,
-    AbkhaziaAcoustic,
-    AbkhaziaDecode,
-    AbkhaziaAlign)
 
 
 class Abkhazia(object):
     """Parse the input arguments and call the requested subcommand"""
-    # the possible subcommand classes
-    _command_classes = [
-        AbkhaziaValidate,
-        AbkhaziaPrepare,
-        AbkhaziaSplit,
-        AbkhaziaMergeWavs,
-        AbkhaziaPlot,
-        AbkhaziaFilter,
-        AbkhaziaFeatures,
-        AbkhaziaLanguage,
-        AbkhaziaAcoustic,
-        AbkhaziaAlign,
-        AbkhaziaDecode
-    ]
-
     # a string describing abkhazia and its subcommands
     description = (
         'ABX and kaldi experiments on speech corpora made easy,\n'
@@ -92,7 +66,23 @@ class Abkhazia(object):
 
         return parser.parse_known_args()[1]
 
-    def init_parser(self):
+    @staticmethod
+    def command_classes(argv):
+        """Return the classes of the subcommands to register in the parser
+
+        Importing a subcommand is costly, so when a subcommand is
+        given in `argv` only this one is imported. All the subcommands
+        are imported when none is given (as in 'abkhazia --help'), for
+        an unknown one, or for shell autocompletion.
+
+        """
+        names = [c[0] for c in commands.commands]
+        given = [a for a in argv if not a.startswith('-')][:1]
+        if given and given[0] in names and '_ARGCOMPLETE' not in os.environ:
+            names = given
+        return [commands.command_class(name) for name in names]
+
+    def init_parser(self, command_classes):
         """Return an argument parser initialized form abkhazia subcommands"""
         # create the top-level parser
         parser = argparse.ArgumentParser(
@@ -124,9 +114,9 @@ class Abkhazia(object):
             help='possible commands are:\n' +
             '\n'.join((' {} - {}'
                        .format(c.name + ' '*(8-len(c.name)), c.description)
-                       for c in self._command_classes)))
+                       for c in command_classes)))
 
-        for command in self._command_classes:
+        for command in command_classes:
             command.add_parser(subparsers)
 
         return parser
@@ -138,7 +128,7 @@ class Abkhazia(object):
         argv = self.load_config()
 
         # init the parser and subparsers for abkhazia
-        parser = self.init_parser()
+        parser = self.init_parser(self.command_classes(argv))
 
         # enable autocompletion and parse arguments
         argcomplete.autocomplete(parser)
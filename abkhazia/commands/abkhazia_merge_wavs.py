@@ -34,6 +34,12 @@ class AbkhaziaMergeWavs(AbstractCoreCommand):
 
         group = parser.add_argument_group('merge_wavs arguments')
 
+        group.add_argument(
+            '-j', '--njobs', type=int, default=utils.default_njobs(),
+            metavar='<njobs>',
+            help='number of speakers to merge in parallel. '
+            'Default is to launch %(default)s jobs.')
+
         return parser
 
     @classmethod
@@ -44,7 +50,5 @@ class AbkhaziaMergeWavs(AbstractCoreCommand):
 
         corpus = Corpus.load(corpus_dir, validate=args.validate, log=log)
 
-        corpus.merge_wavs(corpus_dir,output_dir)
-        
-        corpus.save(os.path.join(output_dir,'data'),no_wavs=True)
-
+        # the merged corpus is saved in output_dir/data
+        corpus.merge_wavs(os.path.join(output_dir, 'data'), njobs=args.njobs)
@@ -25,6 +25,12 @@ from abkhazia.corpus.corpus_split import CorpusSplit
 from abkhazia.corpus.corpus_merge_wavs import CorpusMergeWavs
 from abkhazia.corpus.corpus_filter import CorpusFilter
 from abkhazia.corpus.corpus_trimmer import CorpusTrimmer
+from abkhazia.corpus.corpus_cache import CorpusCache
+from abkhazia.corpus.corpus_dict import CorpusDict
+from abkhazia.corpus.corpus_index import CorpusIndex
+from abkhazia.corpus.corpus_shards import CorpusShards
+from abkhazia.corpus.corpus_columns import (
+    CorpusColumns, SegmentsView, TextView, Utt2SpkView)
 import abkhazia.utils as utils
 
 
@@ -96,20 +102,59 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
     - alternative phones variants (not yet implemented)
     - exemple: []
 
+    The dicts assigned to lexicon, segments, text, utt2spk and phones
+    are copied as CorpusDict instances, which track their
+    modifications (see the CorpusDict class).
+
+    Compact corpus
+    ==============
+
+    The compact() method returns a copy of the corpus where segments,
+    text and utt2spk are read-only views on a columnar storage (see
+    the CorpusColumns class). This strongly reduces the memory usage
+    on large corpora and spk2utt(), wav2utt(), words() and subcorpus()
+    then operate on numpy arrays.
+
+    Utterances index
+    ================
+
+    The utterances grouped by speaker and by wav are cached in a
+    CorpusIndex (see the index() method). The index is rebuilt when
+    wav_folder is assigned or when utt2spk or segments are assigned
+    or modified, as detected by their version (see CorpusDict).
+
+    Packed wavs
+    ===========
+
+    The wav folder can store the wav files packed in a few large
+    shards (see the CorpusShards class and the `pack_wavs` option of
+    save()). A packed wav folder is detected when loading the corpus
+    and the wavs are then accessed through the wav_shards() method.
+
     """
+    _indexed = ('utt2spk', 'segments', 'wav_folder')
+    """attributes the index is built from"""
+
+    _tracked = ('lexicon', 'segments', 'text', 'utt2spk', 'phones')
+    """dict attributes stored as CorpusDict"""
 
     @classmethod
-    def load(cls, corpus_dir, validate=False, log=utils.logger.null_logger()):
+    def load(cls, corpus_dir, validate=False, cache=True,
+             log=utils.logger.null_logger()):
         """Return a corpus initialized from `corpus_dir`
 
         If validate is True, make sure the corpus is valid before
         returning it.
 
+        If cache is True, the parsed corpus files are cached (see
+        CorpusCache) to speed up the next loads.
+
         Raise IOError if corpus_dir if an invalid directory, the
         output corpus is not validated.
 
         """
-        return CorpusLoader.load(cls, corpus_dir, validate=validate, log=log)
+        return CorpusLoader.load(
+            cls, corpus_dir, validate=validate, cache=cache, log=log)
 
     def __init__(self, log=utils.logger.null_logger()):
         """Initialize an empty corpus"""
@@ -125,7 +170,18 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         self.silences = []
         self.variants = []
 
-    def save(self, path, no_wavs=False, copy_wavs=True, force=False):
+        # fingerprints of the validated data, see CorpusValidation
+        self._validation = dict()
+
+    def __setattr__(self, name, value):
+        if name in self._tracked and type(value) is dict:
+            value = CorpusDict(value)
+        if name in self._indexed:
+            self.invalidate_index()
+        super(Corpus, self).__setattr__(name, value)
+
+    def save(self, path, no_wavs=False, copy_wavs=True, force=False,
+             pack_wavs=False):
         """Save the corpus to the directory `path`
 
         :param str path: The output directory is assumed to be a non
@@ -140,6 +196,10 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         :param bool force: when True, overwrite `path` if it is
             already existing
 
+        :param bool pack_wavs: when True, the wavs are copied in
+            large shard files instead of one file per wav (see
+            CorpusShards), copy_wavs is ignored
+
         :raise: OSError if force=False and `path` already exists
 
         """
@@ -149,16 +209,21 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
             self.log.warning('overwriting existing path: %s', path)
             utils.remove(path)
 
-        CorpusSaver.save(self, path, no_wavs=no_wavs, copy_wavs=copy_wavs)
+        CorpusSaver.save(self, path, no_wavs=no_wavs, copy_wavs=copy_wavs,
+                         pack_wavs=pack_wavs)
 
-    def validate(self, njobs=utils.default_njobs()):
+    def validate(self, njobs=utils.default_njobs(), force=False):
         """Validate speech corpus data
 
         Raise IOError on the first encoutered error, relies on the
         CorpusValidation class.
 
+        The validation is incremental: only the data modified since
+        the last validation is checked again, unless `force` is True.
+
         """
-        CorpusValidation(self, njobs=njobs, log=self.log).validate()
+        CorpusValidation(self, njobs=njobs, log=self.log).validate(
+            force=force)
 
     def is_valid(self, njobs=utils.default_njobs()):
         """Return True if the corpus is in a valid state"""
@@ -168,6 +233,68 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
             return False
         return True
 
+    def compact(self):
+        """Return a copy of the corpus with a columnar storage
+
+        The segments, text and utt2spk of the returned corpus are
+        read-only dict-like views, other attributes are shared with
+        the original corpus. To modify the utterances, assign new
+        dicts to those attributes.
+
+        """
+        return self._copy_with_columns(CorpusColumns.from_corpus(self))
+
+    def _copy_with_columns(self, columns):
+        corpus = Corpus(log=self.log)
+        corpus.meta = self.meta
+        corpus.wav_folder = self.wav_folder
+        corpus.wavs = self.wavs
+        corpus.lexicon = self.lexicon
+        corpus.phones = self.phones
+        corpus.silences = self.silences
+        corpus.variants = self.variants
+        corpus.segments = SegmentsView(columns)
+        corpus.text = TextView(columns)
+        corpus.utt2spk = Utt2SpkView(columns)
+        corpus._validation = dict(self._validation)
+        return corpus
+
+    def _columns(self):
+        """Return the CorpusColumns behind the corpus, or None
+
+        None is returned if the corpus is not compact or if one of
+        segments, text or utt2spk has been replaced.
+
+        """
+        views = (self.segments, self.text, self.utt2spk)
+        if not all(isinstance(v, (SegmentsView, TextView, Utt2SpkView))
+                   for v in views):
+            return None
+        columns = views[0].columns
+        if not all(v.columns is columns for v in views):
+            return None
+        return columns
+
+    def index(self):
+        """Return the CorpusIndex of the utterances, built on first call
+
+        The index is built again when utt2spk or segments have been
+        modified since, or at each call if one of them has no version
+        (when it is not a CorpusDict or a columnar view).
+
+        """
+        index, versions = self.__dict__.get('_index', (None, None))
+        current = (getattr(self.utt2spk, 'version', None),
+                   getattr(self.segments, 'version', None))
+        if index is None or versions != current or None in current:
+            index = CorpusIndex.from_corpus(self)
+            self.__dict__['_index'] = (index, current)
+        return index
+
+    def invalidate_index(self):
+        """Discard the cached index"""
+        self.__dict__['_index'] = (None, None)
+
     def utts(self):
         """Return the list of utterance ids stored in the corpus"""
         return list(self.utt2spk.keys())
@@ -184,13 +311,7 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         egs/wsj/s5/utils/utt2spk_to_spk2utt.pl.
 
         """
-        # init an empty list for all speakers
-        spk2utt = {spk: [] for spk in set(self.utt2spk.values())}
-
-        # populate lists with utterance ids
-        for utt, spk in self.utt2spk.items():
-            spk2utt[spk].append(utt)
-        return spk2utt
+        return {spk: list(utts) for spk, utts in self.index().spk2utt.items()}
 
     def wav2utt(self):
         """Return a dict of wav-ids mapped to utterances/timestamps they contain
@@ -199,31 +320,101 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         tend). Built on self.segments.
 
         """
-        # init an empty list for all wavs
-        wav2utt = {wav: [] for wav, _, _ in self.segments.values()}
+        return {wav: list(utts) for wav, utts in self.index().wav2utt.items()}
+
+    def spk2duration(self):
+        """Return a dict of speakers mapped to their speech duration
 
-        def _float(t):
-            return None if t is None else float(t)
+        Durations are floats expressed in seconds, see utt2duration.
 
-        # populate lists with utterance ids and timestamps
-        for utt, (wav, tstart, tend) in self.segments.items():
-            wav2utt[wav].append((utt, _float(tstart), _float(tend)))
-        return wav2utt
+        """
+        return dict(self.index().spk2duration(self.utt2duration))
 
-    def utt2duration(self):
+    def utt2duration(self, wavs_meta=None):
         """Return a dict of utterances ids mapped to their duration
 
         Durations are floats expressed in second, read from wav files
+        (see wavs_metadata) when the utterances have no timestamps.
+
+        `wavs_meta` is an optional dict of precomputed wavs meta
+        information, used instead of reading the wav files.
 
         """
+        wavs = {wav for wav, _, stop in self.segments.values()
+                if stop is None}
+        if wavs_meta is not None and wavs.issubset(wavs_meta.keys()):
+            meta = wavs_meta
+        else:
+            meta = self.wavs_metadata(wavs) if wavs else {}
+
         utt2dur = dict()
         for utt, (wav, start, stop) in self.segments.items():
             start = 0 if start is None else start
-            wav_path = os.path.join(self.wav_folder, wav)
-            stop = utils.wav.duration(wav_path) if stop is None else stop
+            stop = meta[wav].duration if stop is None else stop
             utt2dur[utt] = stop - start
         return utt2dur
 
+    def wavs_metadata(self, wavs=None, njobs=1):
+        """Return a dict of wavs mapped to their meta information
+
+        The meta information is obtained from utils.wav.scan(), see
+        the documentation there for details.
+
+        wavs : the wav ids to scan, default to all the corpus wavs
+
+        njobs : the number of parallel scans
+
+        The meta information is cached for the corpus containing the
+        wav folder (see CorpusCache) so that a wav is scanned again
+        only when it has been modified. Packed wavs are scanned
+        directly from their shards (see CorpusShards.scan).
+
+        """
+        wavs = self.wavs if wavs is None else wavs
+
+        shards = self.wav_shards()
+        if shards is not None:
+            return shards.scan(wavs, njobs=njobs)
+
+        paths = {w: os.path.join(self.wav_folder, w) for w in wavs}
+
+        cache = CorpusCache(
+            os.path.dirname(os.path.abspath(self.wav_folder)), log=self.log)
+        entries = cache.get('wavs', None, dict)
+        previous = dict(entries)
+
+        meta = utils.wav.scan(paths.values(), njobs=njobs, cache=entries)
+        if entries != previous:
+            cache.set('wavs', None, entries)
+
+        return {w: meta[path] for w, path in paths.items()}
+
+    def wav_shards(self):
+        """Return the CorpusShards of a packed wav folder, or None
+
+        The shards are loaded on the first call and reloaded only when
+        the wav folder changes.
+
+        """
+        folder, shards = self.__dict__.get('_shards', (None, None))
+        if folder != self.wav_folder:
+            shards = (CorpusShards.load(self.wav_folder, log=self.log)
+                      if CorpusShards.is_packed(self.wav_folder) else None)
+            self.__dict__['_shards'] = (self.wav_folder, shards)
+        return shards
+
+    def wav_rxfilename(self, wav, pipe=False):
+        """Return the Kaldi rxfilename of a wav, as written in wav.scp
+
+        This is the path to the wav file, or its location in a shard
+        for packed wavs (see CorpusShards.rxfilename for `pipe`).
+
+        """
+        shards = self.wav_shards()
+        if shards is not None:
+            return shards.rxfilename(wav, pipe=pipe)
+        return os.path.join(self.wav_folder, wav)
+
     def duration(self, format='seconds'):
         """Return the total duration of the corpus
 
@@ -252,6 +443,11 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         a set for search efficiency.
 
         """
+        columns = self._columns()
+        if columns is not None:
+            return set(word for word in columns.words_set()
+                       if (word in self.lexicon if in_lexicon else True))
+
         return set(
             word for utt in self.text.values() for word in utt.split()
             if (word in self.lexicon if in_lexicon else True))
@@ -276,27 +472,36 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         not occurs if the input corpus is valid).
 
         """
-        corpus = Corpus()
+        columns = self._columns()
+        if columns is not None:
+            corpus = self._copy_with_columns(columns.subset(utt_ids))
+            corpus.log = utils.logger.null_logger()
+            corpus.meta = utils.meta.Meta()
+        else:
+            corpus = Corpus()
+            corpus.lexicon = self.lexicon
+            corpus.phones = self.phones
+            corpus.silences = self.silences
+            corpus.variants = self.variants
+
+            corpus.wav_folder = self.wav_folder
+            corpus.wavs = self.wavs
+
+            corpus.segments = dict()
+            corpus.text = dict()
+            corpus.utt2spk = dict()
+            for utt in utt_ids:
+                corpus.segments[utt] = self.segments[utt]
+                corpus.text[utt] = self.text[utt]
+                corpus.utt2spk[utt] = self.utt2spk[utt]
+
         corpus.meta.source = self.meta.source
         corpus.meta.name = name if name else 'subcorpus of ' + self.meta.name
         corpus.meta.comment = ('{} utterances from {}'
                                .format(len(utt_ids), len(self.utts())))
 
-        corpus.lexicon = self.lexicon
-        corpus.phones = self.phones
-        corpus.silences = self.silences
-        corpus.variants = self.variants
-
-        corpus.wav_folder = self.wav_folder
-        corpus.wavs = self.wavs
-
-        corpus.segments = dict()
-        corpus.text = dict()
-        corpus.utt2spk = dict()
-        for utt in utt_ids:
-            corpus.segments[utt] = self.segments[utt]
-            corpus.text[utt] = self.text[utt]
-            corpus.utt2spk[utt] = self.utt2spk[utt]
+        # the wavs validated for this corpus are not scanned again
+        corpus._validation = dict(self._validation)
 
         if prune:
             corpus.prune()
@@ -433,6 +638,36 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
                      else spliter.split_by_speakers)
         return split_fun(train_prop, test_prop)
 
+    def kfold(self, k, by_speakers=True, stratify_on=None,
+              random_seed=None):
+        """Return a generator of k pairs (train, testing) of subcorpora
+        for cross-validation
+
+        k : int, the number of folds, must be greater than 1, raise
+          RuntimeError otherwise
+
+        by_speakers : bool, if True the utterances of a speaker are
+          all in the same fold, else the utterances of each speaker
+          are distributed among the folds (default is True).
+
+        stratify_on : dict mapping speakers (if by_speakers is True)
+          or utterances (else) to a stratum (e.g. speakers to their
+          gender). Each stratum is distributed evenly among the
+          folds. If None, utterances are stratified on their speaker
+          and speakers are not stratified (default is None).
+
+        random_seed : seed for pseudo-random numbers generation (default
+          is to use the current system time)
+
+        The wavs are validated once for all the folds and the yielded
+        subcorpora are compact read-only views on this corpus (see
+        the compact method).
+
+        """
+        spliter = CorpusSplit(self, random_seed=random_seed, prune=True)
+        return spliter.kfold(
+            k, by_speakers=by_speakers, stratify_on=stratify_on)
+
     def phonemize(self):
         """Return a phonemized version of the corpus
 
@@ -488,17 +723,9 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         # connection without X forward)
         import matplotlib.pyplot as plt
 
-        utt_ids, utt_speakers = zip(*self.utt2spk.items())
-        utt2dur = self.utt2duration()
-        spkr2dur = dict()
-
-        for spkr in utt_speakers:
-            spkr2dur[spkr] = sum(
-                [utt2dur[utt_id] for utt_id in self.utt2spk
-                 if self.utt2spk[utt_id] == spkr])
-
-        sorted_speaker = sorted(spkr2dur.items(), key=lambda k, v: (v, k))
-        sorted_speaker.reverse()
+        sorted_speaker = sorted(
+            self.spk2duration().items(), key=lambda x: (x[1], x[0]),
+            reverse=True)
 
         # Set plot parameters
         names = [spk_id for (spk_id, duration) in sorted_speaker]
@@ -529,12 +756,13 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
 
         return(plt)
 
-    def merge_wavs(self, output_dir, log=None, padding=0.):
+    def merge_wavs(self, output_dir, log=None, padding=0., njobs=1):
         """ Merge all wav files from same speaker
         Returns a corpus with one wav file per speaker """
         if log is None:
             log = self.log
-        CorpusMergeWavs(self, log=log).merge_wavs(output_dir, padding)
+        CorpusMergeWavs(self, log=log).merge_wavs(
+            output_dir, padding, njobs=njobs)
 
     def create_filter(self, out_path, function,
                       nb_speaker=None, new_speakers=10, THCHS30=False):
@@ -542,8 +770,10 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         return(CorpusFilter(self).create_filter(
             out_path, function, nb_speaker, new_speakers, THCHS30))
 
-    def trim(self, corpus_dir, output_dir, function, not_kept_utts):
-        """ Remove utterances from the corpus
-            (using sox to trim the wav files)"""
-        CorpusTrimmer(self).trim(
-                corpus_dir, output_dir, function, not_kept_utts)
+    def trim(self, corpus_dir, output_dir, function, not_kept_utts,
+             njobs=1):
+        """ Remove utterances from the corpus wav files
+            (see CorpusTrimmer)"""
+        CorpusTrimmer(self, log=self.log).trim(
+                corpus_dir, output_dir, function, not_kept_utts,
+                njobs=njobs)
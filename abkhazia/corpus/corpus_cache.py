@@ -0,0 +1,109 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the CorpusCache class"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+from abkhazia.utils import logger, cache_directory
+
+
+class CorpusCache(object):
+    """Persistent cache of the parsed data of a corpus directory
+
+    The cache is stored in the user cache directory (see
+    utils.cache_directory), in a subdirectory named after the hash of
+    the corpus real path. It is never stored in the corpus itself:
+    the entries are pickled and a corpus directory downloaded from
+    elsewhere must not be able to run code when loaded. Each entry is
+    a pickle file storing some data along with the key it has been
+    computed from. When the key changes (for instance when a source
+    file is modified), the entry is rebuilt.
+
+    The cache is best effort: a corrupted entry is rebuilt and if the
+    cache directory is not writable, the entries are simply not saved.
+
+    corpus_dir (str): the corpus directory
+
+    log (logging.Logger): the logging instance to send messages, by
+      default disable logging.
+
+    """
+    dirname = 'corpus'
+    """name of the corpora caches in the user cache directory"""
+
+    version = 1
+    """version of the cache format, entries of other versions are rebuilt"""
+
+    def __init__(self, corpus_dir, log=logger.null_logger()):
+        corpus_dir = os.path.realpath(corpus_dir)
+        self.directory = os.path.join(
+            cache_directory(), self.dirname,
+            hashlib.sha1(corpus_dir.encode('utf-8')).hexdigest())
+        self.log = log
+
+    @staticmethod
+    def fingerprint(path):
+        """Return the (mtime, size) of `path` to detect modifications"""
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, name, key, build):
+        """Return the data cached as `name`, or `build()` if outdated
+
+        `key` must be a picklable object identifying the data, compared
+        with the one stored in the cache. When the cached data is
+        missing or outdated, it is computed by calling `build()` and
+        saved to the cache.
+
+        """
+        entry = os.path.join(self.directory, name + '.pickle')
+
+        try:
+            with open(entry, 'rb') as fin:
+                cached_key, data = pickle.load(fin)
+            if cached_key == (self.version, key):
+                self.log.debug('loaded %s from cache', name)
+                return data
+        except Exception:  # missing or corrupted entry
+            pass
+
+        data = build()
+        self.set(name, key, data)
+        return data
+
+    def set(self, name, key, data):
+        """Save `data` to the cache as `name` identified by `key`"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            # write to a temp file first so that concurrent readers
+            # never see a partial entry
+            with tempfile.NamedTemporaryFile(
+                    dir=self.directory, delete=False) as tmp:
+                pickle.dump(
+                    ((self.version, key), data), tmp, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp.name, os.path.join(
+                self.directory, name + '.pickle'))
+        except OSError as err:
+            self.log.debug('cannot cache %s: %s', name, err)
+
+    def load_file(self, path, parser):
+        """Return `parser(path)`, cached as long as `path` is unchanged"""
+        return self.get(
+            os.path.basename(path), self.fingerprint(path),
+            lambda: parser(path))
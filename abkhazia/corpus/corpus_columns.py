@@ -0,0 +1,214 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the CorpusColumns class, a compact storage for corpora"""
+
+import collections.abc
+
+import numpy as np
+
+from abkhazia.corpus.corpus_dict import next_version
+
+
+class CorpusColumns(object):
+    """Columnar storage of the utterance indexed data of a corpus
+
+    The segments, text and utt2spk dictionaries of a corpus are stored
+    as numpy arrays of integer ids. Utterances, speakers, wavs and
+    words are interned in lists mapping ids to str:
+
+    - utterance i is spoken by speakers[utt2spk[i]]
+    - it comes from wavs[utt2wav[i]], between start[i] and stop[i]
+      (both NaN if the utterance covers the whole wav)
+    - its text is the words with ids in
+      text_words[text_indptr[i]:text_indptr[i+1]]
+
+    A subset of the utterances shares the speakers, wavs and words
+    lists with its parent, only the per-utterance arrays are indexed.
+
+    Use the from_corpus() method to build an instance from the dicts
+    of a corpus. The segments, text and utt2spk attributes are
+    read-only dict-like views on the columns.
+
+    """
+    def __init__(self, utts, speakers, wavs, words,
+                 utt2spk, utt2wav, start, stop, text_indptr, text_words):
+        self.utts = utts
+        self.speakers = speakers
+        self.wavs = wavs
+        self.words = words
+
+        self.utt2spk = utt2spk
+        self.utt2wav = utt2wav
+        self.start = start
+        self.stop = stop
+        self.text_indptr = text_indptr
+        self.text_words = text_words
+
+        self.utt_index = {utt: i for i, utt in enumerate(utts)}
+
+    @classmethod
+    def from_corpus(cls, corpus):
+        """Return the columns built from `corpus` segments, text and utt2spk
+
+        Raise KeyError if an utterance in utt2spk is not in segments
+        or text.
+
+        """
+        utts = sorted(corpus.utt2spk.keys())
+
+        def _intern(values):
+            vocab = {}
+            ids = np.fromiter(
+                (vocab.setdefault(v, len(vocab)) for v in values),
+                dtype=np.int32, count=len(utts))
+            return list(vocab.keys()), ids
+
+        speakers, utt2spk = _intern(corpus.utt2spk[utt] for utt in utts)
+        wavs, utt2wav = _intern(corpus.segments[utt][0] for utt in utts)
+
+        def _time(t):
+            return np.nan if t is None else t
+
+        start = np.fromiter(
+            (_time(corpus.segments[utt][1]) for utt in utts),
+            dtype=np.float64, count=len(utts))
+        stop = np.fromiter(
+            (_time(corpus.segments[utt][2]) for utt in utts),
+            dtype=np.float64, count=len(utts))
+
+        # text as compressed sparse rows of word ids
+        tokens = [corpus.text[utt].split() for utt in utts]
+        text_indptr = np.zeros(len(utts) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in tokens], out=text_indptr[1:])
+        vocab = {}
+        text_words = np.fromiter(
+            (vocab.setdefault(w, len(vocab)) for t in tokens for w in t),
+            dtype=np.int32, count=int(text_indptr[-1]))
+
+        return cls(utts, speakers, wavs, list(vocab.keys()),
+                   utt2spk, utt2wav, start, stop, text_indptr, text_words)
+
+    def __len__(self):
+        return len(self.utts)
+
+    def index(self, utt_ids):
+        """Return the array of indices of the utterances `utt_ids`
+
+        Raise KeyError if an utterance is not in the columns.
+
+        """
+        return np.fromiter(
+            (self.utt_index[utt] for utt in utt_ids), dtype=np.int64)
+
+    def subset(self, utt_ids):
+        """Return the columns restricted to the utterances `utt_ids`
+
+        Raise KeyError if an utterance is not in the columns.
+
+        """
+        index = np.sort(self.index(utt_ids))
+
+        # gather the text rows of the selected utterances
+        lengths = np.diff(self.text_indptr)[index]
+        text_indptr = np.zeros(len(index) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=text_indptr[1:])
+        offsets = np.repeat(
+            self.text_indptr[index] - text_indptr[:-1], lengths)
+        text_words = self.text_words[
+            np.arange(text_indptr[-1], dtype=np.int64) + offsets]
+
+        return CorpusColumns(
+            [self.utts[i] for i in index],
+            self.speakers, self.wavs, self.words,
+            self.utt2spk[index], self.utt2wav[index],
+            self.start[index], self.stop[index],
+            text_indptr, text_words)
+
+    def text_of(self, i):
+        """Return the text of the utterance at index `i` as a str"""
+        words = self.text_words[self.text_indptr[i]:self.text_indptr[i+1]]
+        return ' '.join(self.words[w] for w in words)
+
+    def segment_of(self, i):
+        """Return the segment of the utterance at index `i` as a tuple"""
+        start, stop = self.start[i], self.stop[i]
+        return (self.wavs[self.utt2wav[i]],
+                None if np.isnan(start) else float(start),
+                None if np.isnan(stop) else float(stop))
+
+    def spk2utt(self):
+        """Return a dict of speakers mapped to a list of utterances"""
+        return self._group(self.utt2spk, self.speakers)
+
+    def wav2utt(self):
+        """Return a dict of wavs mapped to (utt-id, tstart, tend) tuples"""
+        utts = self._group(self.utt2wav, self.wavs, index=True)
+        return {wav: [(self.utts[i],) + self.segment_of(i)[1:]
+                      for i in index]
+                for wav, index in utts.items()}
+
+    def words_set(self):
+        """Return the set of words used in the text"""
+        return {self.words[w] for w in np.unique(self.text_words)}
+
+    def _group(self, ids, vocab, index=False):
+        """Return a dict vocab[id] -> utterances, in one sort of `ids`"""
+        order = np.argsort(ids, kind='stable')
+        keys, starts = np.unique(ids[order], return_index=True)
+        groups = np.split(order, starts[1:])
+        if index:
+            return {vocab[k]: g for k, g in zip(keys, groups)}
+        return {vocab[k]: [self.utts[i] for i in g]
+                for k, g in zip(keys, groups)}
+
+
+class _ColumnsView(collections.abc.Mapping):
+    """Read-only dict-like view on CorpusColumns, indexed by utt-ids
+
+    As a view never changes, its version (see CorpusDict) is fixed.
+    The concrete views implement __getitem__.
+
+    """
+    def __init__(self, columns):
+        self.columns = columns
+        self.version = next_version()
+
+    def __iter__(self):
+        return iter(self.columns.utts)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class SegmentsView(_ColumnsView):
+    """View on CorpusColumns as a dict utt-id -> (wav, tbegin, tend)"""
+    def __getitem__(self, utt):
+        return self.columns.segment_of(self.columns.utt_index[utt])
+
+
+class TextView(_ColumnsView):
+    """View on CorpusColumns as a dict utt-id -> text"""
+    def __getitem__(self, utt):
+        return self.columns.text_of(self.columns.utt_index[utt])
+
+
+class Utt2SpkView(_ColumnsView):
+    """View on CorpusColumns as a dict utt-id -> speaker"""
+    def __getitem__(self, utt):
+        return self.columns.speakers[
+            self.columns.utt2spk[self.columns.utt_index[utt]]]
@@ -0,0 +1,87 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the CorpusDict class, a dict tracking its modifications"""
+
+import itertools
+
+
+_versions = itertools.count()
+
+
+def next_version():
+    """Return a version number never returned before in this process"""
+    return next(_versions)
+
+
+class CorpusDict(dict):
+    """A dict with a version number changed on each modification
+
+    The version is unique among all the CorpusDict instances of the
+    process: two equal versions mean the same dict, unmodified in
+    between. This allows the Corpus class to detect the
+    modifications of its dicts in constant time, to keep its index up
+    to date (see CorpusIndex) and to skip the validation checks on
+    unchanged data (see CorpusValidation).
+
+    A copy or an unpickled CorpusDict has a new version.
+
+    """
+    def __init__(self, *args, **kwargs):
+        super(CorpusDict, self).__init__(*args, **kwargs)
+        self.version = next_version()
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def copy(self):
+        return self.__class__(self)
+
+    def _modified(self):
+        self.version = next_version()
+
+    def __setitem__(self, key, value):
+        super(CorpusDict, self).__setitem__(key, value)
+        self._modified()
+
+    def __delitem__(self, key):
+        super(CorpusDict, self).__delitem__(key)
+        self._modified()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        super(CorpusDict, self).clear()
+        self._modified()
+
+    def pop(self, *args):
+        value = super(CorpusDict, self).pop(*args)
+        self._modified()
+        return value
+
+    def popitem(self):
+        item = super(CorpusDict, self).popitem()
+        self._modified()
+        return item
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        super(CorpusDict, self).update(*args, **kwargs)
+        self._modified()
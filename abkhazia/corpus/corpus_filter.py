@@ -54,11 +54,10 @@ class CorpusFilter(object):
         self.log = log
         self.corpus = corpus
 
-        # read utt2spk from the input corpus
-        utt_ids, utt_speakers = zip(*self.corpus.utt2spk.items())
-        self.utts = zip(utt_ids, utt_speakers)
-        self.size = len(utt_ids)
-        self.speakers = set(utt_speakers)
+        # group the utterances by speaker
+        self.spk2utt = self.corpus.spk2utt()
+        self.size = len(self.corpus.utt2spk)
+        self.speakers = set(self.spk2utt.keys())
         self.limits = dict()
         self.gender = dict()
         self.spk2utts = dict()
@@ -75,22 +74,12 @@ class CorpusFilter(object):
            If plot=True, a plot of the speech duration
            distribution and of the cutting function will be displayed.
         """
-        utt2spk = self.corpus.utt2spk
-        utt2dur = self.corpus.utt2duration()
-        spkr2dur = dict()
         self.log.info('sorting speaker by the total duration of speech')
 
         # Sort Speech duration from longest to shortest
-        spk2utts_temp = defaultdict(list)
-        spk2utts = defaultdict(list)
-
-        for spkr in self.speakers:
-            spkr2dur[spkr] = sum([utt2dur[utt_id]
-                                  for utt_id in utt2spk
-                                  if utt2spk[utt_id] == spkr])
-        sorted_speaker = sorted(spkr2dur.items(),
-                                key=lambda k, v: (v, k))
-        sorted_speaker.reverse()
+        sorted_speaker = sorted(self.corpus.spk2duration().items(),
+                                key=lambda x: (x[1], x[0]),
+                                reverse=True)
 
         # For the LibriSpeech corpus, read SPEAKER.TXT to find the genders :
         # male=set()
@@ -162,20 +151,14 @@ class CorpusFilter(object):
         """
         utt2dur = self.corpus.utt2duration()
         utt_ids = []
+        kept_utt_set = set()
         spk2utts = defaultdict(list)
         not_kept_utts = defaultdict(list)
 
-        # for each speaker, list utterances
-        #for utt,spkr in self.utts:
-        #    spk2utts[spkr].append(utt)
-
-        spk2utts_temp = defaultdict(list)
-        for utt, spkr in self.utts:
-            utt_start = self.corpus.segments[utt][1]
-            spk2utts_temp[spkr].append([utt, utt_start])
-        for spkr in self.speakers:
-            spk2utts_temp[spkr] = sorted(spk2utts_temp[spkr], key=lambda x: x[1])
-            spk2utts[spkr] = [utt for utt, utt_start in spk2utts_temp[spkr]]
+        # for each speaker, list utterances sorted by start time
+        for spkr, utts in self.spk2utt.items():
+            spk2utts[spkr] = sorted(
+                utts, key=lambda utt: self.corpus.segments[utt][1])
 
         # create lists of utterances we want to keep,
         # utterances we don't want to keep
@@ -202,37 +185,19 @@ class CorpusFilter(object):
 
                 if time < limits[speaker] or nb_utt < 10:
                     utt_ids.append(utts)
+                    kept_utt_set.add(utts)
                     nb_utt += 1
                 else:
                     nb_utt = 0
                     time = 0
                     break
 
-            kept_utt_set = set(utt_ids)
-
-            # here we build the list of utts we remove,
-            # and we adjust the boundaries of
-            # the other utterances, in order to have correct timestamps
-            offset = 0
-            for utt in spk2utts[speaker]:
-                # for each wav, we compute the cumsum
-                # of the lengths of the utts we remove
-                # in order to have correct timestamps
-                # for the other utts in the files
-                wav_id, utt_tbegin, utt_tend = self.corpus.segments[utt]
-
-                if utt_tbegin-offset < 0 or utt_tend-offset < 0:
-
-                    self.log.info('''WARN : offset is greater'''
-                                  '''than utterance boundaries''')
-                if utt not in kept_utt_set:
-
-                    offset = offset + utt2dur[utt]
-                    not_kept_utts[speaker].append(
-                        (utt, self.corpus.segments[utt]))
-                else:
-                    self.corpus.segments[utt] = (
-                        wav_id, utt_tbegin - offset, utt_tend - offset)
+            # here we build the list of utts we remove, their
+            # timestamps are removed from the wavs by CorpusTrimmer,
+            # which adjusts the boundaries of the other utterances
+            not_kept_utts[speaker] = [
+                (utt, self.corpus.segments[utt])
+                for utt in spk2utts[speaker] if utt not in kept_utt_set]
 
         return(self.corpus.subcorpus(
             utt_ids, prune=True,
@@ -248,7 +213,6 @@ class CorpusFilter(object):
         time = 0
         utt_ids = []
         spk2utts = self.spk2utts
-        utt2dur = self.utt2dur
         not_kept_utts = defaultdict(list)
         corpus = self.corpus
 
@@ -278,31 +242,14 @@ class CorpusFilter(object):
                              utt.split('_')[1]) <= limit_out2]
             utt_ids = utt_ids + kept_utts
 
-        # here we build the list of utts we remove, and we adjust the
-        # boundaries of the other utterancess, in order to have correct
-        # timestamps
+        # here we build the list of utts we remove, their timestamps
+        # are removed from the wavs by CorpusTrimmer, which adjusts
+        # the boundaries of the other utterances
+        kept_utt_set = set(utt_ids)
         for speaker in names:
-            offset = 0
-            for utt in spk2utts[speaker]:
-                # for each wav, we compute the cumsum of the lengths of the
-                # utts we remove in order to have correct timestamps for the
-                # other utts in the files
-                wav_id, utt_tbegin, utt_tend = corpus.segments[utt]
-                corpus.segments[utt] = (wav_id,
-                                        utt_tbegin - offset,
-                                        utt_tend - offset)
-
-                if utt_tbegin - offset < 0 or utt_tend - offset < 0:
-                    print(utt_tbegin)
-                    print(offset)
-                    print(utt_tend)
-                    print(offset)
-                    self.log.info(
-                            '''WARN : offset is greater'''
-                            ''' than utterance boundaries''')
-                if utt not in utt_ids:
-                    offset = offset + utt2dur[utt]
-                    not_kept_utts[speaker].append((utt, corpus.segments[utt]))
+            not_kept_utts[speaker] = [
+                (utt, corpus.segments[utt]) for utt in spk2utts[speaker]
+                if utt not in kept_utt_set]
 
         return(self.corpus.subcorpus(
                     utt_ids, prune=True, name=function, validate=True),
@@ -0,0 +1,84 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the CorpusIndex class, grouping utterances of a corpus"""
+
+
+class CorpusIndex(object):
+    """Utterances of a corpus grouped by speaker and by wav
+
+    The index is built in a single pass over utt2spk and segments and
+    is cached by the Corpus class (see Corpus.index), so that the
+    classes iterating over speakers or wavs (CorpusSplit,
+    CorpusFilter, CorpusMergeWavs) do not scan all the utterances for
+    each speaker.
+
+    spk2utt (dict): speakers mapped to the list of their utterances
+
+    wav2utt (dict): wavs mapped to the list of (utt-id, tstart, tend)
+      they contain
+
+    spk2wavs (dict): speakers mapped to the sorted list of their wavs
+
+    The speakers duration are computed on demand by spk2duration().
+
+    """
+    def __init__(self, spk2utt, wav2utt, spk2wavs):
+        self.spk2utt = spk2utt
+        self.wav2utt = wav2utt
+        self.spk2wavs = spk2wavs
+        self._spk2duration = None
+
+    @classmethod
+    def from_corpus(cls, corpus):
+        """Return the index of the utterances in `corpus`"""
+        columns = corpus._columns()
+        if columns is not None:
+            spk2utt = columns.spk2utt()
+            wav2utt = columns.wav2utt()
+        else:
+            spk2utt = {}
+            for utt, spk in corpus.utt2spk.items():
+                spk2utt.setdefault(spk, []).append(utt)
+
+            def _float(t):
+                return None if t is None else float(t)
+
+            wav2utt = {}
+            for utt, (wav, tstart, tend) in corpus.segments.items():
+                wav2utt.setdefault(wav, []).append(
+                    (utt, _float(tstart), _float(tend)))
+
+        spk2wavs = {}
+        for spk, utts in spk2utt.items():
+            # utterances missing in segments are left to the validation
+            spk2wavs[spk] = {corpus.segments[utt][0] for utt in utts
+                             if utt in corpus.segments}
+        spk2wavs = {spk: sorted(wavs) for spk, wavs in spk2wavs.items()}
+
+        return cls(spk2utt, wav2utt, spk2wavs)
+
+    def spk2duration(self, utt2duration):
+        """Return a dict of speakers mapped to their speech duration
+
+        `utt2duration` is a function returning the utterances
+        duration, called only on the first call.
+
+        """
+        if self._spk2duration is None:
+            utt2dur = utt2duration()
+            self._spk2duration = {
+                spk: sum(utt2dur[utt] for utt in utts)
+                for spk, utts in self.spk2utt.items()}
+        return self._spk2duration
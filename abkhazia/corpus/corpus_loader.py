@@ -16,6 +16,7 @@
 
 import os
 import abkhazia.utils as utils
+from abkhazia.corpus.corpus_cache import CorpusCache
 
 
 class CorpusLoader(object):
@@ -30,9 +31,13 @@ class CorpusLoader(object):
 
     @classmethod
     def load(cls, corpus_cls, corpus_dir,
-             validate=False, log=utils.logger.null_logger()):
+             validate=False, cache=True, log=utils.logger.null_logger()):
         """Return a corpus initialized from `corpus_dir`
 
+        If `cache` is True, the parsed corpus files are cached (see
+        CorpusCache) and a file is parsed again only
+        when it has been modified since the last load.
+
         Raise IOError if corpus_dir if an invalid abkhazia corpus
         directory.
 
@@ -40,18 +45,27 @@ class CorpusLoader(object):
         # get the corpus data files as dict basename -> abspath
         data = cls._load_corpus_dir(corpus_dir)
 
+        if cache:
+            _cache = CorpusCache(corpus_dir, log=log)
+
+            def _load(name, parser):
+                return _cache.load_file(data[name], parser)
+        else:
+            def _load(name, parser):
+                return parser(data[name])
+
         # init the corpus from data files
         corpus = corpus_cls()
         corpus.log = log
         corpus.meta = data['meta']
         corpus.wav_folder = data['wavs']
-        corpus.lexicon = cls.load_lexicon(data['lexicon'])
-        corpus.segments, corpus.wavs = cls.load_segments(data['segments'])
-        corpus.text = cls.load_text(data['text'])
-        corpus.phones = cls.load_phones(data['phones'])
-        corpus.silences = cls.load_silences(data['silences'])
-        corpus.utt2spk = cls.load_utt2spk(data['utt2spk'])
-        corpus.variants = cls.load_variants(data['variants'])
+        corpus.lexicon = _load('lexicon', cls.load_lexicon)
+        corpus.segments, corpus.wavs = _load('segments', cls.load_segments)
+        corpus.text = _load('text', cls.load_text)
+        corpus.phones = _load('phones', cls.load_phones)
+        corpus.silences = _load('silences', cls.load_silences)
+        corpus.utt2spk = _load('utt2spk', cls.load_utt2spk)
+        corpus.variants = _load('variants', cls.load_variants)
 
         if validate:
             corpus.validate()
@@ -23,11 +23,12 @@ Created on Wed Nov  1 04:38:30 2017
 
 
 import os
-import wave
-import contextlib
+
+import joblib
 import numpy as np
-import array
 
+import abkhazia.utils as utils
+from abkhazia.corpus.corpus_validation import CorpusValidation
 from abkhazia.utils import logger
 
 
@@ -56,27 +57,16 @@ class CorpusMergeWavs(object):
     def __init__(self, corpus, log=logger.null_logger()):
         self.log = log
         self.corpus = corpus
-        # read utt2spk from the input corpus
-        utt_ids, utt_speakers = zip(*self.corpus.utt2spk.items())
-        self.utts = zip(utt_ids, utt_speakers)
-        self.size = len(utt_ids)
-        self.speakers = set(utt_speakers)
+        # group the utterances by speaker
+        self.spk2utt = self.corpus.spk2utt()
+        self.size = len(self.corpus.utt2spk)
+        self.speakers = set(self.spk2utt.keys())
         self.segments = self.corpus.segments
         self.utt2dur = self.corpus.utt2duration()
         self.log.debug('loaded %i utterances from %i speakers',
                        self.size, len(self.speakers))
 
 
-    def get_wav_duration(self, wav):
-        with contextlib.closing(wave.open(wav, 'r')) as wav_file:
-            frames = wav_file.getnframes()
-            rate = wav_file.getframerate()
-        duration = frames / float(rate)
-        self.log.debug('wav file {} has a duration of {}'.format(wav,
-                                                                 duration))
-        return duration
-
-
     def get_per_spk_data(self):
         # get following corpus info per speaker:
         #   total duration
@@ -84,27 +74,24 @@ class CorpusMergeWavs(object):
         #   list of wav durs
         #   list of utts
         self.spk_data = {'total_dur': {}, 'wavs': {}, 'wav_durs': {}, 'utts': {}}
+        index = self.corpus.index()
+        spk2dur = index.spk2duration(lambda: self.utt2dur)
+        self.wavs_meta = self.corpus.wavs_metadata(
+            {w for wavs in index.spk2wavs.values() for w in wavs})
+
         for spkr in self.speakers:
-            spk_utts = [utt_id for utt_id, utt_speaker in self.utts
-                                if utt_speaker == spkr]
-            duration = sum([self.utt2dur[utt_id] for utt_id in spk_utts])
+            duration = spk2dur[spkr]
             self.spk_data['total_dur'][spkr] = duration
-            self.spk_data['utts'][spkr] = spk_utts
+            self.spk_data['utts'][spkr] = self.spk2utt[spkr]
             self.log.debug('for speaker {}, total duration is {}'.format(
                             spkr, duration/60))
-            wavs = [self.segments[utt][0]
-                        for utt in self.spk_data['utts'][spkr]]
-            # we want unique values in the list of wavs:
-            wavs = sorted(list(set(wavs)))
+            wavs = index.spk2wavs[spkr]
             self.spk_data['wavs'][spkr] = wavs
-            self.spk_data['wav_durs'][spkr] = []
-            for wav in wavs:
-                wav_path = os.path.join(self.corpus.wav_folder, wav)
-                duration = self.get_wav_duration(wav_path)
-                self.spk_data['wav_durs'][spkr].append(duration)
+            self.spk_data['wav_durs'][spkr] = [
+                self.wavs_meta[wav].duration for wav in wavs]
 
 
-    def merge_wavs(self, output_dir, padding=0.):
+    def merge_wavs(self, output_dir, padding=0., njobs=1):
         """
         Merge wav files to have 1 wav per speaker
         and modify accordingly segments to have correct
@@ -114,12 +101,23 @@ class CorpusMergeWavs(object):
 
         padding : duration of silence inserted between merged wave files
                   (in seconds)
+
+        njobs : number of speakers merged in parallel
+
+        The wavs are merged by blocks (see utils.wav.merge) so the
+        memory usage does not depend on the wavs duration. The
+        merged wavs durations and the segments are computed from the
+        input wavs headers.
         """
         # get input and output wav dir
         wav_output_dir = os.path.join(output_dir, 'wavs')
         wav_dir = self.corpus.wav_folder
         if not os.path.isdir(wav_dir):
             raise IOError('invalid corpus: {} not found'.format(wav_dir))
+        if self.corpus.wav_shards() is not None:
+            raise IOError(
+                'cannot merge packed wavs, save the corpus with '
+                'copy_wavs=True to unpack them first')
         if not os.path.isdir(wav_output_dir):
             os.makedirs(wav_output_dir)
 
@@ -131,11 +129,15 @@ class CorpusMergeWavs(object):
         for spkr in self.speakers:
             #the name of the final wave file will be spkr.wav (ex s01.wav)
             spk_wav_id = spkr + '.wav'
-            # offset for each wav of given speaker
-            wav_durs = [e+padding for e in self.spk_data['wav_durs'][spkr]]
-            cumdurs = list(np.cumsum(wav_durs))
-            expected_duration[spk_wav_id] = cumdurs[-1] - padding
-            offsets = {e : f for e, f in zip(self.spk_data['wavs'][spkr], [0]+cumdurs[:-1])}
+            # offset for each wav of given speaker, as a number of frames
+            wavs = self.spk_data['wavs'][spkr]
+            metas = [self.wavs_meta[wav] for wav in wavs]
+            rate = float(metas[0].rate)
+            pad_frames = int(round(metas[0].rate * padding))
+            frames = np.cumsum(
+                [0] + [m.nframes + pad_frames for m in metas])
+            expected_duration[spk_wav_id] = int(frames[-1] - pad_frames) / rate
+            offsets = {e: int(f) / rate for e, f in zip(wavs, frames[:-1])}
             for utt in self.spk_data['utts'][spkr]:
                 utt_wav = self.segments[utt][0]
                 offset = offsets[utt_wav]
@@ -152,53 +154,31 @@ class CorpusMergeWavs(object):
         # update segments in original corpus
         self.corpus.segments = self.segments
 
-        #merge the wavs
-        for spkr in self.speakers:
-            # create the list of waves we want to merge
-            wav_name = spkr + '.wav'
-            in_wavs = [os.path.join(self.corpus.wav_folder, wav)
-                        for wav in self.spk_data['wavs'][spkr]]
-            out_wav = os.path.join(wav_output_dir, wav_name)
-            # read in wavs
-            waveforms = []
-            prev_params = None
-            for wav in in_wavs:
-                with contextlib.closing(wave.open(wav, 'r')) as wav_file:
-                    (nchan, b, fs, n, comp_T, comp_N) = wav_file.getparams()
-                    waveform = wav_file.readframes(n)
-                if not(prev_params is None):
-                    assert prev_params == (nchan, b, fs, comp_T, comp_N)
-                prev_params = (nchan, b, fs, comp_T, comp_N)
-                waveforms.append(waveform)
-            # prepare zero padding
-            if padding > 0:
-                pad_frames = int(round(fs*padding))
-                assert b == 2
-                pad = array.array('h', [0]*pad_frames).tostring()
-            # write out wav
-            with contextlib.closing(wave.open(out_wav, 'w')) as wav_file:
-                wav_file.setparams((nchan, b, fs, 0, comp_T, comp_N))
-                for i, waveform in enumerate(waveforms):
-                    # writeframes also updates nbframes
-                    wav_file.writeframes(waveform)
-                    if padding > 0 and i+1 < len(waveforms):
-                        wav_file.writeframes(pad)
+        # merge the wavs, one speaker per job
+        speakers = sorted(self.speakers)
+        merged = joblib.Parallel(n_jobs=njobs)(
+            joblib.delayed(utils.wav.merge)(
+                [os.path.join(wav_dir, wav)
+                 for wav in self.spk_data['wavs'][spkr]],
+                os.path.join(wav_output_dir, spkr + '.wav'),
+                padding=padding)
+            for spkr in speakers)
+        meta = {spkr + '.wav': m for spkr, m in zip(speakers, merged)}
 
         # update wave set
         self.corpus.wav_folder = wav_output_dir
-        self.corpus.wavs = {spkr+'.wav' for spkr in self.speakers}
+        self.corpus.wavs = set(meta.keys())
 
         # check that created file length is what we expect
-        for wav in self.corpus.wavs:
-            wav_file = os.path.join(self.corpus.wav_folder, wav)
-            duration = self.get_wav_duration(wav_file)
-            print(duration)
-            print(expected_duration[wav])
-            assert abs(duration - expected_duration[wav]) < 1e-5, \
-                    "Unexpected merged file duration"
-
-        # validate the corpus
-        self.corpus.validate()
+        for wav, wav_meta in meta.items():
+            if abs(wav_meta.duration - expected_duration[wav]) > 1e-5:
+                raise IOError(
+                    'unexpected merged file duration for {}: {} != {}'.format(
+                        wav, wav_meta.duration, expected_duration[wav]))
+
+        # validate the corpus, the merged wavs metadata being known
+        CorpusValidation(
+            self.corpus, njobs=njobs, log=self.log).validate(meta=meta)
 
         # save corpus
         self.corpus.save(output_dir, no_wavs=True)  # wavs are already there
@@ -17,13 +17,15 @@
 import os
 import shutil
 
-from abkhazia.utils import open_utf8, append_ext, wav
+from abkhazia.utils import open_utf8, append_ext
+from abkhazia.corpus.corpus_shards import CorpusShards
 
 
 class CorpusSaver(object):
     """Save a corpus to a directory"""
     @classmethod
-    def save(cls, corpus, path, no_wavs=False, copy_wavs=True):
+    def save(cls, corpus, path, no_wavs=False, copy_wavs=True,
+             pack_wavs=False):
         """Save the `corpus` to the directory `path`
 
         `path` is assumed to be a non existing directory.
@@ -38,7 +40,7 @@ class CorpusSaver(object):
             return os.path.join(path, f)
 
         if not no_wavs:
-            cls.save_wavs(corpus, _path('wavs'), copy_wavs)
+            cls.save_wavs(corpus, _path('wavs'), copy_wavs, pack_wavs)
         cls.save_lexicon(corpus, _path('lexicon.txt'))
         cls.save_segments(corpus, _path('segments.txt'))
         cls.save_text(corpus, _path('text.txt'))
@@ -49,13 +51,15 @@ class CorpusSaver(object):
         corpus.meta.save(_path('meta.txt'))
 
     @staticmethod
-    def save_wavs(corpus, path, copy_wavs=False):
+    def save_wavs(corpus, path, copy_wavs=False, pack_wavs=False):
         """Save the corpus wavs in `path`
 
         `path` is assumed to be a non existing directory
 
-        If `copy_wavs` is True, copy the wavs in `path` else make
-        symlinks
+        If `pack_wavs` is True, copy the wavs in shards in `path` (see
+        CorpusShards), else if `copy_wavs` is True, copy the wavs in
+        `path` else make symlinks. Packed wavs are unpacked when
+        copied with `pack_wavs` False.
 
         :raise IOError: if `path` already exists
 
@@ -65,12 +69,23 @@ class CorpusSaver(object):
 
         # remove any trailing slash etc. for correct dirname behavior
         path = os.path.abspath(path)
-
-        if copy_wavs:
+        shards = corpus.wav_shards()
+
+        if pack_wavs:
+            if shards is not None:
+                sources = {w: shards.source(w) for w in corpus.wavs}
+            else:
+                sources = {w: CorpusShards.file_source(
+                    os.path.join(corpus.wav_folder, w)) for w in corpus.wavs}
+            CorpusShards.pack(sources, path)
+        elif copy_wavs:
             os.makedirs(path)
             for w in corpus.wavs:
-                wav = os.path.realpath(os.path.join(corpus.wav_folder, w))
-                shutil.copy(wav, os.path.join(path, w))
+                if shards is not None:
+                    shards.extract(w, os.path.join(path, w))
+                else:
+                    wav = os.path.realpath(os.path.join(corpus.wav_folder, w))
+                    shutil.copy(wav, os.path.join(path, w))
         else:
             source = os.path.realpath(corpus.wav_folder)
             link_name = path
@@ -90,6 +105,11 @@ class CorpusSaver(object):
         timestamps, create them with the value (0, wav_duration).
 
         """
+        if force_timestamps is True:
+            meta = corpus.wavs_metadata(
+                {append_ext(w, '.wav') for w, start, _ in
+                 corpus.segments.values() if start is None})
+
         with open_utf8(path, 'w') as out:
             for k, v in sorted(corpus.segments.items()):
                 # make sure we have the '.wav' extension
@@ -97,9 +117,7 @@ class CorpusSaver(object):
 
                 if v[1] is None:
                     if force_timestamps is True:
-                        # abs path to the wav file
-                        w = os.path.join(corpus.wav_folder, v[0])
-                        v = u'{} 0.0 {}'.format(v[0], wav.duration(w))
+                        v = u'{} 0.0 {}'.format(v[0], meta[v[0]].duration)
                     else:
                         v = v[0]
 
@@ -0,0 +1,214 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the CorpusShards class, a packed storage for wav files"""
+
+import collections
+import os
+
+import abkhazia.utils as utils
+from abkhazia.corpus.corpus_cache import CorpusCache
+
+
+class CorpusShards(object):
+    """Wav files of a corpus packed in a few large shard files
+
+    On corpora made of millions of short utterances, storing one file
+    per wav makes the metadata operations of the filesystem (open,
+    stat) dominate the processing time. In a packed wav folder, the
+    wav files are concatenated in shards of about `shard_size` bytes
+    and an index file maps each wav to its location as (shard, byte
+    offset, length).
+
+    The wavs are stored unchanged in the shards, so that a packed wav
+    is readable by Kaldi directly from its offset in the shard (see
+    rxfilename).
+
+    directory (str): the packed wav folder
+
+    index (dict): wav-ids mapped to (shard, offset, length), where
+      shard is a filename relative to `directory`
+
+    """
+    index_file = 'shards.txt'
+    """name of the index file in a packed wav folder"""
+
+    shard_size = 1 << 30
+    """approximative size of a shard in bytes"""
+
+    def __init__(self, directory, index):
+        self.directory = os.path.abspath(directory)
+        self.index = index
+
+    @classmethod
+    def is_packed(cls, directory):
+        """Return True if `directory` is a packed wav folder"""
+        return os.path.isfile(os.path.join(directory, cls.index_file))
+
+    @classmethod
+    def load(cls, directory, log=utils.logger.null_logger()):
+        """Return the packed wavs stored in `directory`
+
+        The parsed index is cached for the corpus (see CorpusCache).
+
+        Raise IOError if `directory` is not a packed wav folder.
+
+        """
+        path = os.path.join(directory, cls.index_file)
+        if not os.path.isfile(path):
+            raise IOError('{} is not a packed wav folder'.format(directory))
+
+        cache = CorpusCache(
+            os.path.dirname(os.path.abspath(directory)), log=log)
+        return cls(directory, cache.load_file(path, cls._load_index))
+
+    @staticmethod
+    def _load_index(path):
+        index = {}
+        for line in utils.open_utf8(path, 'r'):
+            wav, shard, offset, length = line.split()
+            index[wav] = (shard, int(offset), int(length))
+        return index
+
+    @classmethod
+    def pack(cls, sources, directory, shard_size=None):
+        """Pack the wavs in `sources` into the folder `directory`
+
+        sources (dict): wav-ids mapped to (path, offset, length), the
+          location of the wav to pack (see file_source and source)
+
+        directory (str): the packed wav folder to create, must not
+          exist
+
+        shard_size (int): approximative size of a shard in bytes,
+          default to CorpusShards.shard_size
+
+        Return the created CorpusShards instance.
+
+        Raise IOError if `directory` already exists.
+
+        """
+        if os.path.exists(directory):
+            raise IOError('Wav folder already exists {}'.format(directory))
+        os.makedirs(directory)
+        shard_size = shard_size or cls.shard_size
+
+        index = {}
+        fout, shards, size = None, [], 0
+        try:
+            for wav in sorted(sources):
+                path, offset, length = sources[wav]
+
+                # start a new shard when the current one is full
+                if fout is None or size + length > shard_size and size:
+                    if fout is not None:
+                        os.close(fout)
+                    shard = 'wavs-{:05d}.shard'.format(len(shards))
+                    shards.append(shard)
+                    fout = os.open(
+                        os.path.join(directory, shard),
+                        os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+                    size = 0
+
+                fin = os.open(path, os.O_RDONLY)
+                try:
+                    utils.wav.copy_range(fin, fout, offset, length)
+                finally:
+                    os.close(fin)
+
+                index[wav] = (shard, size, length)
+                size += length
+        finally:
+            if fout is not None:
+                os.close(fout)
+
+        # the index is written last, a partially packed folder is not
+        # detected as packed
+        path = os.path.join(directory, cls.index_file)
+        with utils.open_utf8(path, 'w') as out:
+            for wav, (shard, offset, length) in sorted(index.items()):
+                out.write(u'{} {} {} {}\n'.format(wav, shard, offset, length))
+
+        return cls(directory, index)
+
+    @staticmethod
+    def file_source(path):
+        """Return the (path, offset, length) source of a wav file"""
+        return os.path.realpath(path), 0, os.path.getsize(path)
+
+    def __contains__(self, wav):
+        return wav in self.index
+
+    def source(self, wav):
+        """Return the (path, offset, length) location of a packed wav
+
+        Raise KeyError if `wav` is not in the shards.
+
+        """
+        shard, offset, length = self.index[wav]
+        return os.path.join(self.directory, shard), offset, length
+
+    def extract(self, wav, output):
+        """Copy the packed `wav` to the file `output`"""
+        path, offset, length = self.source(wav)
+        fin = os.open(path, os.O_RDONLY)
+        try:
+            fout = os.open(
+                output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+            try:
+                utils.wav.copy_range(fin, fout, offset, length)
+            finally:
+                os.close(fout)
+        finally:
+            os.close(fin)
+
+    def rxfilename(self, wav, pipe=False):
+        """Return the Kaldi rxfilename of a packed wav for wav.scp
+
+        By default the wav is read by Kaldi from its offset in the
+        shard as 'shard:offset'. If `pipe` is True, the wav is
+        extracted from the shard by a dd command piped to Kaldi, for
+        tools not supporting offsets.
+
+        """
+        path, offset, length = self.source(wav)
+        if pipe:
+            return ('dd if={} iflag=skip_bytes,count_bytes skip={} '
+                    'count={} status=none |'.format(path, offset, length))
+        return '{}:{}'.format(path, offset)
+
+    def scan(self, wavs=None, njobs=1):
+        """Return a dict of packed wavs mapped to their meta information
+
+        This is the equivalent of utils.wav.scan() for packed wavs,
+        the shards are scanned in parallel and each one is opened only
+        once. The wavs not in the shards are ignored.
+
+        """
+        import joblib
+        wavs = self.index.keys() if wavs is None else wavs
+
+        by_shard = collections.defaultdict(list)
+        for wav in wavs:
+            if wav in self.index:
+                shard, offset, length = self.index[wav]
+                by_shard[shard].append((wav, offset, length))
+
+        meta = {}
+        for batch in joblib.Parallel(n_jobs=njobs)(
+                joblib.delayed(utils.wav.scan_members)(
+                    os.path.join(self.directory, shard), members)
+                for shard, members in by_shard.items()):
+            meta.update(batch)
+        return meta
@@ -16,6 +16,8 @@
 
 import configparser
 import random
+
+from abkhazia.corpus.corpus_validation import CorpusValidation
 from abkhazia.utils import logger, config
 
 
@@ -32,6 +34,11 @@ class CorpusSplit(object):
 
     prune : If True the train and testing corpora are pruned (default is True)
 
+    The kfold and multi_split methods compute several subcorpora from
+    a single shuffle of the corpus. The corpus wavs are validated once
+    and the returned subcorpora are compact views on the corpus (see
+    Corpus.compact).
+
     In the split and split_by_speakers methods, arguments are as follow:
 
         test_prop : float, should be between 0.0 and 1.0 and
@@ -58,14 +65,18 @@ class CorpusSplit(object):
             self.log.debug('random seed is %i', random_seed)
         random.seed(random_seed)
 
-        # read utt2spk from the input corpus
-        utt_ids, utt_speakers = zip(*self.corpus.utt2spk.items())
-        self.utts = list(zip(utt_ids, utt_speakers))
-        self.size = len(utt_ids)
-        self.speakers = set(utt_speakers)
+        # group the utterances by speaker
+        self.spk2utt = self.corpus.spk2utt()
+        self.size = len(self.corpus.utt2spk)
+        self.speakers = set(self.spk2utt.keys())
         self.log.debug('loaded %i utterances from %i speakers',
                        self.size, len(self.speakers))
 
+        # compact source corpus and wavs metadata, computed on demand
+        # by _subcorpus
+        self._source = None
+        self._meta = None
+
     @staticmethod
     def default_test_prop():
         """Return the default proportion for the test set
@@ -95,8 +106,7 @@ class CorpusSplit(object):
         train_utt_ids = []
         test_utt_ids = []
         for speaker in self.speakers:
-            spk_utts = [utt_id for utt_id, utt_speaker in self.utts
-                        if utt_speaker == speaker]
+            spk_utts = list(self.spk2utt[speaker])
 
             # if len(spk_utts) <= 1:
             #     self.log.warning(
@@ -161,18 +171,20 @@ class CorpusSplit(object):
         # assert we have no unknown speakers
         for speakers, message in (
                 (train_speakers, 'train_speakers'),
-                (train_speakers, 'train_speakers')):
+                (test_speakers, 'test_speakers')):
             unknown = [spk for spk in speakers if spk not in self.speakers]
             if unknown != []:
                 raise RuntimeError(
                     "The following speakers specified in {} "
                     "are not found in the corpus: {}".format(message, unknown))
 
+        train_speakers = set(train_speakers)
+        test_speakers = set(test_speakers)
+
         train_utt_ids = []
         test_utt_ids = []
         for speaker in self.speakers:
-            spk_utts = [utt_id for utt_id, utt_speaker in self.utts
-                        if utt_speaker == speaker]
+            spk_utts = self.spk2utt[speaker]
 
             if speaker in train_speakers:
                 train_utt_ids += spk_utts
@@ -191,6 +203,125 @@ class CorpusSplit(object):
         return (self.corpus.subcorpus(train_utt_ids, prune=self.prune),
                 self.corpus.subcorpus(test_utt_ids, prune=self.prune))
 
+    def multi_split(self, proportions, by_speakers=False, stratify_on=None):
+        """Split the corpus in several parts of given proportions
+
+        proportions : list of float, the proportion of the corpus in
+          each part. Their sum must be below or equal to 1, in that
+          case part of the corpus is ignored.
+
+        by_speakers : bool, if True the data of each speaker goes in
+          a single part, else each speaker is distributed among the
+          parts (as in the split method).
+
+        stratify_on : dict mapping the units to split (speakers if
+          by_speakers is True, utterances else) to a stratum. Each
+          stratum is distributed among the parts according to the
+          proportions. If None, utterances are stratified on their
+          speaker and speakers are not stratified.
+
+        Return a list of Corpus instances, one per proportion
+
+        """
+        if any(p < 0 or p > 1 for p in proportions):
+            raise RuntimeError('proportions must be in [0, 1]')
+        if sum(proportions) > 1 + 1e-9:
+            raise RuntimeError('sum of proportions is > 1')
+
+        parts = [[] for _ in proportions]
+        for units in self._strata(by_speakers, stratify_on):
+            start = 0
+            cumulated = 0
+            for part, proportion in zip(parts, proportions):
+                cumulated += proportion
+                stop = int(round(len(units) * cumulated))
+                part += units[start:stop]
+                start = stop
+
+        return [self._subcorpus(self._utterances(part, by_speakers))
+                for part in parts]
+
+    def kfold(self, k, by_speakers=True, stratify_on=None):
+        """Return a generator of k pairs (train, testing) for a k-fold
+        cross-validation
+
+        The corpus is split in k folds of nearly equal size. The
+        i-th testing corpus is the i-th fold and the i-th train corpus
+        is made of the others folds. The folds are computed on call,
+        the subcorpora are built when iterating on the generator.
+
+        by_speakers and stratify_on are as in multi_split. The units
+        of each stratum are dealt in turn to the folds, so that both
+        the folds and the strata are balanced.
+
+        Raise RuntimeError if k < 2, on call and not at the first
+        iteration.
+
+        """
+        if k < 2:
+            raise RuntimeError(
+                'number of folds must be greater than 1, it is {}'.format(k))
+
+        folds = [[] for _ in range(k)]
+        index = 0
+        for units in self._strata(by_speakers, stratify_on):
+            for unit in units:
+                folds[index % k].append(unit)
+                index += 1
+
+        folds = [self._utterances(fold, by_speakers) for fold in folds]
+
+        def _folds():
+            for i, fold in enumerate(folds):
+                self.log.debug('fold %i: %i utterances', i + 1, len(fold))
+                train = [utt for j, other in enumerate(folds) if j != i
+                         for utt in other]
+                yield self._subcorpus(train), self._subcorpus(fold)
+
+        return _folds()
+
+    def _strata(self, by_speakers, stratify_on):
+        """Return the shuffled units to split, grouped by stratum"""
+        if by_speakers:
+            units = sorted(self.speakers)
+            if stratify_on is None:
+                stratify_on = {}
+        else:
+            units = sorted(self.corpus.utt2spk.keys())
+            if stratify_on is None:
+                stratify_on = self.corpus.utt2spk
+
+        random.shuffle(units)
+        strata = {}
+        for unit in units:
+            strata.setdefault(stratify_on.get(unit), []).append(unit)
+        return list(strata.values())
+
+    def _utterances(self, units, by_speakers):
+        """Return the list of utterances in `units`"""
+        if not by_speakers:
+            return units
+        return [utt for spk in units for utt in self.spk2utt[spk]]
+
+    def _subcorpus(self, utt_ids):
+        """Return a subcorpus validated from the wavs metadata of the corpus
+
+        The wavs are scanned only once to validate the corpus, the
+        subcorpora are validated from the obtained metadata.
+
+        """
+        if self._source is None:
+            self._meta = CorpusValidation(
+                self.corpus, log=self.log).validate()
+            self._source = (self.corpus.compact()
+                            if self.corpus._columns() is None
+                            else self.corpus)
+
+        corpus = self._source.subcorpus(
+            utt_ids, prune=self.prune, validate=False)
+        CorpusValidation(corpus, log=self.log).validate(meta=self._meta)
+        return corpus
+
     def _proportions(self, train_prop, test_prop):
         """Return 'regularized' proportions of test and train data
 
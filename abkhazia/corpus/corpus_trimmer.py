@@ -16,16 +16,12 @@
 
 import os
 import shutil
-import subprocess
-import shlex
-import sys
-import wave
-import contextlib
 
-from itertools import *
-from operator import itemgetter, attrgetter, methodcaller
-from collections import defaultdict
-from abkhazia.utils import open_utf8, logger
+import joblib
+import numpy as np
+
+import abkhazia.utils as utils
+from abkhazia.utils import logger
 
 
 class CorpusTrimmer(object):
@@ -38,36 +34,33 @@ class CorpusTrimmer(object):
         'corpus' is an instance of Corpus'
 
         'not_kept_utts' is a dictionnary of the form :
-        not_kept_utts=(speaker :[(utt1,wav_id,start_time,stop_time),
-        (utt1,wav_id,start_time,stop_time)...])
+        not_kept_utts=(speaker :[(utt1, (wav_id, start_time, stop_time)),
+        (utt2, (wav_id, start_time, stop_time))...])
         """
         self.log = log
         self.corpus = corpus
 
-        utt_ids, utt_speakers = zip(*self.corpus.utt2spk.items())
-        self.utts = zip(utt_ids, utt_speakers)
-        self.speakers = set(utt_speakers)
-
-    def trim(self, corpus_dir, output_dir, function, not_kept_utts):
+    def trim(self, corpus_dir, output_dir, function, not_kept_utts,
+             njobs=1):
         """Given a corpus and a list of utterances, this
-        method removes the utterances in the list from the wavs,
-        from segments, from the text and from utt2spk
+        method removes the utterances in the list from the wavs
+        and updates the segments accordingly
+
+        The trimmed wavs are written in
+        `output_dir`/`function`/data/wavs, the wavs with nothing to
+        remove are copied. The corpus wav_folder and segments are
+        updated in place.
+
+        The wavs are trimmed in parallel by `njobs` jobs, copying only
+        the kept parts of the audio data (see utils.wav.trim).
         """
-        # return error if sox is not installed
-        try:
-            subprocess.check_output(shlex.split('which sox'))
-        except:
-            raise OSError('sox is not installed on your system')
-
-        spk2utts = defaultdict(list)
-        for utt, spkr in self.utts:
-            spk2utts[spkr].append(utt)
-
-        # get input and output wav paths
-        corpus_dir = os.path.abspath(corpus_dir)
         wav_dir = self.corpus.wav_folder
         if not os.path.isdir(wav_dir):
-            raise IOError('invalid corpus: not found{}'.format(path))
+            raise IOError('invalid corpus: not found {}'.format(wav_dir))
+        if self.corpus.wav_shards() is not None:
+            raise IOError(
+                'cannot trim packed wavs, save the corpus with '
+                'copy_wavs=True to unpack them first')
 
         output_dir = os.path.abspath(output_dir)
         output_dir = os.path.join(output_dir, function)
@@ -75,81 +68,79 @@ class CorpusTrimmer(object):
         if not os.path.isdir(output_wav_dir):
             os.makedirs(output_wav_dir)
 
-        # remove utterances from the wavs using sox
-        for speaker in self.speakers:
-            print(speaker)
-            utt_to_remove = not_kept_utts[speaker]
-
-            # if speaker doesn't have utt to remove, copy file
-            if utt_to_remove == []:
-                wavs_to_copy = set([self.corpus.segments[utt][0] for
-                                    utt in spk2utts[speaker]])
-                for wav in wavs_to_copy:
-                    wav_name = '.'.join([wav, 'wav'])
-                    wav_input_path = '/'.join([wav_dir, wav_name])
-                    wav_output_path = '/'.join([output_wav_dir, wav_name])
-
-                    shutil.copyfile(wav_input_path, wav_output_path)
-
-            # don't trim utterances for wave file that won't be kept at all
-            wav_ids = [os.path.splitext(w)[0] for w in self.corpus.wavs]
-            wavs_output = [(wav_id, start, stop)
-                           for utt_id, (wav_id, start, stop)
-                           in utt_to_remove if wav_id in wav_ids]
-
-            wavs_start_dict = defaultdict(list)
-            wavs_stop_dict = defaultdict(list)
-            wavs_duration_dict = defaultdict(list)
-            for wav_id, start, stop in wavs_output:
-                wavs_start_dict[wav_id].append(start)
-                wavs_stop_dict[wav_id].append(stop)
-                wavs_duration_dict[wav_id].append(stop - start)
-
-            for wav in wavs_start_dict:
-                # start removing utterances at the end
-                # and finish at the begining : removing an utterance at the
-                # end doesn't affect the other utterances timestamps !
-                wavs_starts_temp = sorted(wavs_start_dict[wav], reverse=True)
-                wavs_stop_temp = sorted(wavs_stop_dict[wav], reverse=True)
-
-                wav_name = '.'.join([wav, 'wav'])
-                wav_input_path = '/'.join([wav_dir, wav_name])
-                wav_output_path = '/'.join([output_wav_dir, wav_name])
-
-                # Create string of timestamps to remove to pass as
-                # arguments to sox
-                timestamps = ''
-                for start, stop in zip(wavs_starts_temp, wavs_stop_temp):
-                    times = '=' + str(start) + ' ' + '=' + str(stop)
-                    timestamps = ' '.join([times, timestamps])
-
-                # call sox to trim part of the signal
-                list_command = ['sox', wav_input_path,
-                                wav_output_path, 'trim 0', timestamps]
-
-                command = ' '.join(list_command)
-                process = subprocess.Popen(
-                        shlex.split(command), stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE)
-                stdout, stderr = process.communicate()
-                if stdout:
-                    self.log.debug(stdout)
-                if stderr:
-                    self.log.debug(stderr)
-
-                self.log.debug(
-                        '''for wav {wav_id}, {duration} seconds'''
-                        '''should have been trimmed'''.format(
-                            wav_id=wav, duration=sum(wavs_duration_dict[wav])))
-
-                # if the output file is empty, remove it
-                with contextlib.closing(
-                        wave.open(wav_output_path, 'r')) as wav_file:
-                    frames = wav_file.getnframes()
-
-                self.log.debug('checking length of output trimmed file')
-                if frames == 0:
-                    self.log.debug(
-                            'removing empty file : {wav_id}'.format(
-                                wav_id=wav_output_path))
-                    os.remove(wav_output_path)
+        # time intervals to remove for each wav, don't trim
+        # utterances for wave file that won't be kept at all
+        ranges = {}
+        for utts in not_kept_utts.values():
+            for _, (wav, start, stop) in utts:
+                if wav in self.corpus.wavs:
+                    ranges.setdefault(wav, []).append((start, stop))
+
+        # if a wav doesn't have utt to remove, copy file
+        for wav in self.corpus.wavs:
+            if wav not in ranges:
+                shutil.copyfile(os.path.join(wav_dir, wav),
+                                os.path.join(output_wav_dir, wav))
+
+        wavs = sorted(ranges.keys())
+        trimmed = joblib.Parallel(n_jobs=njobs)(
+            joblib.delayed(utils.wav.trim)(
+                os.path.join(wav_dir, wav),
+                os.path.join(output_wav_dir, wav),
+                ranges[wav])
+            for wav in wavs)
+
+        # shift the remaining utterances by the duration removed
+        # before them
+        wav2utt = self.corpus.wav2utt()
+        segments = dict(self.corpus.segments)
+        for wav, (meta, removed) in zip(wavs, trimmed):
+            self.log.debug(
+                'for wav %s, %s seconds have been trimmed', wav,
+                sum(stop - start for start, stop in removed) / meta.rate)
+
+            if meta.nframes == 0:
+                self.log.debug('removing empty file : %s', wav)
+                os.remove(os.path.join(output_wav_dir, wav))
+                continue
+
+            utts = wav2utt.get(wav, [])
+            if removed and utts:
+                for (utt, _, _), start, stop in zip(utts, *self._shift(
+                        removed, meta.rate,
+                        [(start, stop) for _, start, stop in utts])):
+                    segments[utt] = (wav, start, stop)
+
+        self.corpus.wav_folder = output_wav_dir
+        self.corpus.segments = segments
+
+    @staticmethod
+    def _shift(removed, rate, times):
+        """Return the (starts, stops) `times` once `removed` frames cut
+
+        `removed` is a sorted list of non overlapping frame intervals,
+        `times` a list of (start, stop) in seconds (None stands for
+        the wav boundaries and is left unchanged).
+
+        """
+        removed = np.asarray(removed, dtype=np.float64) / rate
+        cumulated = np.concatenate(
+            ([0], np.cumsum(removed[:, 1] - removed[:, 0])))
+
+        def _shifted(t):
+            # removed duration before t, the interval containing t
+            # (if any) being partially counted
+            index = np.searchsorted(removed[:, 0], t, side='right')
+            partial = np.where(
+                index > 0,
+                np.maximum(removed[np.maximum(index - 1, 0), 1] - t, 0), 0)
+            return t - cumulated[index] + partial
+
+        result = []
+        for column in zip(*times):
+            values = np.array(
+                [np.nan if t is None else t for t in column], dtype=np.float64)
+            shifted = _shifted(values)
+            result.append([None if t is None else float(s)
+                           for t, s in zip(column, shifted)])
+        return result
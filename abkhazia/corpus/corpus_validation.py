@@ -15,9 +15,14 @@
 """Provides the CorpusValidation class"""
 
 import collections
+import collections.abc
+import datetime
 import os
 
-from abkhazia.utils import duplicates, logger, wav, default_njobs
+import numpy as np
+
+from abkhazia.utils import duplicates, logger, default_njobs
+from abkhazia.corpus.corpus_cache import CorpusCache
 
 
 def resume_list(l, n=10):
@@ -28,6 +33,53 @@ def resume_list(l, n=10):
         ' ... and {} more.'.format(len(l) - n))
 
 
+Overlap = collections.namedtuple(
+    'Overlap', ['wav', 'utt1', 'utt2', 'duration'])
+"""Two utterances overlapping in time within a wav, duration in seconds"""
+
+
+def find_overlaps(wav_ids, starts, stops):
+    """Return the pairs of intervals overlapping in time
+
+    The intervals [starts[i], stops[i]] are in the wav wav_ids[i],
+    all the arguments are numpy arrays of the same length, wav_ids
+    being integers. Two intervals overlap if they are in the same wav
+    and share more than a single point.
+
+    This is a sort-and-sweep: once the intervals sorted by (wav,
+    start), the intervals overlapping the interval i are the ones
+    following it in the order up to the first one starting after
+    stops[i]. That bound is found for all intervals at once by
+    sorting the stops along with the starts.
+
+    Return a tuple (i, j, duration) of numpy arrays, such as the
+    intervals i[k] and j[k] overlap for duration[k] seconds, with
+    starts[i[k]] <= starts[j[k]].
+
+    """
+    size = len(starts)
+    order = np.lexsort((starts, wav_ids))
+
+    # rank the stops among the starts, a stop sorts before an equal
+    # start as touching intervals do not overlap
+    merged = np.lexsort((
+        np.repeat([0, 1], size),
+        np.concatenate((stops[order], starts[order])),
+        np.concatenate((wav_ids[order], wav_ids[order]))))
+    is_stop = merged < size
+    end = np.empty(size, dtype=np.int64)
+    end[merged[is_stop]] = np.cumsum(~is_stop)[is_stop]
+
+    # enumerate the pairs (k, l) with k < l < end[k] in sorted order
+    counts = np.maximum(end - np.arange(size) - 1, 0)
+    first = np.repeat(np.arange(size), counts)
+    second = first + 1 + np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts, counts)
+
+    i, j = order[first], order[second]
+    return i, j, np.minimum(stops[i], stops[j]) - starts[j]
+
+
 class CorpusValidation(object):
     """Check and correct a speech corpus
 
@@ -50,6 +102,10 @@ class CorpusValidation(object):
     validate(). If you want a fine-grained validation, use the
     specialized validate_SOMETHING() methods.
 
+    After validate_segments(), the `overlaps` attribute is the list
+    of utterances overlapping in time (as Overlap tuples). Overlaps
+    are not an error, they only issue a warning.
+
     """
     wav_min_duration = 0.1
     """minimal duration for utterances
@@ -64,8 +120,9 @@ class CorpusValidation(object):
         self.corpus = corpus
         self.njobs = njobs
         self.log = log
+        self.overlaps = []
 
-    def validate(self, meta=None):
+    def validate(self, meta=None, force=False):
         """Validate the whole corpus
 
         Raise an IOError on the first detected error. If the function
@@ -79,37 +136,179 @@ class CorpusValidation(object):
         validation of splited corpora, which share the same wavs
         collection.
 
+        The validation is incremental: each successful check is
+        recorded in the corpus along with a fingerprint of the data it
+        depends on, and is skipped when that data is unchanged. The
+        corpus dicts are fingerprinted by their version (see
+        CorpusDict) so this costs nothing. The wavs are recorded with
+        their metainformation and their modification time and size, so
+        that only the wavs not yet validated or modified since are
+        scanned. A subcorpus copies the validation state of its parent:
+        the wavs validated by the parent are not scanned again and the
+        checks on data shared with the parent (such as the phones) are
+        skipped, but the dicts of the subcorpus are new, so the other
+        checks run again. If `force` is True, all the checks are done,
+        as well as the scan of all the wavs.
+
         """
         self.log.info('validating corpus')
         if not self.corpus.utts():
             raise IOError('corpus is empty')
 
-        if meta is None:
-            meta = self.validate_wavs()
-        self.validate_segments(meta)
-
-        self.validate_speakers()
-        self.validate_transcription()
+        state = self.corpus._validation
+        if force:
+            state.clear()
 
-        inventory = self.validate_phones()
-        self.validate_lexicon(inventory)
+        if meta is None:
+            meta = self._validate_wavs_delta(state)
+
+        corpus = self.corpus
+        self._check_once(
+            state, 'segments', lambda: (corpus.segments, corpus.wavs),
+            lambda: self.validate_segments(meta))
+        self._check_once(
+            state, 'speakers', lambda: (corpus.utt2spk, corpus.segments),
+            self.validate_speakers)
+        self._check_once(
+            state, 'transcription', lambda: (corpus.text, corpus.segments),
+            self.validate_transcription)
+        self._check_once(
+            state, 'phones', lambda: (
+                corpus.phones, corpus.silences, corpus.variants),
+            self.validate_phones, corrects=True)
+
+        inventory = set.union(
+            set(self.corpus.phones.keys()), set(self.corpus.silences))
+        self._check_once(
+            state, 'lexicon', lambda: (
+                corpus.lexicon, corpus.text, inventory),
+            lambda: self.validate_lexicon(inventory), corrects=True)
+
+        # compute the duration from the wavs metainformation rather
+        # than with corpus.duration() to avoid scanning the wavs again
+        duration = sum(
+            (meta[wav].duration if stop is None else stop) -
+            (0 if start is None else start)
+            for wav, start, stop in self.corpus.segments.values())
 
         self.log.debug("corpus validated: ready for use with abkhazia")
         self.log.info(
             "corpus of %d utterances from %s speakers, total duration: %s",
             len(self.corpus.utts()), len(self.corpus.spks()),
-            self.corpus.duration(format='datetime'))
+            str(datetime.timedelta(seconds=duration)).split('.')[0])
         return meta
 
-    def validate_wavs(self):
-        """Corpus wavs must be mono 16KHz, 16 bit PCM"""
+    def _validate_wavs_delta(self, state):
+        """Validate the wavs not yet validated, return their metainfo
+
+        The validated wavs are recorded in `state` as wav mapped to
+        (fingerprint, meta), a wav is validated again when its
+        fingerprint changed (see _wavs_fingerprint).
+
+        """
+        folder, validated = state.get('wavs', (None, {}))
+        if folder != self.corpus.wav_folder:
+            validated = {}
+
+        fingerprints = self._wavs_fingerprint(self.corpus.wavs)
+        delta = {w for w, fp in fingerprints.items()
+                 if fp is None or validated.get(w, (None,))[0] != fp}
+        if delta:
+            meta = self.validate_wavs(delta)
+            validated = dict(validated)
+            validated.update(
+                {w: (fingerprints[w], meta[w]) for w in delta})
+            state['wavs'] = (self.corpus.wav_folder, validated)
+        else:
+            self.log.debug("wavs already validated")
+
+        return {w: validated[w][1] for w in self.corpus.wavs}
+
+    def _wavs_fingerprint(self, wavs):
+        """Return the wavs mapped to their (mtime, size), None if missing
+
+        A packed wav is fingerprinted by its shard and its location in
+        the shard.
+
+        """
+        shards = self.corpus.wav_shards()
+        stats = {}
+
+        def _stat(path):
+            if path not in stats:
+                try:
+                    stats[path] = CorpusCache.fingerprint(path)
+                except OSError:
+                    stats[path] = None
+            return stats[path]
+
+        fingerprints = {}
+        for wav in wavs:
+            if shards is None:
+                fingerprints[wav] = _stat(
+                    os.path.join(self.corpus.wav_folder, wav))
+            elif wav in shards:
+                path, offset, length = shards.source(wav)
+                shard = _stat(path)
+                fingerprints[wav] = (
+                    None if shard is None else (shard, offset, length))
+            else:
+                fingerprints[wav] = None
+        return fingerprints
+
+    def _check_once(self, state, name, data, check, corrects=False):
+        """Call `check` only if `data()` changed since its last success
+
+        `data` is a function returning the data the check depends
+        on. If `corrects` is True the check may modify that data, so
+        its fingerprint is computed again after the check.
+
+        """
+        fingerprint = self._fingerprint(data())
+        if state.get(name) == fingerprint:
+            self.log.debug("%s already validated", name)
+            return
+
+        check()
+        state[name] = (self._fingerprint(data()) if corrects
+                       else fingerprint)
+
+    @staticmethod
+    def _fingerprint(data):
+        """Return a fingerprint of a tuple of dicts, sets and lists
+
+        The dicts with a version (see CorpusDict) are fingerprinted by
+        that version, the other data by an unordered hash.
+
+        """
+        def _one(d):
+            version = getattr(d, 'version', None)
+            if version is not None:
+                return 'version', version
+            if isinstance(d, collections.abc.Mapping):
+                return 'items', len(d), hash(frozenset(d.items()))
+            if isinstance(d, (set, frozenset)):
+                return 'set', len(d), hash(frozenset(d))
+            return 'list', tuple(d)
+
+        return tuple(_one(d) for d in data)
+
+    def validate_wavs(self, wavs=None):
+        """Corpus wavs must be mono 16KHz, 16 bit PCM
+
+        If `wavs` is specified, only those wavs are checked, else
+        check all the corpus wavs. Return metainformation on the
+        checked wavs.
+
+        """
         self.log.debug("checking wavs")
+        wav_ids = self.corpus.wavs if wavs is None else set(wavs)
 
         wav_folder = self.corpus.wav_folder
         if not(os.path.isdir(wav_folder)):
             raise IOError(
                 "Wav folder {} does not exist".format(wav_folder))
-        wavs = [os.path.join(wav_folder, w) for w in self.corpus.wavs]
+        wavs = [os.path.join(wav_folder, w) for w in wav_ids]
 
         # ensure all the files have the wav extension
         wrong_extensions = [w for w in wavs if not w.endswith(".wav")]
@@ -119,35 +318,43 @@ class CorpusValidation(object):
                 .format(resume_list(wrong_extensions)))
 
         # ensure all the wavs are here
-        not_here = [
-            w for w in wavs if not os.path.isfile(w)]
+        shards = self.corpus.wav_shards()
+        if shards is not None:
+            not_here = [os.path.join(wav_folder, w)
+                        for w in wav_ids if w not in shards]
+        else:
+            not_here = [w for w in wavs if not os.path.isfile(w)]
         if not_here:
             raise IOError(
                 "The following wavs do not exist: {}".format(
                     resume_list(not_here)))
 
         # get meta information on the wavs
-        meta = wav.scan(wavs, njobs=self.njobs)
-        meta = {os.path.basename(k): v for k, v in meta.items()}
+        meta = self.corpus.wavs_metadata(wav_ids, njobs=self.njobs)
 
-        missing_meta = set.difference(self.corpus.wavs, meta.keys())
+        missing_meta = set.difference(wav_ids, meta.keys())
         if missing_meta:
             raise IOError('Cannot retrieve metadata for the following '
                           'wavs: {}'.format(resume_list(missing_meta)))
 
-        empty_files = [w for w in self.corpus.wavs if meta[w].nframes == 0]
+        malformed = [meta[w].error for w in wav_ids if meta[w].error]
+        if malformed:
+            raise IOError("The following files are malformed: {}"
+                          .format(resume_list(malformed)))
+
+        empty_files = [w for w in wav_ids if meta[w].nframes == 0]
         if empty_files:
             raise IOError("The following files are empty: {}"
                           .format(resume_list(empty_files)))
 
-        weird_rates = [w for w in self.corpus.wavs if meta[w].rate != 16000]
+        weird_rates = [w for w in wav_ids if meta[w].rate != 16000]
         if weird_rates:
             raise IOError(
                 "Currently only files sampled at 16,000 Hz "
                 "are supported. The following files are sampled "
                 "at other frequencies: {0}".format(resume_list(weird_rates)))
 
-        non_mono = [w for w in self.corpus.wavs if meta[w].nbc != 1]
+        non_mono = [w for w in wav_ids if meta[w].nbc != 1]
         if non_mono:
             raise IOError(
                 "Currently only mono files are supported. "
@@ -155,7 +362,7 @@ class CorpusValidation(object):
                 "one channel: {0}".format(resume_list(non_mono)))
 
         # in bytes: 16 bit == 2 bytes
-        non_16bit = [w for w in self.corpus.wavs if meta[w].width != 2]
+        non_16bit = [w for w in wav_ids if meta[w].width != 2]
         if non_16bit:
             raise IOError(
                 "Currently only files encoded on 16 bits are "
@@ -163,8 +370,7 @@ class CorpusValidation(object):
                 "in this format: {0}"
                 .format(resume_list(non_16bit)))
 
-        compressed = [w for w in self.corpus.wavs
-                      if meta[w].comptype != 'NONE']
+        compressed = [w for w in wav_ids if meta[w].comptype != 'NONE']
         if compressed:
             raise IOError(
                 "The following files are compressed: {0}"
@@ -217,11 +423,16 @@ class CorpusValidation(object):
             # timestamps) associated to each wavefile and for each
             # wavefile, check consistency of the timestamps of all
             # utterances inside it
-            warning, short_wavs = self._check_timestamps(meta)
-            if warning:
+            self.overlaps, short_wavs = self._check_timestamps(meta)
+            if self.overlaps:
                 self.log.warning(
-                    "Some utterances are overlapping in time, "
-                    "see details in log file")
+                    "%s pairs of utterances are overlapping in time "
+                    "(%.2f seconds in total), see details in log file",
+                    len(self.overlaps),
+                    sum(o.duration for o in self.overlaps))
+                self.log.debug(
+                    "overlapping utterances (wav, utt1, utt2, duration): %s",
+                    resume_list(self.overlaps))
 
         if short_wavs:
             self.log.debug(
@@ -592,80 +803,66 @@ class CorpusValidation(object):
                 "in the transcriptions: {}".format(unused_phones))
 
     def _check_timestamps(self, meta):
-        """Check for utterances overlap and timestamps consistency"""
-        self.log.debug("checking timestamps consistency")
+        """Check for utterances overlap and timestamps consistency
 
-        short_utts = []
-        warning = False
-        for _wav, utts in self.corpus.wav2utt().items():
-            duration = meta[_wav].duration
-
-            # check all utterances are within wav boundaries
-            for utt_id, start, stop in utts:
-                if start == stop:
-                    raise IOError(
-                        'utterance {} have a duration of 0'.format(utt_id))
-
-                if not (start >= 0 and stop >= 0 and start <= stop and
-                        start <= duration + (1.0/16000) and
-                        stop <= duration + (1.0/16000)):
-                    raise IOError(
-                        "utterance {} is not whithin boudaries in wav {} "
-                        "({} not in {})"
-                        .format(utt_id, _wav,
-                                '[{}, {}]'.format(start, stop),
-                                '[0, {}]'.format(duration)))
-
-                if stop - start < self.wav_min_duration:  # .015:
-                    short_utts.append(utt_id)
-
-            # then check if there is overlap in time between the
-            # different utterances and if there is, issue a
-            # warning (not an error)
-            wav_starts = [start for _, start, _ in utts]
-            counts = collections.Counter(wav_starts)
-            same_start = {}
-            for start in counts:
-                if counts[start] > 1:
-                    same_start[start] = [
-                        utt for utt, sta, _ in utts if sta == start]
-
-            wav_stops = [stop for _, _, stop in utts]
-            counts = collections.Counter(wav_stops)
-            same_stop = {}
-            for stop in counts:
-                if counts[stop] > 1:
-                    same_stop[stop] = [
-                        utt for utt, _, sto in utts if sto == stop]
-
-            if same_start:
-                warning = True
-                self.log.warning(
-                    "The following utterances start at the same time "
-                    "in wavefile {}: {}".format(_wav, sorted(same_start)))
+        Raise IOError if an utterance is empty or not within its wav
+        boundaries. Return the pair (overlaps, short_utts) with the
+        list of Overlap tuples and the list of utterances shorter than
+        wav_min_duration.
 
-            if same_stop:
-                warning = True
-                self.log.warning(
-                    "The following utterances stop at the same time "
-                    "in wavefile {}: {}".format(_wav, sorted(same_stop)))
-
-            # TODO overlap checking is buggy
-            # timestamps = list(set(wav_starts)) + list(set(wav_stops))
-            # timestamps.sort()
-            #
-            # overlapped = [
-            #     (utt, timestamps.index(stop) - timestamps.index(start))
-            #     for utt, start, stop in utts
-            #     if timestamps.index(stop) - timestamps.index(start) > 2]
-            #
-            # if overlapped:
-            #     warning = True
-            #     self.log.warning(
-            #         "The following utterances from file {} are "
-            #         "overlapping in time: {}".format(wav, overlapped))
-
-        return warning, short_utts
+        Utterances without timestamps cover their whole wav.
+
+        """
+        self.log.debug("checking timestamps consistency")
+
+        utt_ids = list(self.corpus.segments.keys())
+        segments = self.corpus.segments.values()
+        wavs = sorted({wav for wav, _, _ in segments})
+        wav_index = {wav: i for i, wav in enumerate(wavs)}
+
+        wav_ids = np.fromiter(
+            (wav_index[wav] for wav, _, _ in segments),
+            dtype=np.int64, count=len(utt_ids))
+        durations = np.fromiter(
+            (meta[wav].duration for wav in wavs),
+            dtype=np.float64, count=len(wavs))[wav_ids]
+        starts = np.fromiter(
+            (0 if start is None else start for _, start, _ in segments),
+            dtype=np.float64, count=len(utt_ids))
+        stops = np.fromiter(
+            (np.nan if stop is None else stop for _, _, stop in segments),
+            dtype=np.float64, count=len(utt_ids))
+        stops = np.where(np.isnan(stops), durations, stops)
+
+        # check all utterances are within wav boundaries
+        empty = np.flatnonzero(starts == stops)
+        if empty.size:
+            raise IOError(
+                'utterance {} have a duration of 0'.format(
+                    utt_ids[empty[0]]))
+
+        tolerance = 1.0 / 16000
+        outside = np.flatnonzero(
+            (starts < 0) | (stops < 0) | (starts > stops) |
+            (starts > durations + tolerance) | (stops > durations + tolerance))
+        if outside.size:
+            i = outside[0]
+            raise IOError(
+                "utterance {} is not whithin boudaries in wav {} "
+                "({} not in {})"
+                .format(utt_ids[i], wavs[wav_ids[i]],
+                        '[{}, {}]'.format(starts[i], stops[i]),
+                        '[0, {}]'.format(durations[i])))
+
+        short_utts = [utt_ids[i] for i in np.flatnonzero(
+            stops - starts < self.wav_min_duration)]
+
+        # then check if there is overlap in time between the
+        # different utterances and if there is, issue a warning (not
+        # an error)
+        first, second, duration = find_overlaps(wav_ids, starts, stops)
+        return [Overlap(wavs[wav_ids[i]], utt_ids[i], utt_ids[j], float(d))
+                for i, j, d in zip(first, second, duration)], short_utts
 
     @staticmethod
     def _strcounts2unicode(strcounts):
@@ -18,8 +18,11 @@ import configparser
 import os
 import pkg_resources
 
+import joblib
+
 import abkhazia.utils as utils
 import abkhazia.corpus
+from abkhazia.corpus.corpus_cache import CorpusCache
 
 
 class AbstractPreparator(object):
@@ -59,6 +62,11 @@ class AbstractPreparator(object):
     'input_dir' to a corpus in the abkhazia format, storing the data
     in 'output_dir'.
 
+    Specialized preparators list their input files with input_files(),
+    walking the input directory only once, and parse them in parallel
+    with parse_files(). The parsed data is usually stored in the
+    preparator and shared by the make_*() methods.
+
     """
     @classmethod
     def default_input_dir(cls):
@@ -75,6 +83,12 @@ class AbstractPreparator(object):
         self.njobs = utils.default_njobs(local=True)
         self.log = log
 
+        # meta information on the prepared wavs, see make_wavs
+        self.wavs_meta = None
+
+        # listing of the input directory, see input_files
+        self._input_files = (None, [])
+
         # init input directory
         if not os.path.isdir(input_dir):
             raise IOError(
@@ -86,6 +100,53 @@ class AbstractPreparator(object):
         self.corpus.meta.source = self.input_dir
         self.corpus.meta.name = self.name
 
+    def __getstate__(self):
+        # the preparator is copied to the processes of parse_files(),
+        # don't send them the listing of the input directory
+        state = self.__dict__.copy()
+        state['_input_files'] = (None, [])
+        return state
+
+    def input_files(self, extension='', exclude=None):
+        """Return the sorted list of input files ending with `extension`
+
+        The input directory is walked only once, on the first call,
+        and the listing is reused by the next calls. The returned
+        paths are absolute, in the real input directory (links to
+        files are not resolved).
+
+        exclude : optional list of str, the files with one of them in
+          their path are ignored
+
+        """
+        directory, files = self._input_files
+        if directory != self.input_dir:
+            directory = self.input_dir
+            root = os.path.realpath(directory)
+            files = sorted(os.path.join(path, f)
+                           for path, _, names in os.walk(root)
+                           for f in names)
+            self._input_files = (directory, files)
+
+        exclude = exclude or []
+        return [f for f in files if f.endswith(extension)
+                and not any(e in f for e in exclude)]
+
+    def parse_files(self, parser, files, *args):
+        """Return the list of `parser(f, *args)` for f in `files`
+
+        The files are parsed in parallel by a pool of self.njobs
+        processes and the results are in the order of `files`. The
+        `parser` and `args` are sent to the processes so they must be
+        picklable: `parser` is a module level function or a method of
+        the preparator.
+
+        """
+        files = list(files)
+        self.log.debug('parsing %s files on %s jobs', len(files), self.njobs)
+        return joblib.Parallel(n_jobs=self.njobs)(
+            joblib.delayed(parser)(f, *args) for f in files)
+
     # TODO wavs_dir not a good argument?
     def prepare(self, wavs_dir, keep_short_utts=False):
         """Prepare the corpus from raw distribution to abkhazia format
@@ -120,7 +181,7 @@ class AbstractPreparator(object):
 
         if not keep_short_utts:
             size = len(c.utts())
-            dur = c.utt2duration()
+            dur = c.utt2duration(wavs_meta=self.wavs_meta)
             c = c.subcorpus([u for u in c.utts() if dur[u] > 0.1+1e-8],
                             prune=True, validate=False)
             self.log.debug(
@@ -130,54 +191,146 @@ class AbstractPreparator(object):
         self.log.debug("prepared %s utterances", len(c.utts()))
         return c
 
-    def _broken_wav(self, wav):
-        """Return True if the wav needs to be copied again
+    def _up_to_date(self, entry, source, record):
+        """Return True if the wav `entry` needs not to be converted again
+
+        entry : os.DirEntry of a file in wavs_dir
+
+        source : the audio file `entry` is converted from
+
+        record : the manifest record of `entry`, or None
+
+        A wav is up to date if it is recorded in the manifest as
+        converted from `source`, and both files have not been modified
+        since. A link is not up to date if self.copy_wavs is True.
+
+        """
+        if record is None:
+            return False
+
+        recorded_source, source_fp, wav_fp, linked, _ = record
+        if source != recorded_source or linked != entry.is_symlink():
+            return False
+        if linked and self.copy_wavs:
+            return False
+
+        try:
+            stat = entry.stat(follow_symlinks=False)
+            return ((stat.st_mtime_ns, stat.st_size) == wav_fp
+                    and CorpusCache.fingerprint(source) == source_fp)
+        except OSError:
+            return False
+
+    def _reusable(self, entry, source):
+        """Return True if the wav `entry` can be kept without record
 
-        wav : absolute path to a file in wavs_dir
+        The wav must be a non empty file. A link must point to its
+        `source` and self.copy_wavs be False.
 
-        A wav file is broken if:
-          - the file is empty
-          - the file is a link and self.copy_wavs is True
+        """
+        try:
+            if entry.is_symlink():
+                return (not self.copy_wavs
+                        and os.path.realpath(entry.path) == source
+                        and entry.stat().st_size > 0)
+            return entry.is_file() and entry.stat().st_size > 0
+        except OSError:
+            return False
+
+    def _prepare_wavs_dir(self, wavs_dir, targets, manifest):
+        """Return the (inputs, outputs) to convert, delete undesired files
+
+        targets : dict of the desired wavs (basenames in `wavs_dir`)
+          mapped to their source audio file
+
+        manifest : dict of wavs mapped to their record, the records of
+          the wavs to convert again are deleted
+
+        Any file in `wavs_dir` not desired or not up to date (see
+        _up_to_date) is deleted.
+
+        When the manifest is empty (`wavs_dir` prepared by a previous
+        version of abkhazia), the desired wavs are kept if they are
+        valid 16 kHz mono wavs, and recorded in the manifest. Their
+        sources are then assumed unmodified since their conversion.
 
         """
-        if utils.is_empty_file(wav):
-            return True
-        if os.path.islink(wav) and self.copy_wavs:
-            return True
-        return False
-
-    def _prepare_wavs_dir(self, wavs_dir, inputs, outputs):
-        """Detect outputs already present and delete any undesired file"""
         self.log.debug('scanning %s', wavs_dir)
 
-        target = dict((o, i) for i, o in zip(inputs, outputs))
+        todo = dict(targets)
+        seed = not manifest
+        unrecorded = []
         found = 0
         deleted = 0
-        for wav in os.listdir(wavs_dir):
-            # the complete path to the wav file
-            path = os.path.realpath(os.path.join(wavs_dir, wav))
-
-            # the target file is found in the directory, delete it if
-            # it is empty, delete it it's a link and we force copying
-            if wav in target and not self._broken_wav(path):
-                del target[wav]
+        for entry in os.scandir(wavs_dir):
+            source = todo.get(entry.name)
+            if source is not None and self._up_to_date(
+                    entry, source, manifest.get(entry.name)):
+                del todo[entry.name]
                 found += 1
+            elif (seed and source is not None
+                  and self._reusable(entry, source)):
+                unrecorded.append((source, entry.name))
             else:
-                utils.remove(path)
+                # remove the entry itself, not the source of a link
+                utils.remove(entry.path)
                 deleted += 1
 
+        if unrecorded:
+            # scan the unrecorded wavs to seed the manifest
+            self.log.info(
+                'no manifest for %s, recording the %s wav files found',
+                wavs_dir, len(unrecorded))
+            self._update_manifest(wavs_dir, manifest, unrecorded)
+            for _, wav in unrecorded:
+                meta = manifest[wav][4]
+                if meta.error is None and (
+                        meta.rate, meta.nbc, meta.width) == (16000, 1, 2):
+                    del todo[wav]
+                    found += 1
+                else:
+                    utils.remove(os.path.join(wavs_dir, wav))
+                    deleted += 1
+
+        for wav in list(manifest.keys()):
+            if wav in todo or wav not in targets:
+                del manifest[wav]
+
         self.log.debug(
             'found %s files, deleted %s undesired files', found, deleted)
 
-        # return the updated inputs and outputs
-        return target.values(), target.keys()
+        # return the inputs and outputs to convert
+        return list(todo.values()), list(todo.keys())
+
+    def _update_manifest(self, wavs_dir, manifest, converted):
+        """Record the `converted` wavs in the manifest
+
+        converted : list of (source, wav) pairs
+
+        The converted wavs are scanned and their meta information is
+        recorded in the manifest along with their source.
+
+        """
+        paths = [os.path.join(wavs_dir, wav) for _, wav in converted]
+        meta = utils.wav.scan(paths, njobs=self.njobs)
+
+        for (source, wav), path in zip(converted, paths):
+            stat = os.lstat(path)
+            manifest[wav] = (
+                source, CorpusCache.fingerprint(source),
+                (stat.st_mtime_ns, stat.st_size),
+                os.path.islink(path), meta[path])
 
     def make_wavs(self, wavs_dir):
         """Convert to wav and copy/link the corpus audio files
 
-        Because converting thousands of files can be heavy, only the
-        files that are not already present in wavs_dir are
-        converted.
+        Because converting thousands of files can be heavy, the
+        preparation is incremental: the converted wavs are recorded
+        in a manifest (cached for the corpus, see CorpusCache)
+        with the size and modification time of their source file and
+        their meta information (see utils.wav.scan). Only the files
+        not yet converted, or modified since their conversion, are
+        converted and scanned.
 
         Moreover any file present in wavs_dir but not listed as a
         desired wav file will be deleted.
@@ -187,55 +340,98 @@ class AbstractPreparator(object):
         self.copy_wavs is True).
 
         This method relies on self.list_audio_files() to get the input
-        and output files.
+        and output files. The meta information on the wavs is then
+        available in self.wavs_meta.
 
         """
         # resolve the full path to wavs_dir
         wavs_dir = os.path.realpath(wavs_dir)
 
-        # get the list of input and output files to prepare
-        inputs = []
-        outputs = []
+        # get the input files mapped to the output files to prepare
+        targets = {}
         for f in self.list_audio_files():
             try:  # we have a pair: rename the audio file
                 i, o = f
             except ValueError:  # not renamed
                 i = f
                 o = os.path.splitext(os.path.basename(f))[0] + '.wav'
-            inputs.append(i)
-            outputs.append(o)
+            targets[o] = i
 
-        self.log.info('preparing %s wav files', len(inputs))
+        self.log.info('preparing %s wav files', len(targets))
+
+        # the manifest of the wavs already converted, a moved
+        # directory is converted again
+        cache = CorpusCache(os.path.dirname(wavs_dir), log=self.log)
+        recorded = cache.get('manifest', wavs_dir, dict)
+        manifest = dict(recorded)
 
         if os.path.isdir(wavs_dir):
             # the wavs directory already exists, clean it and prepare
             # it for copy/link of wav files
-            inputs, outputs = self._prepare_wavs_dir(wavs_dir, inputs, outputs)
+            inputs, outputs = self._prepare_wavs_dir(
+                wavs_dir, targets, manifest)
         else:  # wavs_dir does not exist
             os.makedirs(wavs_dir)
+            manifest = {}
+            inputs, outputs = list(targets.values()), list(targets.keys())
 
         # the job is done if all the files are already here, else
         # we continue the preparation
         if len(inputs) == 0:
             self.log.debug(
                 'all wav files already present in the directory')
-        else:
-            # append path to the directory in outputs
-            outputs = [os.path.join(wavs_dir, out) for out in outputs]
 
+            # the manifest may have been seeded
+            if manifest != recorded:
+                cache.set('manifest', wavs_dir, manifest)
+                self._update_wavs_cache(cache, wavs_dir, manifest)
+        else:
             # If original files are not wav, convert them. Else link or
             # copy wav files in function of self.copy_wavs. The wavs that
             # are not at 16 kHz are resampled.
             self.log.debug('converting %s %s files to 16kHz mono wav...',
                            len(inputs), self.audio_format)
-            utils.wav.convert(
-                inputs, outputs, self.audio_format,
-                self.njobs, verbose=5, copy=self.copy_wavs)
+            try:
+                utils.wav.convert(
+                    inputs, [os.path.join(wavs_dir, o) for o in outputs],
+                    self.audio_format, self.njobs, verbose=5,
+                    copy=self.copy_wavs, log=self.log)
+                error = None
+            except utils.wav.ConversionError as err:
+                error = err
+
+            # record the converted files, even if others failed
+            failed = set(error.failed) if error else set()
+            self._update_manifest(
+                wavs_dir, manifest,
+                [(i, o) for i, o in zip(inputs, outputs) if i not in failed])
+            cache.set('manifest', wavs_dir, manifest)
+            self._update_wavs_cache(cache, wavs_dir, manifest)
+            if error:
+                raise error
             self.log.debug('finished converting wavs')
 
+        self.wavs_meta = {
+            wav: record[4] for wav, record in manifest.items()}
+
         # finally return the wav folder path
         return wavs_dir
 
+    @staticmethod
+    def _update_wavs_cache(cache, wavs_dir, manifest):
+        """Fill the cache of Corpus.wavs_metadata from the manifest
+
+        So that the validation of the prepared corpus does not scan
+        the wavs again.
+
+        """
+        entries = cache.get('wavs', None, dict)
+        for wav, (_, source_fp, wav_fp, linked, meta) in manifest.items():
+            # the fingerprint of a link is the one of its source
+            entries[os.path.join(wavs_dir, wav)] = (
+                source_fp if linked else wav_fp, meta)
+        cache.set('wavs', None, entries)
+
     ############################################
     #
     # The above functions are abstracts and must be implemented by
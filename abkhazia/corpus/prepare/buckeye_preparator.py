@@ -16,7 +16,6 @@
 """Data preparation for the revised Buckeye corpus"""
 
 import collections
-import joblib
 import os
 import re
 
@@ -41,15 +40,20 @@ def _load_word(line):
     return _Word(word=match.group(3), time=float(match.group(1)))
 
 
-def _parse_utterances(txt_file, phn_file, log):
+def _parse_utterances(txt_file):
+    """Return (segments, utt2spk, text) from a *.txt file
+
+    The utterances timestamps are read from the corresponding
+    *.words_fold file.
+
+    """
     segments = dict()
     utt2spk = dict()
     text = dict()
 
-    # log.info('loading %s', os.path.basename(txt_file))
-
     # /path/to/.../s2202b.txt -> s2202b
     speaker_id = os.path.splitext(os.path.basename(txt_file))[0]
+    phn_file = txt_file.replace('.txt', '.words_fold')
 
     # load the current files
     txt_data = [l.strip() for l in open(txt_file, 'r') if l.strip()]
@@ -92,6 +96,44 @@ def _parse_utterances(txt_file, phn_file, log):
     return (segments, utt2spk, text)
 
 
+def _parse_lexicon(words_file):
+    """Return the list of (word, phones) entries in a *.words_fold file
+
+    phones is an empty str for the words with no transcription.
+
+    """
+    entries = []
+    for line in open(words_file, 'r'):
+        match = re.match(
+            r'\s\s+(.*)\s+(121|122)\s(.*);(.*); (.*); (.*)', line)
+
+        if match:
+            word = match.group(3)
+            phones = match.group(5)
+
+            # merge phones together
+            phones = phones.replace('em', 'm')
+            phones = phones.replace('el', 'l')
+            phones = phones.replace('en', 'n')
+            phones = phones.replace('eng', 'ng')
+            phones = phones.replace('nx', 'dx')
+
+            # replace VOCNOISE/VOCNOISE_WW/LAUGH by SPN
+            phones = phones.replace('UNKNOWN_WW', 'SPN')
+            phones = phones.replace('UNKNOWN', 'SPN')
+            phones = phones.replace('VOCNOISE_WW', 'SPN')
+            phones = phones.replace('VOCNOISE', 'SPN')
+            phones = phones.replace('LAUGH', 'SPN')
+
+            # replace IVER/NOISE/NOISE_WW by NSN
+            phones = phones.replace('NOISE_WW', 'NSN')
+            phones = phones.replace('NOISE', 'NSN')
+            phones = phones.replace('IVER', 'NSN')
+
+            entries.append((word, phones))
+    return entries
+
+
 class BuckeyePreparator(AbstractPreparator):
     """Convert the Buckeye corpus to the abkhazia format"""
 
@@ -189,39 +231,23 @@ class BuckeyePreparator(AbstractPreparator):
                  copy_wavs=False, njobs=4):
         super(BuckeyePreparator, self).__init__(input_dir, log=log)
         self.copy_wavs = copy_wavs
+        self.njobs = njobs
 
         self.segments = dict()
         self.text = dict()
         self.utt2spk = dict()
 
-        # the input text and lexicon files we will parse
-        txt_files = self._list_files('.txt', exclude=['readme'])
-        phn_files = [f.replace('.txt', '.words_fold') for f in txt_files]
-
         # for each pair of text/lexicon files, update the
         # segments/text/utt2spk dictionaries
-        res = joblib.Parallel(
-            n_jobs=njobs, verbose=0, backend="threading")(
-                joblib.delayed(_parse_utterances)
-                (txt_file, phn_file, self.log)
-                for txt_file, phn_file in zip(txt_files, phn_files))
-
-        for s, u, t in res:
+        for s, u, t in self.parse_files(
+                _parse_utterances,
+                self.input_files('.txt', exclude=['readme'])):
             self.segments.update(s)
             self.utt2spk.update(u)
             self.text.update(t)
 
-    def _list_files(self, ext, exclude=None, abspath=False, realpath=False):
-        files = utils.list_files_with_extension(
-            self.input_dir, ext, abspath=abspath, realpath=realpath)
-
-        if exclude is not None:
-            files = [f for f in files for e in exclude if e not in f]
-
-        return files
-
     def list_audio_files(self):
-        return self._list_files('.wav', abspath=True, realpath=True)
+        return self.input_files('.wav')
 
     def make_segment(self):
         return self.segments
@@ -239,43 +265,18 @@ class BuckeyePreparator(AbstractPreparator):
         lexicon = dict()
         no_lexicon = set()
 
-        files = self._list_files('.words_fold')
-        for line in (l for f in files for l in open(f, 'r')):
-            match = re.match(
-                r'\s\s+(.*)\s+(121|122)\s(.*);(.*); (.*); (.*)', line)
-
-            if match:
-                word = match.group(3)
-                phones = match.group(5)
-
-                # merge phones together
-                phones = phones.replace('em', 'm')
-                phones = phones.replace('el', 'l')
-                phones = phones.replace('en', 'n')
-                phones = phones.replace('eng', 'ng')
-                phones = phones.replace('nx', 'dx')
-
-                # replace VOCNOISE/VOCNOISE_WW/LAUGH by SPN
-                phones = phones.replace('UNKNOWN_WW', 'SPN')
-                phones = phones.replace('UNKNOWN', 'SPN')
-                phones = phones.replace('VOCNOISE_WW', 'SPN')
-                phones = phones.replace('VOCNOISE', 'SPN')
-                phones = phones.replace('LAUGH', 'SPN')
-
-                # replace IVER/NOISE/NOISE_WW by NSN
-                phones = phones.replace('NOISE_WW', 'NSN')
-                phones = phones.replace('NOISE', 'NSN')
-                phones = phones.replace('IVER', 'NSN')
-
-                # add the word to lexicon
-                if phones:
-                    # TODO Here we can check if (and when) we have
-                    # several transcriptions per word (alternate
-                    # pronunciations) and choose the most FREQUENT
-                    # one. Here we are keeping only the most RECENT.
-                    lexicon[word] = phones
-                else:
-                    no_lexicon.add(word)
+        entries = self.parse_files(
+            _parse_lexicon, self.input_files('.words_fold'))
+        for word, phones in (e for entry in entries for e in entry):
+            # add the word to lexicon
+            if phones:
+                # TODO Here we can check if (and when) we have
+                # several transcriptions per word (alternate
+                # pronunciations) and choose the most FREQUENT
+                # one. Here we are keeping only the most RECENT.
+                lexicon[word] = phones
+            else:
+                no_lexicon.add(word)
 
         # detect the words with no transcription
         really_no_lexicon = [t for t in no_lexicon if t not in lexicon]
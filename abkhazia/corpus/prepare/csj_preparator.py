@@ -43,7 +43,6 @@
 import os
 from collections import namedtuple
 from pkg_resources import Requirement, resource_filename
-import progressbar
 
 try:
     import xml.etree.cElementTree as ET
@@ -202,29 +201,20 @@ class CSJPreparator(AbstractPreparator):
                     Requirement.parse('abkhazia'),
                     'abkhazia/share/kana-to-phone_bootphon_CSJ.txt'))
 
-        # gather label data TODO parallelize
-        self.log.info('parsing {} xml files'.format(len(self.data_files)))
+        # gather label data, the xml files are parsed in parallel and
+        # merged in order
         self.all_utts = {}
         self.lexicon = {}
 
         if treat_core:
             self.data_files = self.data_core_files
-        for xml_num, data in enumerate(self.data_files, start=1):
-            print(f'xml {xml_num}/{len(self.data_files)}: ', data)
-            if treat_core:
-                utts = self.parse_core_xml(
-                        os.path.join(xml_dir, data + '.xml'))
-            else:
-                # if not data == 'S05F0612':
-                #    continue
-                # else :
-                #    print data
-                utts = self.parse_non_core_xml(
-                    os.path.join(xml_dir, data + '.xml'), clusters)
-                for utt_id in utts:
-                    utt = utts[utt_id]
-            utts, utt_lexicon = self.extract_basic_transcript(utts,
-                                                              clusters)
+        self.log.info('parsing {} xml files'.format(len(self.data_files)))
+        parsed = self.parse_files(
+            self._parse_xml,
+            [os.path.join(xml_dir, data + '.xml') for data in self.data_files],
+            treat_core, clusters)
+
+        for utts, utt_lexicon in parsed:
             for utt_id in utts:
                 assert not(utt_id in self.all_utts), utt_id
                 self.all_utts[utt_id] = utts[utt_id]
@@ -235,6 +225,14 @@ class CSJPreparator(AbstractPreparator):
                         continue
                     self.lexicon[word] = utt_lexicon[word]
 
+    def _parse_xml(self, xml_file, treat_core, clusters):
+        """Return the utterances and lexicon extracted from `xml_file`"""
+        if treat_core:
+            utts = self.parse_core_xml(xml_file)
+        else:
+            utts = self.parse_non_core_xml(xml_file, clusters)
+        return self.extract_basic_transcript(utts, clusters)
+
     def parse_kana_to_phone(self, kana_csv):
         """Parse katakana phone transcription and pu it in a dict() """
         kana_to_phon = dict()
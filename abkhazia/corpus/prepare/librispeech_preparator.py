@@ -31,6 +31,23 @@ import abkhazia.utils as utils
 from abkhazia.corpus.prepare import AbstractPreparatorWithCMU
 
 
+def _utt_id(utt_id):
+    """Return `utt_id` with the speaker id padded to 4 digits"""
+    len_sid = len(utt_id.split('-')[0])  # length of speaker_id
+    prefix = '00' if len_sid == 2 else '0' if len_sid == 3 else ''
+    return prefix + utt_id
+
+
+def _parse_transcription(trs_file):
+    """Return the list of (utt-id, text) in a *.trans.txt file"""
+    text = []
+    for line in open(trs_file, 'r'):
+        matched = re.match(r'([0-9\-]+)\s([A-Z].*)', line)
+        if matched:
+            text.append((_utt_id(matched.group(1)), matched.group(2)))
+    return text
+
+
 class LibriSpeechPreparator(AbstractPreparatorWithCMU):
     """Convert the LibriSpeech corpus to the abkhazia format"""
     name = 'librispeech'
@@ -117,15 +134,9 @@ class LibriSpeechPreparator(AbstractPreparatorWithCMU):
             self.input_dir = os.path.join(input_dir, selection)
 
     def list_audio_files(self):
-        flacs = utils.list_files_with_extension(
-            self.input_dir, '.flac', abspath=True)
-
-        wavs = []
-        for flac in flacs:
-            utt_id = os.path.basename(flac).replace('.flac', '')
-            len_sid = len(utt_id.split('-')[0])  # length of speaker_id
-            prefix = '00' if len_sid == 2 else '0' if len_sid == 3 else ''
-            wavs.append(prefix + utt_id + '.wav')
+        flacs = self.input_files('.flac')
+        wavs = [_utt_id(os.path.basename(flac).replace('.flac', '')) + '.wav'
+                for flac in flacs]
 
         self._wavs = wavs
         return zip(flacs, wavs)
@@ -148,25 +159,17 @@ class LibriSpeechPreparator(AbstractPreparatorWithCMU):
 
     def make_transcription(self):
         text = dict()
-        wav_list = [os.path.basename(w).replace('.wav', '')
-                    for w in self._wavs]
+        wav_list = {os.path.basename(w).replace('.wav', '')
+                    for w in self._wavs}
 
         corrupted_wavs = []
-        for trs in utils.list_files_with_extension(
-                self.input_dir, '.trans.txt'):
-            for line in open(trs, 'r'):
-                matched = re.match(r'([0-9\-]+)\s([A-Z].*)', line)
-                if matched:
-                    utt = matched.group(2)
-
-                    lid = len(matched.group(1).split("-")[0])
-                    prefix = '00' if lid == 2 else '0' if lid == 3 else ''
-                    utt_id = prefix + matched.group(1)
-
-                    if utt_id in wav_list:
-                        text[utt_id] = utt
-                    else:
-                        corrupted_wavs.append(utt_id)
+        for trs in self.parse_files(
+                _parse_transcription, self.input_files('.trans.txt')):
+            for utt_id, utt in trs:
+                if utt_id in wav_list:
+                    text[utt_id] = utt
+                else:
+                    corrupted_wavs.append(utt_id)
         if corrupted_wavs != []:
             self.log.debug('some utterances have no associated wav: {}'
                            .format(corrupted_wavs))
@@ -23,7 +23,6 @@ Both core and non-core files are processed.
 
 import os
 from collections import namedtuple
-import progressbar
 
 try:
     import xml.etree.cElementTree as ET
@@ -184,28 +183,23 @@ class SPSCSJPreparator(AbstractPreparator):
         self.data_files = os.listdir(xml_dir)
         self.data_files = [f.replace('.xml', '') for f in self.data_files]
         self.data_files = [f for f in self.data_files if f[0] == 'S']
-        # gather label data TODO parallelize
+        # gather label data, the xml files are parsed in parallel and
+        # merged in order
         self.log.info('parsing {} xml files'.format(len(self.data_files)))
         self.all_utts = {}
         self.lexicon = {}
         N_parsed = 0
         N = 0
-        for data in progressbar.ProgressBar()(self.data_files):
-            print("xml : {}".format(data))
-            utts, nb_parsed_utt, nb_utts = self.parse_xml(
-                os.path.join(xml_dir,data + '.xml'))
-            N_parsed = N_parsed + nb_parsed_utt
+        parsed = self.parse_files(
+            self._parse_xml,
+            [os.path.join(xml_dir, data + '.xml') for data in self.data_files])
+
+        for utts, utt_lexicon, nb_parsed_utt, nb_utts, nb_removed in parsed:
+            N_parsed = N_parsed + nb_parsed_utt - nb_removed
             N = N + nb_utts
-            # we do not use directly the bootphon Japanese phoneset,
-            # in particular we remove the + for the following phones:
-            # k+y g+y n+y h+y b+y p+y m+y r+y t+y d+y
-            # (i.e we consider the glide y as a separate phoneme)
-            utts = break_glides_clusters(utts)
-            # removing very infrequent phones
-            utts, nb_removed = remove_infrequent_phones(utts)
-            self.log.info('Removed {} utts with infrequent phones'.format(nb_removed))
-            N_parsed = N_parsed - nb_removed
-            utts, utt_lexicon = self.lexicalize(utts)
+            if nb_removed:
+                self.log.debug(
+                    'Removed %s utts with infrequent phones', nb_removed)
             for utt_id in utts:
                 assert not(utt_id in self.all_utts), utt_id
                 self.all_utts[utt_id] = utts[utt_id]
@@ -214,7 +208,25 @@ class SPSCSJPreparator(AbstractPreparator):
                     self.lexicon[word] = utt_lexicon[word]
         proportion = 100.*N_parsed/float(N)
         self.log.info('{:.2f}% of {} utts successfully parsed'.format(proportion, N))
-        print('{:.2f}% of {} utts successfully parsed'.format(proportion, N))
+
+    def _parse_xml(self, xml_file):
+        """Return the utterances and lexicon extracted from `xml_file`
+
+        Return (utts, lexicon, nb_parsed_utts, nb_utts, nb_removed)
+        with nb_removed the number of utterances removed because of
+        infrequent phones.
+
+        """
+        utts, nb_parsed_utts, nb_utts = self.parse_xml(xml_file)
+        # we do not use directly the bootphon Japanese phoneset,
+        # in particular we remove the + for the following phones:
+        # k+y g+y n+y h+y b+y p+y m+y r+y t+y d+y
+        # (i.e we consider the glide y as a separate phoneme)
+        utts = break_glides_clusters(utts)
+        # removing very infrequent phones
+        utts, nb_removed = remove_infrequent_phones(utts)
+        utts, lexicon = self.lexicalize(utts)
+        return utts, lexicon, nb_parsed_utts, nb_utts, nb_removed
 
     def parse_xml(self, xml_file):
         """Parse raw transcript"""
@@ -24,6 +24,28 @@ import abkhazia.utils as utils
 from abkhazia.corpus.prepare import AbstractPreparatorWithCMU
 
 
+def _parse_transcription(dot_file, correct_word):
+    """Return the list of (utt-id, text, bad) in a *.dot file
+
+    The text is corrected by the function `correct_word`. bad is True
+    if the utterance is tagged as a bad recording.
+
+    """
+    transcription = []
+    for line in utils.open_utf8(dot_file, 'r'):
+        # parse utt_id and text
+        matches = re.match(r'(.*) \((.*)\)', line.strip())
+        text_utt = matches.group(1)
+        utt_id = matches.group(2)
+
+        # re-format text and remove empty words
+        words = [correct_word(w) for w in text_utt.split(' ')]
+        transcription.append((
+            utt_id, ' '.join([w for w in words if w != '']),
+            '[bad_recording]' in line))
+    return transcription
+
+
 class WallStreetJournalPreparator(AbstractPreparatorWithCMU):
     """Convert the WSJ corpus to the abkhazia format"""
 
@@ -377,39 +399,45 @@ class WallStreetJournalPreparator(AbstractPreparatorWithCMU):
                        .format(len(self.input_recordings),
                                len(self.input_transcriptions)))
 
+        # parse the transcriptions once, they are used here to find
+        # the bad utterances and then by make_transcription
+        self.transcription = [
+            t for trs in self.parse_files(
+                _parse_transcription, self.input_transcriptions,
+                self.correct_word)
+            for t in trs]
+
         # filter out the corrupted utterances from input files. The
         # tag '[bad_recording]' in a transcript indicates a problem
         # with the associated recording (if it exists) so exclude it
-        self.bad_utts = []
-        for trs in self.input_transcriptions:
-            for line in utils.open_utf8(trs, 'r').xreadlines():
-                if '[bad_recording]' in line:
-                    utt_id = re.match(r'(.*) \((.*)\)', line).group(2)
-                    self.bad_utts.append(utt_id)
+        self.bad_utts = {utt_id for utt_id, _, bad in self.transcription
+                         if bad}
 
         self.log.debug('found {} corrupted utterances'
                        .format(len(self.bad_utts)))
 
         # filter out bad utterances
+        exclude = self.bad_utts.union(self.exclude_wavs)
         self.sphs = [sph for sph in self.input_recordings
-                     if (os.path.basename(sph).replace('.wv1', '')
-                     not in self.bad_utts and
-                     os.path.basename(sph).replace('.wv1', '')
-                     not in self.exclude_wavs)]
+                     if os.path.basename(sph).replace('.wv1', '')
+                     not in exclude]
 
     def filter_files(self, dir_filter, file_filter):
-        """Return a list of abspaths to relevant WSJ files"""
-        matched = []
-        for path, dirs, _ in os.walk(self.input_dir):
-            for d in (d for d in dirs if dir_filter(d)):
-                for d_path, _, files in os.walk(os.path.join(path, d)):
-                    matched += [os.path.join(d_path, f)
-                                for f in files if file_filter(f)]
+        """Return a list of abspaths to relevant WSJ files
+
+        A file is relevant if its name matches `file_filter` and if
+        one of its parent directories, below the input directory,
+        matches `dir_filter`.
 
-        # TODO when preparing the whole corpus, this function create
-        # duplicate entries. Must correct the function (only 1 os.walk
-        # needed) instead of this little fix
-        return list(set(matched))  # was return matched
+        """
+        root = os.path.realpath(self.input_dir)
+        matched = []
+        for path in self.input_files():
+            dirs, name = os.path.split(os.path.relpath(path, root))
+            if (dirs and file_filter(name) and
+                    any(dir_filter(d) for d in dirs.split(os.sep))):
+                matched.append(path)
+        return matched
 
     def list_audio_files(self):
         return self.sphs
@@ -430,28 +458,10 @@ class WallStreetJournalPreparator(AbstractPreparatorWithCMU):
         return utt2spk
 
     def make_transcription(self):
-        # concatenate all the transcription files
-        transcription = []
-
-        for trs in self.input_transcriptions:
-            transcription += utils.open_utf8(trs, 'r').readlines()
-
-        # parse each line and write it to output file in abkhazia format
-        text = dict()
-        for line in transcription:
-            # parse utt_id and text
-            matches = re.match(r'(.*) \((.*)\)', line.strip())
-            text_utt = matches.group(1)
-            utt_id = matches.group(2)
-
-            # skip bad utterances
-            if utt_id not in self.bad_utts:
-                # re-format text and remove empty words
-                words = [self.correct_word(w) for w in text_utt.split(' ')]
-
-                # output to file
-                text[utt_id] = ' '.join([w for w in words if w != ''])
-        return text
+        # the transcriptions have been parsed in __init__, skip bad
+        # utterances
+        return {utt_id: text for utt_id, text, _ in self.transcription
+                if utt_id not in self.bad_utts}
 
     def make_lexicon(self):
         lexicon = dict()
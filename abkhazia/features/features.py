@@ -200,8 +200,8 @@ class Features(abstract_recipe.AbstractRecipe):
             for line in open(origin, 'r'):
                 key = line.strip().split(' ')[0]
                 assert key in self.corpus.wavs
-                wav = os.path.join(self.corpus.wav_folder, key)
-                scp.write('{} {}\n'.format(key, wav))
+                scp.write('{} {}\n'.format(
+                    key, self.corpus.wav_rxfilename(key)))
 
 
 def _delta_joblib_fnc(scp, instance):
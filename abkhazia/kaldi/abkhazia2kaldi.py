@@ -165,14 +165,20 @@ class Abkhazia2Kaldi(object):
         # tstart/tstop in the segment file
         CorpusSaver.save_segments(self.corpus, target, force_timestamps=True)
 
-    def setup_wav(self):
-        """Create wav.scp in data directory"""
+    def setup_wav(self, pipe=False):
+        """Create wav.scp in data directory
+
+        For packed wavs, the entries are offsets in the shards or,
+        if `pipe` is True, commands extracting the wavs from the
+        shards (see Corpus.wav_rxfilename).
+
+        """
         target = os.path.join(self._output_path(), 'wav.scp')
         wavs = set(w for w, _, _ in self.corpus.segments.values())
         with open_utf8(target, 'w') as out:
             for wav in sorted(wavs):
-                wav_path = os.path.join(self.corpus.wav_folder, wav)
-                out.write(u'{} {}\n'.format(wav, wav_path))
+                out.write(u'{} {}\n'.format(
+                    wav, self.corpus.wav_rxfilename(wav, pipe=pipe)))
 
     def setup_wav_folder(self):
         """using a symbolic link to avoid copying voluminous data"""
@@ -23,19 +23,26 @@ respectively.
 Provides the dict_to_ark function to write ark files from numpy
 arrays.
 
+Provides the ScpIndex class for random access to the utterances
+referenced in a Kaldi scp file.
+
 """
 
+import collections
+import contextlib
+import itertools
+import mmap
+import multiprocessing
 import os
-import re
+import queue
 import struct
-import tempfile
+import warnings
 
 import numpy as np
 import h5features as h5f
 import h5py
 
 import abkhazia.utils as utils
-from abkhazia.kaldi import kaldi_path
 
 
 def ark_to_dict(arkfile):
@@ -51,20 +58,24 @@ def ark_to_dict(arkfile):
     -------
 
     A dictionary where keys are utterances ids (as str) and values are
-    features matrices (as 2D numpy arrays).
+    features matrices (as 2D numpy arrays) or vectors (as 1D numpy
+    arrays). Uncompressed data read from a binary ark are read-only
+    views on the memory-mapped file.
+
+    Raise:
+    ------
+
+    IOError if the ark file contains an unsupported data type or is
+    badly formatted.
 
     """
     if not _is_binary(arkfile):
         return _ark_to_dict_text(arkfile)
-
-    try:
-        return _ark_to_dict_binary(arkfile)
-    except AssertionError:
-        return _ark_to_dict_binary_bytext(arkfile)
+    return _ark_to_dict_binary(arkfile)
 
 
 def ark_to_h5f(ark_files, h5_file, h5_group='features',
-               sample_frequency=100, tstart=0.0125,
+               sample_frequency=100, tstart=0.0125, njobs=1, chunk_size=100,
                log=utils.logger.null_logger()):
     """Convert a sequence of kaldi ark files into a single h5features file
 
@@ -87,6 +98,13 @@ def ark_to_h5f(ark_files, h5_file, h5_group='features',
 
     tstart (float): timestamp of the first feature vector
 
+    njobs (int): number of ark files decoded in parallel, each in a
+        subprocess, default is 1 (no subprocess)
+
+    chunk_size (float): the data is appended to `h5_file` in chunks of
+        approximatively `chunk_size` MB, so that the memory usage does
+        not depend on the size of the ark files, default is 100
+
     log (logging.Logger): optional log for messages
 
     Raise:
@@ -94,29 +112,40 @@ def ark_to_h5f(ark_files, h5_file, h5_group='features',
 
     AssertionError if the `h5_group` already exists in the `h5_file`
 
+    IOError if an ark file cannot be read
+
+    ValueError if `njobs` is lower than 1
+
     """
+    if njobs < 1:
+        raise ValueError(
+            'njobs must be greater than 0, it is {}'.format(njobs))
+
     ark_files = list(ark_files)
 
     if os.path.isfile(h5_file):
-        assert h5_group not in h5py.File(h5_file, 'r'), \
-            'group {} already exists in {}'.format(h5_group, h5_file)
+        with h5py.File(h5_file, 'r') as fh5:
+            assert h5_group not in fh5, \
+                'group {} already exists in {}'.format(h5_group, h5_file)
 
     log.debug('converting %s ark file%s to h5features in %s/%s',
               len(ark_files),
               's' if len(ark_files) else '',
               h5_file, h5_group)
 
+    chunks = (_yield_chunks(ark_files, chunk_size, log) if njobs == 1
+              else _yield_chunks_parallel(ark_files, chunk_size, njobs, log))
+
     with h5f.Writer(h5_file) as fout:
-        for ark in ark_files:
-            log.debug('converting {}...'.format(os.path.basename(ark)))
-            fout.write(_ark_to_data(
-                ark, sample_frequency=sample_frequency, tstart=tstart),
+        for chunk in chunks:
+            fout.write(_dict_to_data(
+                chunk, sample_frequency=sample_frequency, tstart=tstart),
                        h5_group, append=True)
 
 
 def scp_to_h5f(scp_file, h5_file, h5_group='features',
-               sample_frequency=100, tstart=0.0125,
-               log=utils.logger.null_logger()):
+               sample_frequency=100, tstart=0.0125, utts=None,
+               njobs=1, chunk_size=100, log=utils.logger.null_logger()):
     """Convert ark files referenced in `scp_file` into a h5features file
 
     Because Kaldi ark does not store any time information, we need
@@ -138,6 +167,16 @@ def scp_to_h5f(scp_file, h5_file, h5_group='features',
 
     tstart (float): timestamp of the first feature vector
 
+    utts (list of str): when specified, export only those utterances,
+        read directly at their offsets in the ark files. By default
+        all the ark files referenced in the scp are exported.
+
+    njobs (int): number of ark files decoded in parallel, see
+        ark_to_h5f, default is 1
+
+    chunk_size (float): size of the chunks appended to `h5_file` in
+        MB, see ark_to_h5f, default is 100
+
     log (logging.Logger): optional log for messages
 
     Raise:
@@ -145,21 +184,39 @@ def scp_to_h5f(scp_file, h5_file, h5_group='features',
 
     AssertionError if the `h5_group` already exists in the `h5_file`
 
+    KeyError if an utterance in `utts` is not in the scp file
+
     IOError if the scp file is badly formatted
 
+    ValueError if `njobs` is lower than 1
+
     """
-    # extract the ark files referenced in the scp
-    ark_files = set()
-    for n, line in enumerate(open(scp_file, 'r').readlines(), 1):
-        matched = re.match('^.* (.*):[0-9]*$', line)
-        if not matched:
-            raise IOError('Bad scp file line {}: {}'.format(n, scp_file))
-        ark_files.add(matched.group(1))
-
-    # sort them in natural order to have f.10.ark > f.9.ark. This is
-    # important to concatenate features in order because some Kaldi
-    # scripts assumes ordered features (with the rspecifier ark,s,cs).
-    ark_files = list(ark_files)
+    if njobs < 1:
+        raise ValueError(
+            'njobs must be greater than 0, it is {}'.format(njobs))
+
+    index = ScpIndex(scp_file)
+
+    if utts is not None:
+        log.info('writing {} utterances to {} in group {}'.format(
+            len(utts), os.path.basename(h5_file), h5_group))
+
+        if os.path.isfile(h5_file):
+            with h5py.File(h5_file, 'r') as fh5:
+                assert h5_group not in fh5, \
+                    'group {} already exists in {}'.format(h5_group, h5_file)
+
+        with h5f.Writer(h5_file) as fout:
+            fout.write(_dict_to_data(
+                index.get_many(utts), sample_frequency=sample_frequency,
+                tstart=tstart), h5_group)
+        return
+
+    # sort the ark files in natural order to have f.10.ark >
+    # f.9.ark. This is important to concatenate features in order
+    # because some Kaldi scripts assumes ordered features (with the
+    # rspecifier ark,s,cs).
+    ark_files = index.ark_files()
     ark_files.sort(key=utils.natural_sort_keys)
 
     log.info('writing {} ark files to {} in group {}'.format(
@@ -168,10 +225,10 @@ def scp_to_h5f(scp_file, h5_file, h5_group='features',
     # Then deleguate to ark_to_h5f
     ark_to_h5f(ark_files, h5_file, h5_group,
                sample_frequency=sample_frequency, tstart=tstart,
-               log=log)
+               njobs=njobs, chunk_size=chunk_size, log=log)
 
 
-def dict_to_ark(arkfile, data, format='text'):
+def dict_to_ark(arkfile, data, format='text', scp=None, compress=False):
     """Write a data dictionary to a Kaldi ark file
 
     TODO for now time information from h5f is lost in ark
@@ -186,6 +243,13 @@ def dict_to_ark(arkfile, data, format='text'):
     format (str): must be 'text' or 'binary' to write a text or a
         binary ark file respectively, default is 'text'
 
+    scp (str): when specified, also write a Kaldi scp file indexing
+        the utterances in `arkfile` by byte offsets
+
+    compress (bool): when True, write the matrices in the Kaldi
+        compressed format (as 'CM'), only used for binary arks,
+        default is False
+
     Raise:
     ------
 
@@ -193,37 +257,245 @@ def dict_to_ark(arkfile, data, format='text'):
 
     """
     if format == 'text':
-        _dict_to_txt_ark(arkfile, data)
+        offsets = _dict_to_txt_ark(arkfile, data)
     elif format == 'binary':
-        with tempfile.NamedTemporaryFile(
-                dir=utils.config.get('abkhazia', 'tmp-directory')) as tmp:
-            _dict_to_txt_ark(tmp.name, data)
-
-            utils.jobs.run(
-                'copy-feats ark,t:{0} ark:{1}'.format(tmp.name, arkfile),
-                env=kaldi_path(),
-                stdout=open(os.devnull, 'w').write)
+        offsets = _dict_to_binary_ark(arkfile, data, compress=compress)
     else:
         raise RuntimeError(
             'ark format must be "text" or "binary", it is "{}"'
             .format(format))
 
+    if scp is not None:
+        with open(scp, 'w') as fscp:
+            for utt, offset in offsets.items():
+                fscp.write('{} {}:{}\n'.format(utt, arkfile, offset))
+
+
+class ScpIndex(object):
+    """Random access to the utterances referenced in a Kaldi scp file
+
+    The scp file (usually named feats.scp) is parsed once at
+    construction, mapping each utterance id to an ark file and a byte
+    offset in it. The ark files are memory-mapped on first access and
+    kept open in a pool, so reading an utterance is a direct seek to
+    its offset instead of a complete read of the ark.
+
+    Parameters:
+    -----------
+
+    scp_file (str): path to a Kaldi scp file, each line being
+        formatted as 'utt-id /path/to/file.ark:offset'
+
+    Raise:
+    ------
+
+    IOError if the scp file is badly formatted
+
+    Example:
+    --------
+
+    >>> index = ScpIndex('feats.scp')
+    >>> data = index['utt1']
+    >>> subset = index.get_many(['utt2', 'utt3'])
+
+    """
+    def __init__(self, scp_file):
+        self.scp_file = scp_file
+        self._index = {}
+        self._pool = {}
+
+        for n, line in enumerate(open(scp_file, 'r'), 1):
+            try:
+                utt, entry = line.split()
+                ark, offset = entry.rsplit(':', 1)
+                self._index[utt] = (ark, int(offset))
+            except ValueError:
+                raise IOError(
+                    'Bad scp file line {}: {}'.format(n, scp_file))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, utt_id):
+        return utt_id in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __getitem__(self, utt_id):
+        """Return the data of the utterance `utt_id`
+
+        Raise KeyError if `utt_id` is not in the scp file.
+
+        """
+        ark, offset = self._index[utt_id]
+        return self._read(ark, offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def utts(self):
+        """Return the list of utterances ids referenced in the scp"""
+        return list(self._index.keys())
+
+    def ark_files(self):
+        """Return the list of ark files referenced in the scp"""
+        return list(set(ark for ark, _ in self._index.values()))
+
+    def get_many(self, utt_ids):
+        """Return a dict of utterances ids mapped to their data
+
+        The utterances are read ark by ark in increasing offsets
+        order, the returned dict follow the order of `utt_ids`.
+
+        Raise KeyError if an utterance is not in the scp file.
+
+        """
+        utt_ids = list(utt_ids)
+        data = {}
+        for utt in sorted(utt_ids, key=lambda u: self._index[u]):
+            data[utt] = self[utt]
+        return {utt: data[utt] for utt in utt_ids}
+
+    def close(self):
+        """Release the memory-mapped ark files
+
+        The mappings are effectively closed once the arrays read from
+        them are no more referenced.
+
+        """
+        self._pool = {}
+
+    def _read(self, ark, offset):
+        if ark not in self._pool:
+            with open(ark, 'rb') as fin:
+                self._pool[ark] = mmap.mmap(
+                    fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+        data = self._pool[ark]
+        try:
+            if data[offset:offset+2] == b'\0B':
+                return _read_binary_object(data, offset)[0]
+            return _read_text_object(data, offset)[0]
+        except (struct.error, ValueError) as err:
+            raise IOError('{}: cannot read data at byte {}: {}'
+                          .format(ark, offset, err))
+
 
 #
 # Functions above should be considered private
 #
 
 
-def _ark_to_data(arkfile, sample_frequency=100, tstart=0.0125):
-    """ark to h5features.Data"""
-    d = ark_to_dict(arkfile)
-
+def _dict_to_data(d, sample_frequency=100, tstart=0.0125):
+    """dict of numpy arrays to h5features.Data"""
     times = [np.arange(val.shape[0], dtype=float) / sample_frequency + tstart
              for val in d.values()]
 
     return h5f.Data(list(d.keys()), times, list(d.values()))
 
 
+def _yield_arrays(arkfile):
+    """Yield (utt_id, data) tuples read from a binary or text `arkfile`"""
+    return (_yield_utt_binary(arkfile) if _is_binary(arkfile)
+            else _yield_utt(arkfile))
+
+
+def _yield_chunks(ark_files, chunk_size, log=utils.logger.null_logger()):
+    """Yield dicts of (utt_id, data) of about `chunk_size` MB
+
+    The `ark_files` are read sequentially in the given order.
+
+    """
+    chunk, size = {}, 0
+    for ark in ark_files:
+        log.debug('converting {}...'.format(os.path.basename(ark)))
+        for utt, data in _yield_arrays(ark):
+            chunk[utt] = data
+            size += data.nbytes
+            if size >= chunk_size * 2**20:
+                yield chunk
+                chunk, size = {}, 0
+    if chunk:
+        yield chunk
+
+
+def _chunks_to_queue(arkfile, chunk_size, queue):
+    """Put the chunks read from `arkfile` in a queue, then None
+
+    Run in a subprocess by _yield_chunks_parallel. On error the
+    exception is sent through the queue.
+
+    """
+    try:
+        for chunk in _yield_chunks([arkfile], chunk_size):
+            queue.put(chunk)
+        queue.put(None)
+    except Exception as err:
+        queue.put(IOError('{}: {}'.format(arkfile, err)))
+
+
+def _yield_chunks_parallel(ark_files, chunk_size, njobs,
+                           log=utils.logger.null_logger()):
+    """Yield dicts of (utt_id, data) of about `chunk_size` MB
+
+    Up to `njobs` ark files are decoded concurrently in
+    subprocesses. The chunks are yielded in the order of `ark_files`:
+    each subprocess sends its chunks through a bounded queue and is
+    blocked while its queue is full, so no more than 2 * `njobs`
+    chunks are waiting in memory.
+
+    """
+    pending = collections.deque()
+    ark_files = iter(ark_files)
+
+    def _start(ark):
+        _queue = multiprocessing.Queue(maxsize=2)
+        process = multiprocessing.Process(
+            target=_chunks_to_queue, args=(ark, chunk_size, _queue))
+        process.start()
+        pending.append((ark, process, _queue))
+
+    try:
+        for ark in itertools.islice(ark_files, njobs):
+            _start(ark)
+
+        while pending:
+            ark, process, _queue = pending.popleft()
+            log.debug('converting {}...'.format(os.path.basename(ark)))
+
+            while True:
+                try:
+                    chunk = _queue.get(timeout=1)
+                except queue.Empty:
+                    if process.is_alive():
+                        continue
+                    # the process may have exited just after its last put
+                    try:
+                        chunk = _queue.get(timeout=1)
+                    except queue.Empty:
+                        raise IOError(
+                            '{}: conversion process died with exit code {}'
+                            .format(ark, process.exitcode))
+
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+            process.join()
+
+            for ark in itertools.islice(ark_files, 1):
+                _start(ark)
+    finally:
+        for _, process, _ in pending:
+            process.terminate()
+            process.join()
+
+
 def _is_binary(arkfile):
     """Return True if the ark is binary, False if text"""
     # from https://stackoverflow.com/questions/898669
@@ -232,58 +504,145 @@ def _is_binary(arkfile):
     return bool(open(arkfile, 'rb').read(1024).translate(None, textchars))
 
 
+# Kaldi binary tokens for (uncompressed) matrices and vectors mapped
+# to their numpy dtype and dimensionality
+_BINARY_TYPES = {
+    b'FM': (np.float32, 2),
+    b'DM': (np.float64, 2),
+    b'FV': (np.float32, 1),
+    b'DV': (np.float64, 1)}
+
+
 def _ark_to_dict_binary(arkfile):
-    res = {}
+    """Load a binary ark to utterances indexed numpy arrays"""
+    return {utt: data for utt, data in _yield_utt_binary(arkfile)}
+
+
+def _yield_utt_binary(arkfile):
+    """Yield (utt_id, data) tuples read from a binary `arkfile`
+
+    The file is memory-mapped and uncompressed matrices and vectors
+    are yielded as read-only numpy views on the mapped data, so no
+    copy is done. Compressed matrices are decompressed to float32.
+
+    """
     with open(arkfile, 'rb') as fin:
-        while True:
-            # TODO break if empty buffer here
-            fname = b''
-            c = fin.read(1)
-            if c == b'':  # EOF (EOFError not raised by read(empty))
-                break
-            while c != b' ':
-                fname += c
-                c = fin.read(1)
+        if os.fstat(fin.fileno()).st_size == 0:
+            return
+        # the mapping stays alive as long as a view refers to it
+        data = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+    pos, size = 0, len(data)
+    while pos < size:
+        # utterance id is terminated by a space
+        end = data.find(b' ', pos)
+        if end == -1:
+            raise IOError('{}: unexpected end of file at byte {}'
+                          .format(arkfile, pos))
+        utt_id = data[pos:end].decode().strip()
 
-            # end of fname
-            fin.read(1)
+        try:
+            array, pos = _read_binary_object(data, end + 1)
+        except (struct.error, ValueError) as err:
+            raise IOError('{}: cannot read utterance {}: {}'
+                          .format(arkfile, utt_id, err))
+        yield utt_id, array
 
-            # data type
-            assert fin.read(4) == 'BFM ', 'type not supported'
 
-            # nrows type
-            assert struct.unpack('b', fin.read(1))[0] == 4, \
-                'type not supported'
-            nrows = struct.unpack('i', fin.read(4))[0]
+def _read_binary_object(data, pos):
+    """Read a Kaldi binary matrix or vector from `data` at `pos`
 
-            # ncols type:
-            assert struct.unpack('b', fin.read(1))[0] == 4, \
-                'type not supported'
-            ncols = struct.unpack('i', fin.read(4))[0]
+    `data` is a bytes-like object (usually a mmap) and `pos` points on
+    the binary marker '\\0B' following an utterance id. Return the
+    pair (array, pos) where `pos` is the offset of the next utterance.
 
-            # data
-            size = nrows * ncols * 4
-            data = np.frombuffer(
-                fin.read(size), dtype=np.float32).reshape((nrows, ncols))
-            res[fname.decode()] = data
-    return res
+    Raise IOError if the data type is not supported or not terminated.
 
+    """
+    if data[pos:pos+2] != b'\0B':
+        raise IOError('binary marker not found at byte {}'.format(pos))
+    pos += 2
+
+    # data type is terminated by a space
+    end = data.find(b' ', pos)
+    if end == -1:
+        raise IOError('unexpected end of file at byte {}'.format(pos))
+    token = bytes(data[pos:end])
+    pos = end + 1
+
+    if token in _BINARY_TYPES:
+        dtype, ndim = _BINARY_TYPES[token]
+        shape = []
+        for _ in range(ndim):
+            # each dimension is an int32 preceded by its size in bytes
+            nbytes, dim = struct.unpack_from('<bi', data, pos)
+            if nbytes != 4:
+                raise IOError(
+                    'unexpected integer size {} at byte {}'
+                    .format(nbytes, pos))
+            shape.append(dim)
+            pos += 5
+
+        count = int(np.prod(shape))
+        array = np.frombuffer(
+            data, dtype=dtype, count=count, offset=pos).reshape(shape)
+        return array, pos + array.nbytes
+
+    if token in (b'CM', b'CM2', b'CM3'):
+        return _read_compressed_matrix(data, pos, token)
+
+    raise IOError('data type not supported: {}'.format(token.decode()))
+
+
+def _read_compressed_matrix(data, pos, token):
+    """Decompress a Kaldi compressed matrix as a float32 array
+
+    This is a port of Kaldi's CompressedMatrix::CopyToMat for the
+    three compression formats: 'CM' (one byte with per-column
+    headers), 'CM2' (two bytes) and 'CM3' (one byte).
 
-def _ark_to_dict_binary_bytext(arkfile):
-    """Convert a binary ark to text, and load it as numpy arrays"""
-    try:
-        # copy-feats converts binary ark to text ark
-        tempdir = tempfile.mkdtemp(
-            dir=utils.config.get('abkhazia', 'tmp-directory'))
-        txtfile = os.path.join(tempdir, 'txt')
-        utils.jobs.run(
-            'copy-feats ark:{0} ark,t:{1}'.format(arkfile, txtfile),
-            env=kaldi_path(), stdout=open(os.devnull, 'w').write)
-
-        # load the converted text ark as a dict
-        return _ark_to_dict_text(txtfile)
-    finally:
-        utils.remove(tempdir, safe=True)
+    """
+    min_value, prange, nrows, ncols = struct.unpack_from(
+        '<ffii', data, pos)
+    pos += 16
+
+    if token == b'CM2':
+        values = np.frombuffer(
+            data, dtype='<u2', count=nrows*ncols, offset=pos)
+        array = min_value + prange * (1.0 / 65535.0) * values.astype(
+            np.float32)
+        return (array.astype(np.float32).reshape((nrows, ncols)),
+                pos + values.nbytes)
+
+    if token == b'CM3':
+        values = np.frombuffer(
+            data, dtype=np.uint8, count=nrows*ncols, offset=pos)
+        array = min_value + prange * (1.0 / 255.0) * values.astype(
+            np.float32)
+        return (array.astype(np.float32).reshape((nrows, ncols)),
+                pos + values.nbytes)
+
+    # 'CM': 4 uint16 percentiles per column, then column-major bytes
+    headers = np.frombuffer(
+        data, dtype='<u2', count=4*ncols, offset=pos).reshape((ncols, 4))
+    pos += headers.nbytes
+    values = np.frombuffer(
+        data, dtype=np.uint8, count=nrows*ncols, offset=pos).reshape(
+            (ncols, nrows)).astype(np.float32)
+    pos += nrows * ncols
+
+    percentiles = (min_value + prange * 1.52590218966964e-05 *
+                   headers.astype(np.float32))
+    p0, p25, p75, p100 = (percentiles[:, i:i+1] for i in range(4))
+
+    array = np.where(
+        values <= 64,
+        p0 + (p25 - p0) * values * (1 / 64.0),
+        np.where(
+            values <= 192,
+            p25 + (p75 - p25) * (values - 64) * (1 / 128.0),
+            p75 + (p100 - p75) * (values - 192) * (1 / 63.0)))
+    return array.T.astype(np.float32), pos
 
 
 def _ark_to_dict_text(arkfile):
@@ -291,43 +650,184 @@ def _ark_to_dict_text(arkfile):
     return {utt: data for utt, data in _yield_utt(arkfile)}
 
 
-def _str2np(data):
-    """Convert a list of str to a np.array of float"""
-    npdata = np.zeros((len(data), len(data[0].split())))
-    for i, line in enumerate(data):
-        try:
-            npdata[i, :] = [float(f) for f in line.split()]
-        except ValueError:
-            raise ValueError(
-                'error converting str to float in:', line.strip())
-    return npdata
+def _yield_utt(arkfile):
+    """Yield (utt_id, data) tuples read from a text `arkfile`
 
+    The file is memory-mapped and scanned for the '[' and ']'
+    delimiters of each utterance, whose whole body is then converted
+    to float32 in a single numpy call.
 
-def _yield_utt(arkfile):
-    """Yield (utt_id, data) tuples read from a text `arkfile`"""
-    utt_id = None
-    data = []
+    """
+    with open(arkfile, 'rb') as fin:
+        if os.fstat(fin.fileno()).st_size == 0:
+            return
+        data = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+    with contextlib.closing(data):
+        pos = 0
+        while True:
+            start = data.find(b'[', pos)
+            if start == -1:
+                if data[pos:].strip():
+                    raise IOError('{}: unexpected end of file at byte {}'
+                                  .format(arkfile, pos))
+                break
 
-    for line in open(arkfile, 'r'):
-        # a new utterance is starting, yield the previous utt if any
-        if not line.startswith('  '):
-            if utt_id:
-                yield utt_id, _str2np(data)
-                utt_id, data = None, []
-            utt_id = line[:-2].strip()
-        else:  # line of floats
-            data.append(line.replace(']', '').strip())
+            utt_id = data[pos:start].decode().strip()
+            try:
+                array, pos = _read_text_object(data, start)
+            except ValueError as err:
+                raise IOError('{}: cannot read utterance {}: {}'
+                              .format(arkfile, utt_id, err))
+            yield utt_id, array
 
-    # yield the final utt
-    if utt_id:
-        yield utt_id, _str2np(data)
+
+def _read_text_object(data, pos):
+    """Read a Kaldi text matrix or vector from `data` at `pos`
+
+    `data` is a bytes-like object (usually a mmap) and `pos` points
+    before the opening '[' following an utterance id. Return the pair
+    (array, pos) where `pos` is the offset after the closing ']'. A
+    matrix has one row per line, a vector is written on a single line.
+
+    Raise ValueError if the data cannot be converted to float.
+
+    """
+    start = data.find(b'[', pos)
+    stop = data.find(b']', start)
+    if start == -1 or stop == -1:
+        raise ValueError('brackets not found after byte {}'.format(pos))
+    body = data[start+1:stop]
+
+    # the first line (just after '[') is empty for matrices. The last
+    # line may be empty as well if ']' has been written on its own line
+    first = body.find(b'\n')
+    nrows = body.count(b'\n')
+    if nrows and not body[body.rfind(b'\n'):].strip():
+        nrows -= 1
+
+    with warnings.catch_warnings():
+        # on conversion errors, numpy warns and truncates the output,
+        # this is detected below from the size of the array
+        warnings.simplefilter('ignore', DeprecationWarning)
+        array = (np.fromstring(body, dtype=np.float32, sep=' ')
+                 if body.strip() else np.zeros((0,), dtype=np.float32))
+
+    if first == -1:  # a vector
+        if array.size != len(body.split()):
+            raise ValueError('error converting str to float')
+        return array, stop + 1
+
+    end = body.find(b'\n', first + 1)
+    ncols = len(body[first+1:end if end != -1 else None].split())
+    if array.size != nrows * ncols:
+        raise ValueError('error converting str to float')
+    return array.reshape((nrows, ncols)), stop + 1
 
 
 def _dict_to_txt_ark(arkfile, data, sort=True):
-    """Save `data` as a Kaldi ark `arkfile`"""
+    """Save `data` as a Kaldi ark `arkfile`
+
+    Return a dict of utterances mapped to their offset in `arkfile`
+
+    """
+    offsets = {}
     with open(arkfile, 'w') as fark:
         for utt in sorted(data.keys()) if sort else data.keys():
-            fark.write(utt + '  [\n')
+            fark.write(utt + ' ')
+            offsets[utt] = fark.tell()
+            fark.write(' [\n')
             for vec in data[utt][:-1]:
                 fark.write('  ' + ' '.join(str(v) for v in vec) + ' \n')
             fark.write('  ' + ' '.join(str(v) for v in data[utt][-1]) + ' ]\n')
+    return offsets
+
+
+def _dict_to_binary_ark(arkfile, data, sort=True, compress=False):
+    """Save `data` as a Kaldi binary ark `arkfile`
+
+    Float64 arrays are written as double ('DM' or 'DV'), any other
+    type as float ('FM' or 'FV'). If `compress` is True, matrices are
+    written in the compressed 'CM' format.
+
+    Return a dict of utterances mapped to their offset in `arkfile`
+
+    """
+    offsets = {}
+    with open(arkfile, 'wb') as fark:
+        for utt in sorted(data.keys()) if sort else data.keys():
+            array = np.asarray(data[utt])
+            fark.write(utt.encode() + b' ')
+            offsets[utt] = fark.tell()
+
+            if compress and array.ndim == 2 and array.size:
+                fark.write(b'\0BCM ' + _compress_matrix(array))
+                continue
+
+            dtype = np.float64 if array.dtype == np.float64 else np.float32
+            token = {(np.float32, 2): b'FM', (np.float64, 2): b'DM',
+                     (np.float32, 1): b'FV', (np.float64, 1): b'DV'}[
+                         (dtype, array.ndim)]
+
+            fark.write(b'\0B' + token + b' ')
+            for dim in array.shape:
+                fark.write(struct.pack('<bi', 4, dim))
+            fark.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+    return offsets
+
+
+def _compress_matrix(array):
+    """Return the bytes of `array` compressed in the Kaldi 'CM' format
+
+    This is a port of Kaldi's CompressedMatrix::CopyFromMat for the
+    kOneByteWithColHeaders method: each column is quantized on one
+    byte relatively to its 0, 25, 75 and 100 percentiles.
+
+    """
+    array = np.asarray(array, dtype=np.float32)
+    nrows, ncols = array.shape
+
+    # global header
+    min_value = float(array.min())
+    max_value = float(array.max())
+    if max_value == min_value:
+        max_value = min_value + (1.0 + abs(min_value))
+    prange = np.float32(max_value - min_value)
+    min_value = np.float32(min_value)
+
+    def float_to_uint16(value):
+        f = np.clip((value - min_value) / prange, 0.0, 1.0)
+        return np.floor(f * 65535 + 0.499).astype(np.int64)
+
+    def uint16_to_float(value):
+        return min_value + prange * np.float32(1.52590218966964e-05) * value
+
+    # per-column percentiles, as in Kaldi ComputeColHeader
+    sdata = np.sort(array, axis=0)
+    if nrows >= 5:
+        quarter = nrows // 4
+        rows = (0, quarter, 3 * quarter, nrows - 1)
+    else:
+        rows = tuple(min(i, nrows - 1) for i in range(4))
+    p0 = np.minimum(float_to_uint16(sdata[rows[0]]), 65532)
+    p25 = (np.minimum(np.maximum(float_to_uint16(sdata[rows[1]]), p0 + 1),
+                      65533) if nrows > 1 else p0 + 1)
+    p75 = (np.minimum(np.maximum(float_to_uint16(sdata[rows[2]]), p25 + 1),
+                      65534) if nrows > 2 else p25 + 1)
+    p100 = (np.maximum(float_to_uint16(sdata[rows[3]]), p75 + 1)
+            if nrows > 3 else p75 + 1)
+    headers = np.stack((p0, p25, p75, p100), axis=1).astype('<u2')
+
+    # quantize each value on one byte given its column percentiles
+    f0, f25, f75, f100 = (uint16_to_float(p) for p in (p0, p25, p75, p100))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        low = np.clip(np.floor(
+            (array - f0) / (f25 - f0) * 64 + 0.5), 0, 64)
+        mid = np.clip(64 + np.floor(
+            (array - f25) / (f75 - f25) * 128 + 0.5), 64, 192)
+        high = np.clip(192 + np.floor(
+            (array - f75) / (f100 - f75) * 63 + 0.5), 192, 255)
+    values = np.where(array < f25, low, np.where(array < f75, mid, high))
+
+    return (struct.pack('<ffii', min_value, prange, nrows, ncols) +
+            headers.tobytes() + values.T.astype(np.uint8).tobytes())
@@ -14,11 +14,14 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 """Wrapper for getting/setting Kaldi optional parameters"""
 
+import json
+import os
 import re
 import shlex
+import shutil
 import subprocess
 
-from abkhazia.utils import bool2str
+from abkhazia.utils import bool2str, cache_directory
 from abkhazia.kaldi.path import kaldi_path
 
 
@@ -87,19 +90,88 @@ def _type2str(t):
             list: 'list'}[t]
 
 
-def get_options(executable):
+def options_cache_file():
+    """Return the file caching the options of the Kaldi executables
+
+    The file is 'kaldi-options.json' in utils.cache_directory().
+
+    """
+    return os.path.join(cache_directory(), 'kaldi-options.json')
+
+
+def _load_cache(cache_file):
+    try:
+        with open(cache_file, 'r') as fin:
+            return json.load(fin)
+    except (IOError, ValueError):
+        # no cache yet or corrupted one, it will be rewritten
+        return {}
+
+
+def _save_cache(cache_file, cache):
+    # write to a temp file first, concurrent abkhazia calls never see
+    # a partially written cache
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = '{}.{}'.format(cache_file, os.getpid())
+        with open(tmp_file, 'w') as fout:
+            json.dump(cache, fout)
+        os.replace(tmp_file, cache_file)
+    except (IOError, OSError):
+        # the cache is an optimization, failing to write it is not
+        # an error
+        pass
+
+
+def get_options(executable, cache_file=None):
     """Return the options taken by `executable` as a dictionary of entries
 
     This function execute `executable --help` and parse the help
     message to build and return a dictionary of options[name] -> OptionEntry
 
+    The parsed options are cached in `cache_file` (default to
+    options_cache_file()), keyed by the absolute path of the
+    executable and invalidated when its modification time or size
+    changes. So the executable is run only once per Kaldi build.
+
     """
+    env = kaldi_path()
+    path = shutil.which(executable, path=env.get('PATH'))
+    if path is None:
+        raise RuntimeError('No such executable "{}"'.format(executable))
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    fingerprint = [stat.st_mtime_ns, stat.st_size]
+
+    if cache_file is None:
+        cache_file = options_cache_file()
+    cache = _load_cache(cache_file)
+    try:
+        cached = cache[path]
+        if cached['fingerprint'] == fingerprint:
+            return {name: OptionEntry(*entry)
+                    for name, entry in cached['options'].items()}
+    except (KeyError, TypeError):
+        pass
+
+    options = _parse_options(path, env)
+
+    cache[path] = {
+        'fingerprint': fingerprint,
+        'options': {name: [o.help, o.type, o.default, None]
+                    for name, o in options.items()}}
+    _save_cache(cache_file, cache)
+    return options
+
+
+def _parse_options(executable, env):
+    """Return the options of `executable` parsed from its help message"""
     try:
         # help message displayed on stderr with --help argument
         helpmsg = subprocess.Popen(
             shlex.split(executable + ' --help'),
             stderr=subprocess.PIPE,
-            env=kaldi_path()).communicate()[1].decode()
+            env=env).communicate()[1].decode()
     except OSError:
         raise RuntimeError('No such executable "{}"'.format(executable))
 
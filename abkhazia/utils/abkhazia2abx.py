@@ -19,6 +19,8 @@ from itertools import groupby, chain
 import abkhazia.utils as utils
 import joblib
 
+from abkhazia.align.alignment_columns import AlignmentColumns
+
 
 def alignment2item(corpus, alignment_file, item_file,
                    segment_extension='single_phone',
@@ -56,7 +58,9 @@ def alignment2item(corpus, alignment_file, item_file,
            utt_id tstart tstop phone
 
         Any utterance present in the alignment but not registered in
-        the corpus is ignored
+        the corpus is ignored. The alignment can also be in columnar
+        format (see abkhazia.align.AlignmentColumns), this is much
+        faster to read than text.
 
     item_file (filename): the item file to write
 
@@ -79,7 +83,8 @@ def alignment2item(corpus, alignment_file, item_file,
         all the parallel tasks
 
     ali_with_phone_proba (bool): True if phone posterior probabilities
-        are specified in the alignment file
+        are specified in the alignment file, ignored for a columnar
+        alignment
 
     Raise:
     ------
@@ -90,15 +95,26 @@ def alignment2item(corpus, alignment_file, item_file,
     """
     assert segment_extension in ('single_phone', 'triphone', 'half_triphone')
 
+    # the aligned utterances as (utt_id, [(start, stop, phone), ...])
+    if AlignmentColumns.is_columns(alignment_file):
+        utterances = (
+            (utt_id, [tuple(row[:3]) for row in rows])
+            for utt_id, rows in AlignmentColumns.load(
+                alignment_file).utterances())
+    else:
+        utterances = (
+            (utt_id, [parse_line(line, ali_with_phone_proba)
+                      for line in lines])
+            for utt_id, lines in groupby(
+                utils.open_utf8(alignment_file, mode='r'),
+                lambda line: line.split()[0]))
+
     # gather and process each aligned utterance in parallel
     items = joblib.Parallel(
         n_jobs=njobs, verbose=verbose, backend='threading')(
         joblib.delayed(_utt2item)
-        (utt_id, corpus, list(lines), segment_extension, exclude_phones,
-         ali_with_phone_proba)
-        for utt_id, lines in groupby(
-                utils.open_utf8(alignment_file, mode='r'),
-                lambda line: line.split()[0]))
+        (utt_id, corpus, phones, segment_extension, exclude_phones)
+        for utt_id, phones in utterances)
 
     # open output file and write items to it
     with utils.open_utf8(item_file, mode='w') as fout:
@@ -115,13 +131,17 @@ def parse_line(line, ali_with_phone_proba):
     return start, stop, phone
 
 
-def _utt2item(utt_id, corpus, lines, segment_extension, exclude_phones,
-              ali_with_phone_proba):
-    """Convert an utterance alignment to a list of items"""
+def _utt2item(utt_id, corpus, phones, segment_extension, exclude_phones):
+    """Convert an utterance alignment to a list of items
+
+    `phones` is the list of the (start, stop, phone) aligned in the
+    utterance.
+
+    """
     items = []
 
     # ensure the utterance is registered in the corpus
-    if utt_id not in corpus.utts():
+    if utt_id not in corpus.utt2spk:
         return items
 
     # get back the utterance's speaker
@@ -129,22 +149,20 @@ def _utt2item(utt_id, corpus, lines, segment_extension, exclude_phones,
 
     # use the first phone only in 'single_phone' case
     if segment_extension == 'single_phone':
-        start, stop, phone = parse_line(lines[0], ali_with_phone_proba)
+        start, stop, phone = phones[0]
         prev_phone = 'SIL'
-        if len(lines) == 1:
+        if len(phones) == 1:
             next_phone = 'SIL'
         else:
-            _, _, next_phone = parse_line(lines[1], ali_with_phone_proba)
+            _, _, next_phone = phones[1]
 
         _append_item(items, utt_id, start, stop, phone,
                      'SIL', next_phone, speaker, exclude_phones)
 
     # middle lines
-    for prev_line, line, next_line in zip(
-            lines[:-2], lines[1:-1], lines[2:]):
-        prev_start, prev_stop, prev_phone = parse_line(prev_line, ali_with_phone_proba)
-        start, stop, phone = parse_line(line, ali_with_phone_proba)
-        next_start, next_stop, next_phone = parse_line(next_line, ali_with_phone_proba)
+    for (prev_start, prev_stop, prev_phone), (start, stop, phone), (
+            next_start, next_stop, next_phone) in zip(
+                phones[:-2], phones[1:-1], phones[2:]):
 
         # setup start and stop according to the segment
         # extension
@@ -160,9 +178,9 @@ def _utt2item(utt_id, corpus, lines, segment_extension, exclude_phones,
 
     # use the last line only in 'single_phone' case (and don't process
     # twice the same line as first and last line)
-    if segment_extension == 'single_phone' and len(lines) > 1:
-        start, stop, phone = parse_line(lines[-1], ali_with_phone_proba)
-        _, _, prev_phone = parse_line(lines[-2], ali_with_phone_proba)
+    if segment_extension == 'single_phone' and len(phones) > 1:
+        start, stop, phone = phones[-1]
+        _, _, prev_phone = phones[-2]
 
         _append_item(items, utt_id, start, stop, phone,
                      prev_phone, 'SIL', speaker, exclude_phones)
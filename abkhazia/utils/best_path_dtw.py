@@ -12,80 +12,214 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
-""" Return the best dtw path"""
+"""Return the best dtw path
+
+This was created to get the word alignment from the phone level
+alignment. The dtw matrix is filled by anti-diagonals: the cells of
+an anti-diagonal only depend on the two previous ones and are
+computed at once with numpy, for a batch of utterances padded
+together. The phones are encoded as integers and only the
+backpointers of the matrix are stored, optionally restricted to a
+band around its diagonal (Sakoe-Chiba constraint).
+
+"""
 
-import abkhazia.utils as utils
-import os
-import sys
 import numpy as np
-from operator import itemgetter
-
-
-
-def dtw(alignment, list_phones, word_pos, utt_align):
-    """ Get the best path from dtw"""
-    """ This was created to get the """
-    """ word alignment from the phone level alignment"""
-    
-    # return if alignment of list of phones is empty 
-    # (can happen if utterance is just noise for example)
-    if (len(alignment) == 0) or (len(list_phones) == 0):
-        return []
-    word_alignment = []
-
-    # init dtw matrix
-    dtw = np.zeros((len(alignment),len(list_phones)))
-    dtw[0,:] = np.inf
-    dtw[:,0] = np.inf
-    dtw[0,0] = 0
-
-    # compute dtw costs
-    for i in range(1,len(alignment)):
-        for j in range(1,len(list_phones)):
-            cost = int(not alignment[i] == list_phones[j])
-            dtw[i,j] = cost + min([dtw[i-1,j], dtw[i,j-1], dtw[i-1, j-1]])
-    word_alignment.append(word_pos[-1])
-
-    # go backward to get the best path
-    i = len(alignment) - 1
-    j = len(list_phones) - 1
-    path = []
-    while (not i == 0 and not j == 0):
-        options = [dtw[i-1,j], dtw[i,j-1], dtw[i-1, j-1]]
-        idx, val = min(enumerate(options), key=itemgetter(1))
-        if idx == 0:
-            i = i-1
+
+
+def dtw(alignment, list_phones, word_pos, utt_align, window=None):
+    """Get the best path from dtw
+
+    alignment (list): the aligned phones
+
+    list_phones (list): the phones of the utterance transcription
+
+    word_pos (list): the word of each phone in `list_phones`
+
+    utt_align (list): the alignment lines, one per aligned phone
+
+    window (int): if specified, the best path deviates from the
+      diagonal of the dtw matrix by at most `window` phones, this
+      bounds the memory and time to O(len(alignment) * window).
+
+    Return the lines of `utt_align` suffixed by their word, at the
+    beginning of each word.
+
+    """
+    return dtw_batch(
+        [(alignment, list_phones, word_pos, utt_align)], window=window)[0]
+
+
+def dtw_batch(utterances, window=None, batch_size=256):
+    """Get the best dtw paths of several utterances at once
+
+    utterances (list): the (alignment, list_phones, word_pos,
+      utt_align) arguments of dtw() for each utterance
+
+    window (int): the Sakoe-Chiba band width, as in dtw()
+
+    batch_size (int): the number of utterances aligned together, the
+      utterances are sorted by length to limit the padding
+
+    Return the list of the complete alignments of the utterances, as
+    returned by dtw().
+
+    """
+    utterances = list(utterances)
+    result = [[] for _ in utterances]
+
+    # return if alignment of list of phones is empty (can happen if
+    # utterance is just noise for example)
+    todo = sorted(
+        (i for i, utt in enumerate(utterances) if len(utt[0]) and len(utt[1])),
+        key=lambda i: (len(utterances[i][0]), len(utterances[i][1])))
+
+    phone_ids = {}
+    for n in range(0, len(todo), batch_size):
+        batch = todo[n:n+batch_size]
+        xs = encode([utterances[i][0] for i in batch], phone_ids)
+        ys = encode([utterances[i][1] for i in batch], phone_ids)
+
+        for i, path in zip(batch, best_paths(xs, ys, window=window)):
+            word_pos, utt_align = utterances[i][2], utterances[i][3]
+            result[i] = _complete_alignment(
+                utt_align, _word_alignment(path, word_pos))
+    return result
+
+
+def encode(sequences, phone_ids):
+    """Return the phones `sequences` as arrays of integers
+
+    phone_ids (dict): phones mapped to their integer id, completed
+      with the new phones
+
+    """
+    return [np.fromiter(
+        (phone_ids.setdefault(p, len(phone_ids)) for p in seq),
+        dtype=np.int32, count=len(seq)) for seq in sequences]
+
+
+def band(n, m, window=None):
+    """Return the columns bounds of the rows of a n x m dtw matrix
+
+    Return two arrays `lo` and `hi` such that the row i of the matrix
+    is restricted to the columns lo[i] to hi[i] included. Without
+    `window`, the whole matrix is used.
+
+    The first row and column of the matrix are an initial state, so
+    the band is centered on a staircase going from (1, 1) to (n-1,
+    m-1) and widened by `window` on each side, any path in the band
+    is thus connected.
+
+    """
+    if window is None or n < 3 or m < 3:
+        return np.zeros(n, dtype=np.int64), np.full(n, m - 1, dtype=np.int64)
+
+    rows = np.arange(n)
+    stairs = 1 + (np.maximum(rows - 1, 0) * (m - 2)) // (n - 2)
+    lo = np.maximum(np.concatenate(([0, 1], stairs[1:-1])) - window, 0)
+    hi = np.minimum(stairs + window, m - 1)
+    lo[0], hi[0] = 0, 0
+    return lo, hi
+
+
+def best_paths(xs, ys, window=None):
+    """Return the best dtw paths for pairs of integer sequences
+
+    xs, ys (list of arrays): the sequences to align, xs[k] on the
+      rows and ys[k] on the columns of the k-th dtw matrix
+
+    window (int): the Sakoe-Chiba band width, as in dtw()
+
+    The dtw matrices are filled together by anti-diagonals. A path is
+    returned as the list of backtrace moves from the last cell of the
+    matrix: 0 goes up, 1 goes left and 2 goes diagonally.
+
+    """
+    nbatch = len(xs)
+    ns = np.array([len(x) for x in xs])
+    ms = np.array([len(y) for y in ys])
+    nmax, mmax = ns.max(), ms.max()
+
+    # padded sequences and band of each matrix
+    x = np.zeros((nbatch, nmax), dtype=np.int32)
+    y = np.zeros((nbatch, mmax), dtype=np.int32)
+    lo = np.zeros((nbatch, nmax), dtype=np.int64)
+    hi = np.full((nbatch, nmax), -1, dtype=np.int64)
+    for k in range(nbatch):
+        x[k, :ns[k]] = xs[k]
+        y[k, :ms[k]] = ys[k]
+        lo[k, :ns[k]], hi[k, :ns[k]] = band(ns[k], ms[k], window)
+
+    # backpointers of the cells in the band, row i of the matrix k
+    # is stored in pointers[k, i, :hi - lo + 1]
+    width = max(1, (hi - lo).max() + 1)
+    pointers = np.zeros((nbatch, nmax, width), dtype=np.int8)
+
+    # the two previous anti-diagonals, indexed by row
+    prev2 = np.full((nbatch, nmax), np.inf)
+    prev1 = np.full((nbatch, nmax), np.inf)
+    prev2[:, 0] = 0
+    for d in range(2, nmax + mmax - 1):
+        current = np.full((nbatch, nmax), np.inf)
+        rows = np.arange(max(1, d - mmax + 1), min(nmax - 1, d - 1) + 1)
+        cols = d - rows
+
+        valid = ((cols >= lo[:, rows]) & (cols <= hi[:, rows])
+                 & (cols < ms[:, None]))
+        if valid.any():
+            options = np.stack(
+                (prev1[:, rows - 1], prev1[:, rows], prev2[:, rows - 1]))
+            best = options.argmin(axis=0)
+            cost = (x[:, rows] != y[:, cols]) + options.min(axis=0)
+            current[:, rows] = np.where(valid, cost, np.inf)
+
+            k, c = np.nonzero(valid)
+            pointers[k, rows[c], cols[c] - lo[k, rows[c]]] = best[k, c]
+
+        prev2, prev1 = prev1, current
+
+    # go backward to get the best paths
+    paths = []
+    for k in range(nbatch):
+        i, j, path = ns[k] - 1, ms[k] - 1, []
+        while i != 0 and j != 0:
+            move = pointers[k, i, j - lo[k, i]]
+            path.append(move)
+            if move != 1:
+                i -= 1
+            if move != 0:
+                j -= 1
+        paths.append(path)
+    return paths
+
+
+def _word_alignment(path, word_pos):
+    """Return the word of each aligned phone from a backtrace path"""
+    j = len(word_pos) - 1
+    word_alignment = [word_pos[-1]]
+    for move in path:
+        if move == 0:
             word_alignment.append(word_pos[j])
-            path.append((i,j,word_pos[j]))
-            continue
-        elif idx == 1:
-            word_alignment.pop()
-            word_alignment.append(word_pos[j-1])
-            j = j-1
-            path.append((i,j,word_pos[j]))
-            continue
-        elif idx == 2:
+        elif move == 1:
+            word_alignment[-1] = word_pos[j-1]
+            j -= 1
+        else:
             word_alignment.append(word_pos[j-1])
-            i = i-1
-            j = j-1
-            path.append((i,j,word_pos[j]))
-            continue
+            j -= 1
 
-    # return alignment with words
     word_alignment.reverse()
+    return word_alignment
+
 
+def _complete_alignment(utt_align, word_alignment):
+    """Return alignment with words, at the beginning of each word"""
     prev_word = ''
     complete_alignment = []
-    for utt,word in zip(utt_align, word_alignment):
+    for utt, word in zip(utt_align, word_alignment):
         if word == prev_word:
-            prev_word = word
             complete_alignment.append(utt)
-            continue
         else:
             prev_word = word
-            complete_alignment.append(u'{} {}'.format(utt,word))
-
-    #complete_alignment = ['{} {}'.format(utt,word)
-    #        for utt, word in zip(utt_align,word_alignment)]
+            complete_alignment.append(u'{} {}'.format(utt, word))
     return complete_alignment
-
@@ -19,6 +19,19 @@ import re
 import shutil
 
 
+def cache_directory():
+    """Return the directory where abkhazia caches data for the user
+
+    The directory is 'abkhazia' in $XDG_CACHE_HOME, default to
+    ~/.cache. It is not created.
+
+    """
+    return os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or
+        os.path.join(os.path.expanduser('~'), '.cache'),
+        'abkhazia')
+
+
 def list_directory(directory, abspath=False):
     """Return os.listdir(directory) with .DS_Store filtered out"""
     lsd = [e for e in os.listdir(directory) if e != '.DS_Store']
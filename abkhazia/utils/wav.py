@@ -20,15 +20,244 @@ that is 16 bits, 16 kHz mono wav files.
 """
 
 import collections
-import contextlib
+import importlib.util
+import itertools
+import math
 import os
 import shlex
 import shutil
+import struct
 import subprocess
-import wave
 
-import joblib
-from . import config
+import numpy as np
+
+from . import config, logger
+
+
+class UnsupportedAudio(Exception):
+    """Raised when an audio file cannot be decoded in process"""
+
+
+class ConversionError(IOError):
+    """Raised by convert() when some files cannot be converted
+
+    The `failed` attribute is the list of the input files not
+    converted.
+
+    """
+    def __init__(self, message, failed):
+        super(ConversionError, self).__init__(message)
+        self.failed = failed
+
+
+def _require(command):
+    """Raise OSError if `command` is not installed on the system"""
+    if not _which(command):
+        raise OSError('{} is not installed on your system'.format(command))
+
+
+_which_cache = {}
+
+
+def _which(command):
+    """Return the path to `command` or None, cached across calls"""
+    if command not in _which_cache:
+        _which_cache[command] = shutil.which(command)
+    return _which_cache[command]
+
+
+def _pcm_to_float(data, width, comptype='NONE', byteorder='<'):
+    """Return the raw audio `data` as an array of float32 in [-1, 1]"""
+    if comptype == 'ULAW':
+        return _ULAW[np.frombuffer(data, dtype=np.uint8)]
+    if comptype == 'ALAW':
+        return _ALAW[np.frombuffer(data, dtype=np.uint8)]
+    if comptype == 'FLOAT' and width in (4, 8):
+        return np.frombuffer(
+            data, dtype='{}f{}'.format(byteorder, width)).astype(np.float32)
+    if comptype != 'NONE':
+        raise UnsupportedAudio('unsupported encoding {}'.format(comptype))
+
+    if width == 1:  # 8 bits samples are unsigned
+        return (np.frombuffer(data, dtype=np.uint8).astype(np.float32)
+                - 128) / 128
+    if width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        if byteorder == '>':
+            raw = raw[:, ::-1]
+        samples = (raw[:, 0].astype(np.int32) | raw[:, 1].astype(np.int32) << 8
+                   | raw[:, 2].astype(np.int8).astype(np.int32) << 16)
+        return samples.astype(np.float32) / (1 << 23)
+    if width in (2, 4):
+        return np.frombuffer(
+            data, dtype='{}i{}'.format(byteorder, width)).astype(
+                np.float32) / (1 << (8 * width - 1))
+    raise UnsupportedAudio('unsupported sample width {}'.format(width))
+
+
+def _g711_tables():
+    """Return the u-law and A-law decoding tables (ITU G.711)"""
+    codes = np.arange(256)
+
+    ulaw = ~codes & 0xFF
+    exponent, mantissa = (ulaw >> 4) & 7, ulaw & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    ulaw = np.where(ulaw & 0x80, -magnitude, magnitude)
+
+    alaw = codes ^ 0x55
+    exponent, mantissa = (alaw >> 4) & 7, alaw & 0x0F
+    magnitude = np.where(
+        exponent == 0, (mantissa << 4) + 8,
+        ((mantissa << 4) + 0x108) << np.maximum(exponent - 1, 0))
+    alaw = np.where(alaw & 0x80, magnitude, -magnitude)
+
+    return (ulaw.astype(np.float32) / 32768, alaw.astype(np.float32) / 32768)
+
+
+_ULAW, _ALAW = _g711_tables()
+
+
+def _decode_wav(wav):
+    """Return (samples, rate) from a wav file, see decoders"""
+    with open(wav, 'rb') as fin:
+        meta, offset = _scan_fd(wav, fin.fileno())
+        if meta.error:
+            raise IOError(meta.error)
+        fin.seek(offset)
+        data = fin.read(meta.nframes * meta.nbc * meta.width)
+
+    samples = _pcm_to_float(data, meta.width, meta.comptype)
+    return samples.reshape(-1, meta.nbc), meta.rate
+
+
+def _decode_sph(sph):
+    """Return (samples, rate) from a NIST SPHERE file, see decoders"""
+    with open(sph, 'rb') as fin:
+        head = fin.read(1024)
+        if not head.startswith(b'NIST_1A'):
+            raise IOError('{} is not a NIST SPHERE file'.format(sph))
+        header_size = int(head.split(b'\n')[1])
+        if header_size > len(head):
+            head += fin.read(header_size - len(head))
+
+        # header lines are 'name -type value'
+        fields = {}
+        for line in head[:header_size].split(b'\n')[2:]:
+            line = line.decode('ascii', errors='replace').split(None, 2)
+            if line and line[0] == 'end_head':
+                break
+            if len(line) == 3:
+                fields[line[0]] = line[2].strip()
+
+        coding = fields.get('sample_coding', 'pcm')
+        if 'shorten' in coding:
+            raise UnsupportedAudio('shorten compressed SPHERE')
+        comptype = {'pcm': 'NONE', 'ulaw': 'ULAW', 'mu-law': 'ULAW',
+                    'alaw': 'ALAW'}.get(coding.split(',')[0], coding)
+        nbc = int(fields.get('channel_count', 1))
+        width = int(fields.get('sample_n_bytes', 2))
+        byteorder = '>' if fields.get('sample_byte_format') == '10' else '<'
+
+        fin.seek(header_size)
+        size = int(fields.get('sample_count', -1)) * nbc * width
+        data = fin.read() if size < 0 else fin.read(size)
+
+    data = data[:len(data) // (nbc * width) * nbc * width]
+    samples = _pcm_to_float(data, width, comptype, byteorder)
+    return samples.reshape(-1, nbc), int(fields['sample_rate'])
+
+
+def _decode_flac(flac):
+    """Return (samples, rate) from a flac file, see decoders
+
+    Relies on the optional soundfile module, installed with the
+    'audio' extra of abkhazia.
+
+    """
+    # last moment import, soundfile is an optional dependency
+    try:
+        import soundfile
+    except ImportError:
+        raise UnsupportedAudio('soundfile is not installed')
+
+    samples, rate = soundfile.read(flac, dtype='float32', always_2d=True)
+    return samples, rate
+
+
+decoders = {'wav': _decode_wav, 'sph': _decode_sph, 'flac': _decode_flac}
+"""In process decoders, as {audio format: function}
+
+A decoder takes an audio file and returns a pair (samples, rate)
+where samples is an array of float in [-1, 1] of shape (nframes,
+nchannels). It raises UnsupportedAudio to delegate the conversion to
+an external tool (see the `external` dict).
+
+"""
+
+
+resample_zeros = 16
+"""number of zero crossings on each side of the resampling filter"""
+
+
+def _resample(samples, rate_in, rate_out):
+    """Resample the 1D array `samples` from `rate_in` to `rate_out` Hz
+
+    Polyphase windowed sinc interpolation: the output sample n is at
+    the position t = n * rate_in / rate_out in the input and is
+    computed from the inputs around t. The output samples sharing
+    the same fractional part of t (the same phase) share the same
+    filter taps.
+
+    """
+    gcd = math.gcd(rate_in, rate_out)
+    up, down = rate_out // gcd, rate_in // gcd
+    if up == down:
+        return samples
+
+    # low pass below the smallest Nyquist frequency
+    cutoff = min(1.0, up / down)
+    half = int(math.ceil(resample_zeros / cutoff))
+    taps = np.arange(-half + 1, half + 1)
+
+    nout = int(math.ceil(len(samples) * up / down))
+    padded = np.concatenate((
+        np.zeros(half, dtype=np.float32), samples,
+        np.zeros(half + down, dtype=np.float32)))
+    output = np.empty(nout, dtype=np.float32)
+
+    for phase in range(min(up, nout)):
+        # for the outputs phase + k*up, t = base + k*down + frac
+        base, frac = divmod(phase * down, up)
+        frac /= up
+        # distances from t to the inputs in the window
+        x = frac - taps
+        window = np.i0(8.6 * np.sqrt(np.clip(1 - (x / half) ** 2, 0, 1)))
+        weights = (cutoff * np.sinc(cutoff * x) *
+                   window / np.i0(8.6)).astype(np.float32)
+
+        count = len(range(phase, nout, up))
+        windows = np.lib.stride_tricks.as_strided(
+            padded[base + 1:], shape=(count, 2 * half),
+            strides=(down * padded.strides[0], padded.strides[0]))
+        output[phase::up] = windows @ weights
+
+    return output
+
+
+def _to_pcm16(samples, rate):
+    """Return 16 bits, 16 kHz mono audio data from decoded samples"""
+    mono = samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+    mono = _resample(mono.astype(np.float32), rate, 16000)
+    return np.clip(np.round(mono * 32768), -32768, 32767).astype('<i2')
+
+
+def _write_pcm16(wav, data):
+    """Write the 16 kHz mono 16 bits `data` to the file `wav`"""
+    meta = _metawav(1, 2, 16000, len(data), 'NONE', 'not compressed',
+                    len(data) / 16000.)
+    with open(wav, 'wb') as fout:
+        fout.write(_header(meta, len(data)))
+        fout.write(data.tobytes())
 
 
 def wav2wav(wav_in, wav_out, copy=True):
@@ -41,10 +270,10 @@ def wav2wav(wav_in, wav_out, copy=True):
     info = _scan_one(wav_in)
     if info.rate != 16000 or info.nbc != 1 or info.width != 2:
         # convert the file to the desired audio format
-        command = ('sox -c 1 -b 16 {} -t wav {} rate 16k'
-                   .format(wav_in, wav_out))
-
-        subprocess.call(shlex.split(command))
+        try:
+            _write_pcm16(wav_out, _to_pcm16(*_decode_wav(wav_in)))
+        except UnsupportedAudio:
+            _sox(wav_in, wav_out)
 
     elif copy:
         shutil.copy(wav_in, wav_out)
@@ -52,13 +281,12 @@ def wav2wav(wav_in, wav_out, copy=True):
         os.symlink(wav_in, wav_out)
 
 
-# a little trick to send wav2wav to joblib
-def _wav2wav_link(i, o):
-    return wav2wav(i, o, copy=False)
-
-
-def _wav2wav_copy(i, o):
-    return wav2wav(i, o, copy=True)
+def _sox(audio, wav):
+    """Convert `audio` to 16 bits 16 kHz mono `wav` with sox"""
+    _require('sox')
+    command = ('sox {} -c 1 -b 16 -t wav {} rate 16k'
+               .format(audio, wav))
+    subprocess.check_call(shlex.split(command))
 
 
 def flac2wav(flac, wav):
@@ -68,15 +296,7 @@ def flac2wav(flac, wav):
     'wav' is the filename of the created file
 
     """
-    try:
-        subprocess.check_output(shlex.split('which sox'))
-    except:
-        raise OSError('sox is not installed on your system')
-
-    command = ('sox -c 1 -b 16 {} -t wav {} rate 16k'
-               .format(flac, wav))
-
-    subprocess.call(shlex.split(command))
+    _sox(flac, wav)
 
 
 def sph2wav(sph, wav):
@@ -86,7 +306,8 @@ def sph2wav(sph, wav):
     'wav' if the filename of the created file
 
     sph2pipe is required for converting sph to wav. This function look
-    at it in the abkhazia configuration file.
+    at it in the abkhazia configuration file. The output is resampled
+    if necessary.
 
     """
     sph2pipe = os.path.join(
@@ -97,7 +318,11 @@ def sph2wav(sph, wav):
         raise OSError('sph2pipe not found on your system')
 
     command = sph2pipe + ' -f wav {} {}'.format(sph, wav)
-    subprocess.call(shlex.split(command))
+    subprocess.check_call(shlex.split(command))
+
+    info = _scan_one(wav)
+    if info.rate != 16000 or info.nbc != 1 or info.width != 2:
+        _write_pcm16(wav, _to_pcm16(*_decode_wav(wav)))
 
 
 def shn2wav(shn, wav):
@@ -117,10 +342,7 @@ def shn2wav(shn, wav):
     """
     # check shorten and sox commands are available
     for cmd in ['shorten', 'sox']:
-        try:
-            subprocess.check_output(shlex.split('which {}'.format(cmd)))
-        except:
-            raise OSError('{} is not installed on your system'.format(cmd))
+        _require(cmd)
 
     command1 = 'shorten -x {} -'.format(shn)
     command2 = ('sox -t raw -r 16000 -e signed-integer -b 16 - -t wav {}'
@@ -131,7 +353,47 @@ def shn2wav(shn, wav):
     ps.wait()
 
 
-def convert(inputs, outputs, fileformat, njobs=1, verbose=0, copy=False):
+external = {'flac': flac2wav, 'sph': sph2wav, 'shn': shn2wav, 'wav': _sox}
+"""Conversions relying on external tools, as {audio format: function}
+
+They are used for the formats not supported by the in process
+decoders, or when the decoder raises UnsupportedAudio.
+
+"""
+
+
+def _convert_one(audio, wav, fileformat, copy, native):
+    """Convert `audio` to `wav`, return None or an error message"""
+    try:
+        if fileformat == 'wav':
+            info = _scan_one(audio)
+            if info.rate == 16000 and info.nbc == 1 and info.width == 2:
+                if copy:
+                    shutil.copy(audio, wav)
+                else:
+                    os.symlink(audio, wav)
+                return None
+
+        if native and fileformat in decoders:
+            try:
+                _write_pcm16(wav, _to_pcm16(*decoders[fileformat](audio)))
+                return None
+            except UnsupportedAudio:
+                pass
+
+        external[fileformat](audio, wav)
+        return None
+    except Exception as err:
+        return '{}: {}'.format(audio, err)
+
+
+def _convert_batch(audios, wavs, fileformat, copy, native):
+    return [_convert_one(audio, wav, fileformat, copy, native)
+            for audio, wav in zip(audios, wavs)]
+
+
+def convert(inputs, outputs, fileformat, njobs=1, verbose=0, copy=False,
+            native=True, log=logger.null_logger()):
     """Convert a range of audio files to the wav format
 
     inputs: list of input files to convert
@@ -145,21 +407,24 @@ def convert(inputs, outputs, fileformat, njobs=1, verbose=0, copy=False):
 
     copy: only for wavs input, see wav2wav
 
+    log: where to send log messages
+
+    native: if True, the files are decoded and resampled in process
+        when supported (see the `decoders` dict), else they are
+        converted with external tools (see the `external` dict).
+
     We must have len(inputs) == len(wavs), all files in inputs must
-    exist. For details on the verbose level, please refeer to the
-    joblib documentation.
+    exist. The conversions run in a pool of `njobs` processes, by
+    batches of at most scan_batch_size files, each process getting at
+    least one batch. A conversion error does not
+    stop the other conversions, the failed files are reported in the
+    ConversionError (an IOError) raised at the end. For details on
+    the verbose level, please refeer to the joblib documentation.
 
     """
-    # mapping from file format to conversion function
-    try:
-        fnc = {
-            'flac': flac2wav,
-            'sph': sph2wav,
-            'shn': shn2wav,
-            'wav': _wav2wav_copy if copy else _wav2wav_link
-        }[fileformat]
-    except KeyError:
+    if fileformat not in external:
         raise IOError('{} is not a supported format'.format(fileformat))
+    inputs, outputs = list(inputs), list(outputs)
 
     # assert inputs and outputs have the same size
     if not len(inputs) == len(outputs):
@@ -170,33 +435,194 @@ def convert(inputs, outputs, fileformat, njobs=1, verbose=0, copy=False):
         if not os.path.isfile(i):
             raise IOError('input file does not exist: {}'.format(i))
 
-    # convert files in parallel
-    joblib.Parallel(
-        n_jobs=njobs, verbose=verbose, backend='threading')(
-            joblib.delayed(fnc)(i, o) for i, o in zip(inputs, outputs))
+    # the decoders run in the worker processes, tell here (and once)
+    # the flac files are all delegated to sox
+    if (native and fileformat == 'flac' and inputs
+            and importlib.util.find_spec('soundfile') is None):
+        log.info(
+            'soundfile is not installed, converting flac files with '
+            'sox, install the "audio" extra of abkhazia for a faster '
+            'conversion')
+
+    # convert files in parallel (joblib is slow to import, so it is
+    # imported only when needed)
+    import joblib
+    batch_size = max(1, min(
+        scan_batch_size, len(inputs) // max(1, njobs) + 1))
+    batches = [(inputs[i:i+batch_size], outputs[i:i+batch_size])
+               for i in range(0, len(inputs), batch_size)]
+    errors = [
+        (audio, error) for (audios, _), batch in zip(
+            batches, joblib.Parallel(n_jobs=njobs, verbose=verbose)(
+                joblib.delayed(_convert_batch)(
+                    i, o, fileformat, copy, native) for i, o in batches))
+        for audio, error in zip(audios, batch) if error]
+
+    if errors:
+        raise ConversionError(
+            'failed to convert {} files: {}'.format(
+                len(errors), '\n'.join(e for _, e in errors)),
+            [audio for audio, _ in errors])
 
 
 _metawav = collections.namedtuple(
-    '_metawav', 'nbc width rate nframes comptype compname duration')
+    '_metawav', 'nbc width rate nframes comptype compname duration error',
+    defaults=(None,))
+"""Meta information on a wav file
+
+The fields are the ones of wave.getparams() plus the duration in
+seconds. When the file cannot be parsed, `error` is a str describing
+the problem and the other fields are null.
+
+"""
+
+
+# audio formats from the fmt chunk mapped to (comptype, compname)
+_FORMATS = {
+    0x0001: ('NONE', 'not compressed'),
+    0x0003: ('FLOAT', 'IEEE float'),
+    0x0006: ('ALAW', 'A-law'),
+    0x0007: ('ULAW', 'u-law')}
+
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def _scan_error(message):
+    return _metawav(0, 0, 0, 0, 'NONE', 'not compressed', 0.0, message)
 
 
 def _scan_one(wav):
-    """scan a single wav file and return a metawav tuple"""
+    """scan a single wav file and return a metawav tuple
+
+    Parse the RIFF header directly, reading only the chunk headers
+    and the fmt chunk. Never raise, errors are reported in the
+    `error` field of the returned tuple.
+
+    """
     try:
-        param = wave.open(wav, 'r').getparams()
-        return _metawav(
-            param[0], param[1], param[2],
-            param[3], param[4], param[5],
-            param[3]/float(param[2]))  # duration
-    except EOFError:
-        return _metawav(nframes=0)
+        fd = os.open(wav, os.O_RDONLY)
+    except OSError as err:
+        return _scan_error('cannot open {}: {}'.format(wav, err.strerror))
+
+    try:
+        return _scan_fd(wav, fd)[0]
+    finally:
+        os.close(fd)
+
 
+def _scan_fd(wav, fd, base=0, size=None):
+    """Return (metawav, data_offset) parsed from the opened `wav`
 
-def scan(wavs, njobs=1, verbose=0):
+    data_offset is the position of the audio data in the file, or
+    None on error.
+
+    The wav may be stored at the offset `base` of a larger file, in
+    `size` bytes (by default up to the end of the file).
+
+    """
+    try:
+        if size is None:
+            size = os.fstat(fd).st_size - base
+        # most headers fit in the first 512 bytes
+        head = os.pread(fd, min(512, size), base)
+
+        def read(offset, n):
+            if offset + n <= len(head):
+                return head[offset:offset+n]
+            return os.pread(fd, min(n, size - offset), base + offset)
+
+        if len(head) < 12 or head[:4] != b'RIFF' or head[8:12] != b'WAVE':
+            return _scan_error('{} is not a RIFF/WAVE file'.format(wav)), None
+
+        fmt, pos = None, 12
+        while pos + 8 <= size:
+            chunk_id, chunk_size = struct.unpack('<4sI', read(pos, 8))
+
+            if chunk_id == b'fmt ':
+                fmt = read(pos + 8, min(chunk_size, 40))
+                if len(fmt) < 16:
+                    return _scan_error(
+                        '{}: truncated fmt chunk'.format(wav)), None
+
+            elif chunk_id == b'data':
+                if fmt is None:
+                    return _scan_error(
+                        '{}: data chunk before fmt chunk'.format(wav)), None
+
+                fmt_code, nbc, rate, _, block_align, bits = struct.unpack(
+                    '<HHIIHH', fmt[:16])
+                if fmt_code == _WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                    # the actual format is the beginning of the subformat
+                    fmt_code = struct.unpack('<H', fmt[24:26])[0]
+                if not nbc or not rate or not block_align:
+                    return _scan_error(
+                        '{}: invalid fmt chunk'.format(wav)), None
+
+                # the data size may be wrong on streamed or truncated
+                # files, keep what is really in the file
+                chunk_size = min(chunk_size, size - pos - 8)
+                nframes = chunk_size // block_align
+                comptype, compname = _FORMATS.get(
+                    fmt_code, ('0x{:04X}'.format(fmt_code), 'unknown'))
+                return _metawav(
+                    nbc, (bits + 7) // 8, rate, nframes, comptype,
+                    compname, nframes / float(rate)), base + pos + 8
+
+            # chunks are word aligned
+            pos += 8 + chunk_size + (chunk_size & 1)
+
+        return _scan_error('{}: data chunk not found'.format(wav)), None
+    except (OSError, struct.error) as err:
+        return _scan_error('cannot read {}: {}'.format(wav, err)), None
+
+
+def _scan_batch(wavs):
+    """scan a list of wavs and return a list of metawav tuples"""
+    return [_scan_one(wav) for wav in wavs]
+
+
+def scan_members(path, members):
+    """Return meta information on wavs stored in the file `path`
+
+    This is the equivalent of scan() for wavs concatenated in a larger
+    file, opened only once. `members` is a list of (wav, offset,
+    length) giving the location of each wav in the file. Return a
+    dict {wav: metainfo}.
+
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as err:
+        error = _scan_error('cannot open {}: {}'.format(path, err.strerror))
+        return {wav: error for wav, _, _ in members}
+
+    try:
+        return {wav: _scan_fd(wav, fd, offset, length)[0]
+                for wav, offset, length in members}
+    finally:
+        os.close(fd)
+
+
+def fingerprint(wav):
+    """Return the (mtime, size) of a wav file to detect modifications"""
+    stat = os.stat(wav)
+    return stat.st_mtime_ns, stat.st_size
+
+
+scan_batch_size = 1000
+"""maximal number of wavs scanned by a single job in scan()"""
+
+
+def scan(wavs, njobs=1, verbose=0, cache=None):
     """Return meta information on the input `wavs` files
 
     wavs : a list of absolute paths to wav files
-    njobs : the number of parallel scans
+    njobs : the number of parallel processes
+    cache : an optional dict storing the meta information across
+      calls, as {wav: (fingerprint, metainfo)}. Only the wavs missing
+      from the cache or modified since their last scan (as detected
+      by their mtime and size) are scanned. The dict is updated in
+      place.
 
     The returned dict 'metainfo' have wavs for keys and the following
     named tuple as value:
@@ -208,17 +634,227 @@ def scan(wavs, njobs=1, verbose=0):
         metainfo = scan(wavs)
         d = metainfo[wavs[2]].duration
 
-    See the documentation of wave.getparams() for details.
+    See the documentation of wave.getparams() for details. The header
+    of the wav files is parsed directly (WAVE_FORMAT_EXTENSIBLE is
+    supported). Malformed files do not raise, but have the `error`
+    field of their metainfo set to an error message.
+
+    """
+    if cache is None:
+        cache = {}
+
+    def _fingerprint(wav):
+        try:
+            return fingerprint(wav)
+        except OSError:  # reported as an error by _scan_one
+            return None
+
+    wavs = list(wavs)
+    fingerprints = {wav: _fingerprint(wav) for wav in wavs}
+    outdated = [wav for wav in wavs
+                if fingerprints[wav] is None or wav not in cache
+                or cache[wav][0] != fingerprints[wav]]
+
+    if outdated:
+        import joblib
+
+        # scan the wavs in large batches distributed over processes
+        batch_size = max(1, min(
+            scan_batch_size, len(outdated) // max(1, njobs) + 1))
+        batches = [outdated[i:i+batch_size]
+                   for i in range(0, len(outdated), batch_size)]
+
+        res = joblib.Parallel(n_jobs=njobs, verbose=verbose)(
+            joblib.delayed(_scan_batch)(batch) for batch in batches)
+
+        for wav, meta in zip(outdated, itertools.chain(*res)):
+            cache[wav] = (fingerprints[wav], meta)
+
+    return {wav: cache[wav][1] for wav in wavs}
+
+
+def duration(wav, cache=None):
+    """Return the duration of a wav file in seconds
+
+    See scan() for a description of `cache`.
+
+    Raise IOError if the wav file cannot be parsed.
+
+    """
+    meta = (_scan_one(wav) if cache is None
+            else scan([wav], cache=cache)[wav])
+    if meta.error:
+        raise IOError(meta.error)
+    return meta.duration
+
+
+copy_block_size = 1 << 20
+"""size in bytes of the blocks copied at once by merge()"""
+
+
+def _header(meta, nframes):
+    """Return a canonical RIFF/WAVE header for `nframes` frames"""
+    codes = {comptype: code for code, (comptype, _) in _FORMATS.items()}
+    if meta.comptype not in codes:
+        raise IOError('unsupported audio format {}'.format(meta.comptype))
+
+    block_align = meta.nbc * meta.width
+    data_size = nframes * block_align
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size + (data_size & 1), b'WAVE',
+        b'fmt ', 16, codes[meta.comptype], meta.nbc, meta.rate,
+        meta.rate * block_align, block_align, meta.width * 8,
+        b'data', data_size)
+
+
+def copy_range(fin, fout, offset, size):
+    """Append `size` bytes from `offset` in `fin` to `fout`
+
+    Use copy_file_range when available, so that the data does not go
+    through user space, else copy blocks of copy_block_size bytes.
 
     """
-    res = joblib.Parallel(
-        n_jobs=njobs, verbose=verbose, backend="threading")(
-            joblib.delayed(_scan_one)(wav) for wav in wavs)
+    while size > 0:
+        count = min(size, copy_block_size)
+        try:
+            copied = os.copy_file_range(fin, fout, count, offset)
+        except (AttributeError, OSError):
+            # not supported by the Python version, the kernel or the
+            # filesystems
+            copied = 0
+
+        if not copied:
+            data = os.pread(fin, count, offset)
+            if len(data) != count:
+                raise IOError('unexpected end of file')
+            copied = os.write(fout, data)
+
+        offset += copied
+        size -= copied
 
-    return dict(zip(wavs, res))
 
+def _format(meta):
+    """Return the audio format of a metawav as a tuple"""
+    return meta.nbc, meta.width, meta.rate, meta.comptype
 
-def duration(wav):
-    """Return the duration of a wav file in seconds"""
-    with contextlib.closing(wave.open(wav, 'r')) as w:
-        return w.getnframes() / float(w.getframerate())
+
+def merge(inputs, output, padding=0.):
+    """Concatenate the wav files `inputs` into the wav file `output`
+
+    inputs : the list of wav files to merge, they must all have the
+      same format (channels, width, rate and encoding).
+
+    output : the merged wav file, the header is computed from the
+      inputs headers and the audio data is copied by blocks, so that
+      memory usage does not depend on the wavs size.
+
+    padding : duration of silence inserted between the inputs (in
+      seconds), rounded to the closest number of frames.
+
+    Return the metawav tuple of `output` (see scan()).
+
+    Raise IOError if an input cannot be parsed or if the inputs have
+    different formats.
+
+    """
+    if not inputs:
+        raise IOError('no wav to merge in {}'.format(output))
+
+    fds = []
+    try:
+        headers = []
+        for wav in inputs:
+            fds.append(os.open(wav, os.O_RDONLY))
+            meta, offset = _scan_fd(wav, fds[-1])
+            if meta.error:
+                raise IOError(meta.error)
+            if headers and _format(meta) != _format(headers[0][0]):
+                raise IOError(
+                    'cannot merge wavs of different formats: {} and {}'
+                    .format(inputs[0], wav))
+            headers.append((meta, offset))
+
+        meta = headers[0][0]
+        block_align = meta.nbc * meta.width
+        pad_frames = int(round(meta.rate * padding))
+        nframes = (sum(m.nframes for m, _ in headers) +
+                   pad_frames * (len(headers) - 1))
+
+        fds.append(os.open(
+            output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666))
+        fout = fds[-1]
+        os.write(fout, _header(meta, nframes))
+        for i, (meta_in, offset) in enumerate(headers):
+            if i and pad_frames:
+                os.write(fout, bytes(pad_frames * block_align))
+            copy_range(fds[i], fout, offset, meta_in.nframes * block_align)
+        if nframes * block_align & 1:
+            os.write(fout, b'\0')
+
+        return meta._replace(
+            nframes=nframes, duration=nframes / float(meta.rate))
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+def trim(wav_in, wav_out, ranges):
+    """Copy the wav file `wav_in` to `wav_out` without the time `ranges`
+
+    ranges : list of (start, stop) time intervals to remove from the
+      wav, in seconds. They are rounded to the closest frames and
+      overlapping intervals are merged.
+
+    Only the kept parts of the audio data are copied (see merge), the
+    header of `wav_out` is computed from the one of `wav_in`.
+
+    Return a pair (meta, removed) with the metawav tuple of `wav_out`
+    and the removed frames as a sorted list of (start, stop) frame
+    intervals, with no overlap.
+
+    Raise IOError if `wav_in` cannot be parsed.
+
+    """
+    fin = os.open(wav_in, os.O_RDONLY)
+    try:
+        meta, offset = _scan_fd(wav_in, fin)
+        if meta.error:
+            raise IOError(meta.error)
+
+        # frame intervals to remove, sorted and merged
+        removed = []
+        for start, stop in sorted(
+                (max(int(round(start * meta.rate)), 0),
+                 min(int(round(stop * meta.rate)), meta.nframes))
+                for start, stop in ranges):
+            if start >= stop:
+                continue
+            if removed and start <= removed[-1][1]:
+                removed[-1] = (removed[-1][0], max(removed[-1][1], stop))
+            else:
+                removed.append((start, stop))
+
+        # the complementary frame intervals are kept
+        bounds = [0] + [f for r in removed for f in r] + [meta.nframes]
+        kept = [(start, stop) for start, stop in zip(bounds[::2], bounds[1::2])
+                if start < stop]
+        nframes = sum(stop - start for start, stop in kept)
+
+        block_align = meta.nbc * meta.width
+        fout = os.open(
+            wav_out, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            os.write(fout, _header(meta, nframes))
+            for start, stop in kept:
+                copy_range(fin, fout, offset + start * block_align,
+                           (stop - start) * block_align)
+            if nframes * block_align & 1:
+                os.write(fout, b'\0')
+        finally:
+            os.close(fout)
+
+        return meta._replace(
+            nframes=nframes, duration=nframes / float(meta.rate)), removed
+    finally:
+        os.close(fin)
@@ -47,6 +47,9 @@ setup(
     # install python dependencies from PyPI
     install_requires=REQUIREMENTS,
 
+    # optional dependencies, 'audio' decodes flac files in process
+    extras_require={'audio': ['soundfile']},
+
     # include any files in abkhazia/share and abkhazia.conf
     package_data={'abkhazia': ['share/*.*']},
 
@@ -27,6 +27,19 @@ from abkhazia.language import LanguageModel
 import abkhazia.acoustic as acoustic
 
 
+@pytest.fixture(scope='session', autouse=True)
+def cache_directory(tmpdir_factory):
+    """Do not write the abkhazia caches in the user cache directory"""
+    cache = os.environ.get('XDG_CACHE_HOME')
+    os.environ['XDG_CACHE_HOME'] = str(tmpdir_factory.mktemp('cache'))
+    yield os.environ['XDG_CACHE_HOME']
+
+    if cache is None:
+        del os.environ['XDG_CACHE_HOME']
+    else:
+        os.environ['XDG_CACHE_HOME'] = cache
+
+
 def assert_no_expr_in_log(flog, expr='error'):
     """Raise if `expr` is found in flog"""
     assert os.path.isfile(flog)
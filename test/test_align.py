@@ -15,6 +15,7 @@
 """Test of the abkhazia.align module"""
 
 import os
+import numpy as np
 import pytest
 import abkhazia.align as align
 from abkhazia import utils
@@ -116,3 +117,61 @@ def test_align(
             res = [l.strip() for l in utils.open_utf8(ali_file, 'r')
                    if l.startswith('s0102a-sent17')]
             assert res == expected_ali[level]
+
+
+def test_decode_alignment():
+    ali = {'utt1': '1 3 ; 2 2', 'utt2': '3 1', 'utt3': ''}
+    post = {'utt1': '1 1 0.4 0.5 0.5', 'utt2': '0.2', 'utt3': ''}
+    utt_ids, codes, start, stop, mpost = align.align.decode_alignment(
+        ali, post)
+
+    assert utt_ids == ['utt1', 'utt1', 'utt2']
+    assert codes == ['1', '2', '3']
+    assert start == pytest.approx([0, 0.0375, 0])
+    assert stop == pytest.approx([0.0375, 0.065, 0.025])
+    assert mpost == pytest.approx([0.8, 0.5, 0.2])
+
+    assert align.align.decode_alignment(ali)[-1] is None
+
+
+def test_align_words():
+    phones = ['SIL', 'dh', 'ae', 't', 'SIL', 'ae', 'ae', 'b', 'SIL']
+    words = [['dh', 'ae', 't'], ['ae', 'ae'], ['b']]
+    assert align.align.align_words(phones, words) == [1, 5, 7]
+
+    # mismatch on the first word, the next one is searched from the
+    # start
+    words = [['dh', 'x', 't'], None, ['ae', 'ae'], ['b']]
+    assert align.align.align_words(phones, words) == [None, None, 2, 7]
+
+    # with fallback the mismatch is a substitution
+    assert align.align.align_words(
+        phones, words, silences=['SIL'], fallback=True) == [1, None, 5, 7]
+
+
+@pytest.mark.parametrize('level, post', params)
+def test_alignment_columns(tmpdir, level, post):
+    lines = expected_ali[level]
+    if post:
+        # insert fake posteriors after the timestamps
+        lines = [' '.join(l.split()[:3] + ['0.{:04d}'.format(i * 7)]
+                          + l.split()[3:]) for i, l in enumerate(lines)]
+
+    columns = align.AlignmentColumns.from_lines(
+        lines, level=level, posteriors=post)
+    assert len(columns) == len(lines)
+    assert columns.rows('s0102a-sent17') == slice(0, len(lines))
+    assert (columns.phone is None) == (level == 'words')
+    assert (columns.word is None) == (level == 'phones')
+
+    path = str(tmpdir.join('alignment.npz'))
+    columns.save(path)
+    loaded = align.AlignmentColumns.read(path)
+    assert list(loaded.lines()) == lines
+    if post:
+        assert loaded.rounded('posterior')[:2].tolist() == [0, 0.0007]
+
+    # a npz file which is not an alignment
+    np.savez(str(tmpdir.join('other.npz')), a=np.zeros(3))
+    with pytest.raises(IOError):
+        align.AlignmentColumns.load(str(tmpdir.join('other.npz')))
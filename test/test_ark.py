@@ -15,6 +15,7 @@
 """Test of the abkhazia.kaldi.io module"""
 
 import os
+import struct
 
 import h5features as h5f
 import numpy as np
@@ -80,3 +81,229 @@ def test_h5f_twice(tmpdir, data):
     # test writing in an existing group
     with pytest.raises(AssertionError):
         io.ark_to_h5f([ark], h5file, 'test')
+
+
+def _binary_record(utt, token, array):
+    """Return a Kaldi binary ark record of an uncompressed array"""
+    record = utt.encode() + b' \0B' + token + b' '
+    for dim in array.shape:
+        record += struct.pack('<bi', 4, dim)
+    return record + array.tobytes()
+
+
+@pytest.mark.parametrize('token, dtype, shape', [
+    (b'FM', np.float32, (10, 3)),
+    (b'DM', np.float64, (10, 3)),
+    (b'FV', np.float32, (7,)),
+    (b'DV', np.float64, (7,))])
+def test_read_binary(tmpdir, token, dtype, shape):
+    data = {'a': np.random.random_sample(shape).astype(dtype),
+            'b': np.random.random_sample(shape).astype(dtype)}
+
+    ark = os.path.join(str(tmpdir), 'ark')
+    with open(ark, 'wb') as fark:
+        for utt, array in data.items():
+            fark.write(_binary_record(utt, token, array))
+
+    data2 = io.ark_to_dict(ark)
+    assert data.keys() == data2.keys()
+    for k in data.keys():
+        assert data2[k].dtype == dtype
+        assert np.array_equal(data[k], data2[k])
+
+
+@pytest.mark.parametrize('token', [b'CM', b'CM2', b'CM3'])
+def test_read_binary_compressed(tmpdir, token):
+    nrows, ncols = 20, 4
+    min_value, prange = -1.0, 2.0
+
+    if token == b'CM2':
+        values = np.random.randint(0, 65536, (nrows, ncols)).astype('<u2')
+        expected = min_value + prange * values / 65535.0
+        body = values.tobytes()
+    elif token == b'CM3':
+        values = np.random.randint(0, 256, (nrows, ncols)).astype(np.uint8)
+        expected = min_value + prange * values / 255.0
+        body = values.tobytes()
+    else:
+        # distinct percentiles for each column, the values spanning
+        # the three interpolation ranges
+        headers = np.array([np.sort(np.random.choice(65536, 4, replace=False))
+                            for _ in range(ncols)], dtype='<u2')
+        values = np.random.randint(0, 256, (ncols, nrows)).astype(np.uint8)
+        values[:, :3] = [32, 128, 224]
+        expected = np.empty((nrows, ncols))
+        for j in range(ncols):
+            p0, p25, p75, p100 = min_value + prange * headers[j] / 65535.0
+            for i in range(nrows):
+                v = float(values[j, i])
+                if v <= 64:
+                    expected[i, j] = p0 + (p25 - p0) * v / 64
+                elif v <= 192:
+                    expected[i, j] = p25 + (p75 - p25) * (v - 64) / 128
+                else:
+                    expected[i, j] = p75 + (p100 - p75) * (v - 192) / 63
+        body = headers.tobytes() + values.tobytes()
+
+    ark = os.path.join(str(tmpdir), 'ark')
+    with open(ark, 'wb') as fark:
+        fark.write(b'utt \0B' + token + b' ')
+        fark.write(struct.pack('<ffii', min_value, prange, nrows, ncols))
+        fark.write(body)
+
+    data = io.ark_to_dict(ark)
+    assert list(data.keys()) == ['utt']
+    assert data['utt'].dtype == np.float32
+    assert np.allclose(data['utt'], expected, atol=1e-5)
+
+
+def test_read_binary_bad_type(tmpdir):
+    ark = os.path.join(str(tmpdir), 'ark')
+    with open(ark, 'wb') as fark:
+        fark.write(b'utt \0BXX ' + bytes(10))
+
+    with pytest.raises(IOError) as err:
+        io.ark_to_dict(ark)
+    assert 'not supported' in str(err.value)
+
+
+def test_read_binary_truncated(tmpdir):
+    ark = os.path.join(str(tmpdir), 'ark')
+    with open(ark, 'wb') as fark:
+        fark.write(b'utt \0BFM')
+
+    with pytest.raises(IOError) as err:
+        io.ark_to_dict(ark)
+    assert 'unexpected end of file' in str(err.value)
+
+
+def test_scp_index(tmpdir):
+    data = {'utt{}'.format(i): np.random.random_sample((5 + i, 3)).astype(
+        np.float32) for i in range(6)}
+
+    # write two ark files and the scp file indexing them
+    scp = os.path.join(str(tmpdir), 'feats.scp')
+    with open(scp, 'w') as fscp:
+        for n, utts in enumerate((sorted(data)[:3], sorted(data)[3:])):
+            ark = os.path.join(str(tmpdir), 'raw.{}.ark'.format(n + 1))
+            with open(ark, 'wb') as fark:
+                for utt in utts:
+                    offset = fark.tell() + len(utt) + 1
+                    fark.write(_binary_record(utt, b'FM', data[utt]))
+                    fscp.write('{} {}:{}\n'.format(utt, ark, offset))
+
+    with io.ScpIndex(scp) as index:
+        assert len(index) == 6
+        assert sorted(index) == sorted(data)
+        assert len(index.ark_files()) == 2
+        assert np.array_equal(index['utt4'], data['utt4'])
+
+        subset = index.get_many(['utt5', 'utt0', 'utt3'])
+        assert list(subset.keys()) == ['utt5', 'utt0', 'utt3']
+        for utt, array in subset.items():
+            assert np.array_equal(array, data[utt])
+
+        with pytest.raises(KeyError):
+            index['unknown']
+
+    # export only a subset to h5features
+    h5file = os.path.join(str(tmpdir), 'h5f')
+    io.scp_to_h5f(scp, h5file, utts=['utt1', 'utt4'])
+    data2 = h5f.Reader(h5file).read()
+    assert data2.items() == ['utt1', 'utt4']
+    assert np.allclose(data2.dict_features()['utt4'], data['utt4'])
+
+    # export all the arks
+    io.scp_to_h5f(scp, h5file, h5_group='all')
+    assert sorted(h5f.Reader(h5file, 'all').read().items()) == sorted(data)
+
+
+def test_read_text(tmpdir):
+    ark = os.path.join(str(tmpdir), 'ark')
+    with open(ark, 'w') as fark:
+        fark.write('a  [\n  1 2 3 \n  4 5 6 ]\n')
+        fark.write('b [ 1.5 -2.5e-3 ]\n')
+        fark.write('c  [\n  7 8 \n]\n')
+
+    data = io.ark_to_dict(ark)
+    assert list(data.keys()) == ['a', 'b', 'c']
+    assert data['a'].dtype == np.float32
+    assert np.array_equal(data['a'], [[1, 2, 3], [4, 5, 6]])
+    assert np.allclose(data['b'], [1.5, -2.5e-3])
+    assert np.array_equal(data['c'], [[7, 8]])
+
+    with open(ark, 'w') as fark:
+        fark.write('a  [\n  1 2 3 \n  4 x 6 ]\n')
+    with pytest.raises(IOError) as err:
+        io.ark_to_dict(ark)
+    assert 'cannot read utterance a' in str(err.value)
+
+
+@pytest.mark.parametrize('format', ['text', 'binary'])
+def test_write_scp(tmpdir, format, data):
+    ark = os.path.join(str(tmpdir), 'ark')
+    scp = os.path.join(str(tmpdir), 'scp')
+    io.dict_to_ark(ark, data, format=format, scp=scp)
+
+    index = io.ScpIndex(scp)
+    assert sorted(index.utts()) == sorted(data.keys())
+    for k in data.keys():
+        assert np.allclose(data[k], index[k], rtol=0, atol=1e-7)
+
+
+def test_write_compressed(tmpdir, data):
+    ark = os.path.join(str(tmpdir), 'ark')
+    io.dict_to_ark(ark, data, format='binary', compress=True)
+    data2 = io.ark_to_dict(ark)
+
+    assert data.keys() == data2.keys()
+    for k in data.keys():
+        assert data2[k].dtype == np.float32
+        assert data2[k].shape == data[k].shape
+        # one byte quantization on data in [0, 1]
+        assert np.allclose(data[k], data2[k], rtol=0, atol=1e-2)
+
+
+@pytest.mark.parametrize('njobs, chunk_size', [(1, 1e-3), (2, 1e-3), (3, 100)])
+def test_h5f_parallel(tmpdir, njobs, chunk_size):
+    arks, data = [], {}
+    for n in range(4):
+        ark_data = {'utt{}_{}'.format(n, i): np.random.random_sample(
+            (10 + i, 4)).astype(np.float32) for i in range(3)}
+        arks.append(os.path.join(str(tmpdir), 'raw.{}.ark'.format(n)))
+        io.dict_to_ark(arks[-1], ark_data, format='binary')
+        data.update(ark_data)
+
+    h5file = os.path.join(str(tmpdir), 'h5f')
+    io.ark_to_h5f(arks, h5file, njobs=njobs, chunk_size=chunk_size)
+
+    data2 = h5f.Reader(h5file, 'features').read()
+    assert data2.items() == sorted(data.keys())
+    for utt, array in data.items():
+        assert np.array_equal(data2.dict_features()[utt], array)
+
+
+@pytest.mark.parametrize('njobs', [0, -1])
+def test_h5f_bad_njobs(tmpdir, data, njobs):
+    ark = os.path.join(str(tmpdir), 'ark')
+    scp = os.path.join(str(tmpdir), 'scp')
+    io.dict_to_ark(ark, data, format='binary', scp=scp)
+    h5file = os.path.join(str(tmpdir), 'h5f')
+
+    with pytest.raises(ValueError):
+        io.ark_to_h5f([ark], h5file, njobs=njobs)
+    with pytest.raises(ValueError):
+        io.scp_to_h5f(scp, h5file, njobs=njobs)
+    assert not os.path.exists(h5file)
+
+
+def test_h5f_parallel_error(tmpdir, data):
+    ark = os.path.join(str(tmpdir), 'ark')
+    io.dict_to_ark(ark, data, format='binary')
+    bad = os.path.join(str(tmpdir), 'bad')
+    with open(bad, 'wb') as fbad:
+        fbad.write(b'utt \0BXX ' + bytes(10))
+
+    with pytest.raises(IOError) as err:
+        io.ark_to_h5f([ark, bad], os.path.join(str(tmpdir), 'h5f'), njobs=2)
+    assert 'not supported' in str(err.value)
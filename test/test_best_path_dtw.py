@@ -0,0 +1,59 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.best_path_dtw module"""
+
+import pytest
+
+from abkhazia.utils import best_path_dtw
+
+
+UTTERANCES = [
+    # a substitution
+    ((['SIL', 'h', 'e', 'l', 'o', 'w', 'o', 'r', 'l', 'd'],
+      ['SIL', 'h', 'e', 'l', 'o', 'w', 'e', 'r', 'l', 'd'],
+      [''] + ['hello'] * 4 + ['world'] * 5,
+      ['u {}'.format(i) for i in range(10)]),
+     ['u 0', 'u 1 hello', 'u 2', 'u 3', 'u 4',
+      'u 5 world', 'u 6', 'u 7', 'u 8', 'u 9']),
+
+    # an insertion
+    ((['SIL', 'a', 'b', 'b', 'c'], ['SIL', 'a', 'b', 'c'],
+      ['', 'x', 'y', 'y'], list('01234')),
+     ['0', '1 x', '2 y', '3', '4']),
+
+    # an empty alignment
+    (([], ['SIL', 'a'], ['', 'x'], []), [])]
+
+
+@pytest.mark.parametrize('utterance, expected', UTTERANCES)
+def test_dtw(utterance, expected):
+    assert best_path_dtw.dtw(*utterance) == expected
+    assert best_path_dtw.dtw(*utterance, window=1) == expected
+
+
+def test_dtw_batch():
+    utterances = [u for u, _ in UTTERANCES]
+    assert best_path_dtw.dtw_batch(utterances, batch_size=2) == [
+        e for _, e in UTTERANCES]
+
+
+def test_band():
+    lo, hi = best_path_dtw.band(5, 9, window=1)
+    assert list(lo) == [0, 0, 0, 2, 4]
+    assert list(hi) == [0, 2, 4, 6, 8]
+
+    lo, hi = best_path_dtw.band(5, 9)
+    assert list(lo) == [0] * 5
+    assert list(hi) == [8] * 5
@@ -15,7 +15,17 @@
 """Test of the Corpus class"""
 
 import os
+import pickle
+import wave
+
+import numpy as np
+
 from abkhazia.corpus import Corpus
+from abkhazia.corpus.corpus_cache import CorpusCache
+from abkhazia.corpus.corpus_dict import CorpusDict
+from abkhazia.corpus.corpus_shards import CorpusShards
+from abkhazia.corpus.corpus_validation import find_overlaps
+from abkhazia.corpus.corpus_split import CorpusSplit
 
 import pytest
 
@@ -35,6 +45,85 @@ def test_save_corpus(tmpdir, corpus, copy_wavs):
     assert corpus.wavs == d.wavs
 
 
+def test_load_cache(tmpdir, corpus):
+    corpus_saved = str(tmpdir.mkdir('corpus'))
+    corpus.save(corpus_saved, copy_wavs=False)
+
+    files = sorted(os.listdir(corpus_saved))
+    d = Corpus.load(corpus_saved)
+    cache = CorpusCache(corpus_saved).directory
+    assert os.path.isfile(os.path.join(cache, 'text.txt.pickle'))
+
+    # nothing is written in the corpus itself
+    assert sorted(os.listdir(corpus_saved)) == files
+
+    # second load from cache
+    e = Corpus.load(corpus_saved)
+    assert d.text == e.text
+    assert d.segments == e.segments
+    assert d.lexicon == e.lexicon
+
+    # a modified file is parsed again
+    utt = sorted(corpus.utts())[0]
+    with open(os.path.join(corpus_saved, 'text.txt'), 'w') as ftext:
+        ftext.write('{} modified\n'.format(utt))
+    f = Corpus.load(corpus_saved)
+    assert f.text == {utt: 'modified'}
+    assert f.segments == d.segments
+
+    g = Corpus.load(corpus_saved, cache=False)
+    assert g.text == f.text
+
+
+def test_wavs_metadata(tmpdir, corpus):
+    corpus_saved = str(tmpdir.mkdir('corpus'))
+    corpus.save(corpus_saved, copy_wavs=True)
+    d = Corpus.load(corpus_saved)
+
+    meta = d.wavs_metadata()
+    assert sorted(meta.keys()) == sorted(d.wavs)
+    assert all(m.rate == 16000 for m in meta.values())
+    assert os.path.isfile(
+        os.path.join(CorpusCache(corpus_saved).directory, 'wavs.pickle'))
+
+    # the cached metadata is reused by another instance
+    assert Corpus.load(corpus_saved).wavs_metadata() == meta
+    assert d.utt2duration() == corpus.utt2duration()
+
+
+def test_packed_wavs(tmpdir, corpus, monkeypatch):
+    # small shards to have several of them
+    monkeypatch.setattr(CorpusShards, 'shard_size', 1 << 16)
+    packed = str(tmpdir.mkdir('packed'))
+    corpus.save(packed, pack_wavs=True)
+    shards = [os.path.join(packed, 'wavs', f)
+              for f in os.listdir(os.path.join(packed, 'wavs'))
+              if f.endswith('.shard')]
+    assert len(shards) > 1
+    assert not any(os.stat(s).st_mode & 0o111 for s in shards)
+
+    d = Corpus.load(packed)
+    assert d.wav_shards() is not None
+    assert d.is_valid()
+    assert d.wavs_metadata() == corpus.wavs_metadata()
+    assert d.utt2duration() == corpus.utt2duration()
+
+    wav = sorted(d.wavs)[0]
+    shard, offset, _ = d.wav_shards().source(wav)
+    assert d.wav_rxfilename(wav) == '{}:{}'.format(shard, offset)
+    assert d.wav_rxfilename(wav, pipe=True).endswith('|')
+
+    # the wavs are unpacked when copied
+    unpacked = str(tmpdir.mkdir('unpacked'))
+    d.save(unpacked, copy_wavs=True)
+    e = Corpus.load(unpacked)
+    assert e.wav_shards() is None
+    with open(os.path.join(e.wav_folder, wav), 'rb') as fin:
+        with open(os.path.join(corpus.wav_folder, wav), 'rb') as fref:
+            assert fin.read() == fref.read()
+    assert not os.stat(os.path.join(e.wav_folder, wav)).st_mode & 0o111
+
+
 def test_empty():
     c = Corpus()
     assert not c.is_valid()
@@ -58,6 +147,82 @@ def test_subcorpus(corpus):
     assert d.wav_folder == e.wav_folder
 
 
+def test_validate_incremental(corpus):
+    corpus.validate(njobs=1)
+    assert 'wavs' in corpus._validation
+
+    # the subcorpus inherits the validation of its parent
+    d = corpus.subcorpus(list(corpus.utts())[:5])
+    assert d._validation['wavs'] == corpus._validation['wavs']
+    d.validate(njobs=1)
+
+    # a modified subcorpus is validated again
+    utt = list(d.utts())[0]
+    d.text[utt] = d.text[utt] + ' a_word_not_in_lexicon'
+    d.validate(njobs=1)
+
+    # a corrupted corpus is detected, even if validated before
+    d.utt2spk[utt] = 'a_speaker_not_prefixing_utterances'
+    with pytest.raises(IOError):
+        d.validate(njobs=1)
+    with pytest.raises(IOError):
+        d.validate(njobs=1, force=True)
+
+
+def test_validate_modified_wav(tmpdir, corpus):
+    corpus_saved = str(tmpdir.mkdir('corpus'))
+    corpus.save(corpus_saved, copy_wavs=True)
+    d = Corpus.load(corpus_saved)
+    d.validate(njobs=1)
+
+    # a wav modified on disk is validated again
+    wav = os.path.join(d.wav_folder, sorted(d.wavs)[0])
+    with wave.open(wav, 'w') as fwav:
+        fwav.setnchannels(1)
+        fwav.setsampwidth(2)
+        fwav.setframerate(8000)
+        fwav.writeframes(bytes(1600))
+    with pytest.raises(IOError):
+        d.validate(njobs=1)
+
+
+def test_corpus_dict():
+    d = CorpusDict(a=1)
+    versions = [d.version]
+
+    def _check():
+        assert d.version not in versions
+        versions.append(d.version)
+
+    d['b'] = 2
+    _check()
+    d['b'] = 3  # same size
+    _check()
+    del d['b']
+    _check()
+    d.update(c=4)
+    _check()
+    d.setdefault('e', 5)
+    _check()
+    d.pop('e')
+    _check()
+    d |= {'f': 6}
+    _check()
+    d.popitem()
+    _check()
+    d.clear()
+    _check()
+
+    # a copy is a new dict
+    assert d.copy().version != d.version
+    assert pickle.loads(pickle.dumps(d)).version != d.version
+
+    # plain dicts assigned to a corpus are converted
+    c = Corpus()
+    c.text = {'u': 'a'}
+    assert isinstance(c.text, CorpusDict)
+
+
 def test_split(corpus):
     d, e = corpus.split(train_prop=0.5)
     assert '<unk>' in d.lexicon
@@ -123,12 +288,112 @@ def test_split_less_than_1(corpus, by_speaker):
     assert 'corpus is empty' in str(err.value)
 
 
+@pytest.mark.parametrize('by_speakers', [True, False])
+def test_kfold(corpus, by_speakers):
+    folds = list(corpus.kfold(3, by_speakers=by_speakers, random_seed=0))
+    assert len(folds) == 3
+
+    tests = set()
+    for train, test in folds:
+        assert train.is_valid()
+        assert not set(train.utts()).intersection(test.utts())
+        assert len(train.utts()) + len(test.utts()) == len(corpus.utts())
+        if by_speakers:
+            assert not set(train.spks()).intersection(test.spks())
+        tests.update(test.utts())
+    assert tests == set(corpus.utts())
+
+    # raised on call, not at the first iteration
+    with pytest.raises(RuntimeError):
+        corpus.kfold(1)
+
+
+def test_multi_split(corpus):
+    spliter = CorpusSplit(corpus, random_seed=0)
+    parts = spliter.multi_split([0.5, 0.5])
+    assert len(parts) == 2
+    utts = [set(p.utts()) for p in parts]
+    assert not utts[0].intersection(utts[1])
+    assert len(utts[0]) + len(utts[1]) == len(corpus.utts())
+
+    # stratified split by speakers
+    spks = sorted(corpus.spks())
+    strata = {spk: i % 2 for i, spk in enumerate(spks)}
+    a, b = spliter.multi_split([0.5, 0.5], True, strata)
+    assert not set(a.spks()).intersection(b.spks())
+    assert {strata[s] for s in a.spks() + b.spks()} == {0, 1}
+    assert len(a.spks()) + len(b.spks()) == len(spks)
+
+    with pytest.raises(RuntimeError):
+        spliter.multi_split([0.8, 0.8])
+
+
+def test_compact(corpus):
+    c = corpus.compact()
+    assert c.is_valid()
+    assert c.segments == corpus.segments
+    assert c.text == corpus.text
+    assert c.utt2spk == corpus.utt2spk
+    assert c.words() == corpus.words()
+    assert {k: sorted(v) for k, v in c.spk2utt().items()} == \
+        {k: sorted(v) for k, v in corpus.spk2utt().items()}
+    assert {k: sorted(v) for k, v in c.wav2utt().items()} == \
+        {k: sorted(v) for k, v in corpus.wav2utt().items()}
+
+    utts = sorted(corpus.utts())[:3]
+    d = c.subcorpus(utts)
+    e = corpus.subcorpus(utts)
+    assert sorted(d.utts()) == utts
+    assert d.text == e.text
+    assert d.segments == e.segments
+    assert d.wavs == e.wavs
+
+
 def test_spk2utt():
     c = Corpus()
     c.utt2spk = {'u1': 's1', 'u2': 's1', 'u3': 's2'}
     assert c.spk2utt() == {'s1': ['u1', 'u2'], 's2': ['u3']}
 
 
+def test_index():
+    c = Corpus()
+    c.utt2spk = {'u1': 's1', 'u2': 's1', 'u3': 's2'}
+    c.segments = {'u1': ('w1', 0, 1), 'u2': ('w2', 0, 2), 'u3': ('w1', 1, 4)}
+    assert c.spk2utt() == {'s1': ['u1', 'u2'], 's2': ['u3']}
+    assert c.index().spk2wavs == {'s1': ['w1', 'w2'], 's2': ['w1']}
+    assert c.spk2duration() == {'s1': 3, 's2': 3}
+    assert c.index() is c.index()
+
+    # adding utterances or assigning attributes rebuilds the index
+    c.utt2spk['u4'] = 's3'
+    c.segments['u4'] = ('w3', 0, 1)
+    assert c.spk2utt()['s3'] == ['u4']
+    c.segments = dict(c.segments, u4=('w3', 0, 2))
+    assert c.spk2duration()['s3'] == 2
+
+    # in place modifications of the same size rebuild the index
+    c.utt2spk['u4'] = 's2'
+    assert c.spk2utt() == {'s1': ['u1', 'u2'], 's2': ['u3', 'u4']}
+    c.segments['u4'] = ('w1', 4, 5)
+    assert c.wav2utt()['w1'] == [('u1', 0, 1), ('u3', 1, 4), ('u4', 4, 5)]
+    assert c.index().spk2wavs['s2'] == ['w1']
+
+
+def test_find_overlaps():
+    wavs = np.array([0, 0, 0, 1, 1, 0])
+    starts = np.array([0., 1., 2., 0., 0.5, 0.5])
+    stops = np.array([1., 2., 3., 1., 2., 2.5])
+    i, j, duration = find_overlaps(wavs, starts, stops)
+
+    # touching utterances and utterances in different wavs do not overlap
+    assert sorted(zip(i, j, duration)) == [
+        (0, 5, 0.5), (3, 4, 0.5), (5, 1, 1.0), (5, 2, 0.5)]
+
+    i, j, duration = find_overlaps(
+        np.array([], dtype=int), np.array([]), np.array([]))
+    assert i.size == j.size == duration.size == 0
+
+
 def test_phonemize_text(corpus, tmpdir):
     phones = corpus.phonemize_text()
     assert sorted(phones.keys()) == sorted(corpus.utts())
@@ -0,0 +1,73 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.kaldi.options module"""
+
+import os
+import stat
+
+import abkhazia.kaldi.options as options
+
+
+HELP = '''compute-fake-feats
+
+Options:
+  --num-ceps                  : Number of cepstra (int, default = 13)
+  --use-energy                : Use energy (bool, default = true)
+
+Standard options:
+  --help                      : Print out usage message (bool, default = false)
+'''
+
+
+def _fake_executable(directory, counter):
+    # an executable printing its help message on stderr and counting
+    # its calls in `counter`
+    path = os.path.join(directory, 'compute-fake-feats')
+    with open(path, 'w') as fexe:
+        fexe.write('#!/bin/sh\necho >> {}\ncat >&2 <<EOF\n{}EOF\n'
+                   .format(counter, HELP))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+def test_options_cache(tmpdir, monkeypatch):
+    bindir = str(tmpdir.mkdir('bin'))
+    counter = str(tmpdir.join('counter'))
+    cache = str(tmpdir.join('cache', 'options.json'))
+    path = _fake_executable(bindir, counter)
+    monkeypatch.setattr(
+        options, 'kaldi_path', lambda: dict(
+            os.environ, PATH=bindir + os.pathsep + os.environ['PATH']))
+
+    def _ncalls():
+        return len(open(counter, 'r').readlines())
+
+    opts = options.get_options('compute-fake-feats', cache_file=cache)
+    assert sorted(opts) == ['num-ceps', 'use-energy']
+    assert opts['num-ceps'].type == 'int'
+    assert opts['num-ceps'].default == '13'
+    assert _ncalls() == 1
+
+    # second call read from cache
+    cached = options.get_options('compute-fake-feats', cache_file=cache)
+    assert _ncalls() == 1
+    assert {k: vars(v) for k, v in cached.items()} == {
+        k: vars(v) for k, v in opts.items()}
+
+    # the executable changed, cache is invalidated
+    stats = os.stat(path)
+    os.utime(path, ns=(stats.st_atime_ns, stats.st_mtime_ns + 10**9))
+    options.get_options('compute-fake-feats', cache_file=cache)
+    assert _ncalls() == 2
@@ -0,0 +1,160 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the AbstractPreparator class"""
+
+import os
+import wave
+
+import pytest
+
+import abkhazia.utils as utils
+from abkhazia.corpus.corpus_cache import CorpusCache
+from abkhazia.corpus.prepare.abstract_preparator import AbstractPreparator
+
+
+class _Preparator(AbstractPreparator):
+    name = 'test'
+    audio_format = 'wav'
+
+    def list_audio_files(self):
+        return sorted(os.path.join(self.input_dir, f)
+                      for f in os.listdir(self.input_dir))
+
+
+def _write_wav(filename, nframes, rate=16000):
+    with wave.open(filename, 'w') as fwav:
+        fwav.setnchannels(1)
+        fwav.setsampwidth(2)
+        fwav.setframerate(rate)
+        fwav.writeframes(bytes(2 * nframes))
+
+
+@pytest.fixture
+def converted(monkeypatch):
+    """The list of the input files converted by utils.wav.convert"""
+    inputs = []
+    convert = utils.wav.convert
+
+    def _convert(i, *args, **kwargs):
+        inputs.extend(i)
+        return convert(i, *args, **kwargs)
+
+    monkeypatch.setattr(utils.wav, 'convert', _convert)
+    return inputs
+
+
+def test_make_wavs_incremental(tmpdir, converted):
+    input_dir = str(tmpdir.mkdir('input'))
+    wavs_dir = os.path.join(str(tmpdir), 'corpus', 'wavs')
+    for i in range(3):
+        _write_wav(os.path.join(input_dir, '{}.wav'.format(i)), 1600)
+    _write_wav(os.path.join(input_dir, '8k.wav'), 800, rate=8000)
+
+    preparator = _Preparator(input_dir)
+    preparator.njobs = 1
+    preparator.make_wavs(wavs_dir)
+    assert len(converted) == 4
+    assert sorted(os.listdir(wavs_dir)) == [
+        '0.wav', '1.wav', '2.wav', '8k.wav']
+    assert os.path.islink(os.path.join(wavs_dir, '0.wav'))
+    assert not os.path.islink(os.path.join(wavs_dir, '8k.wav'))
+    assert preparator.wavs_meta['8k.wav'].rate == 16000
+    assert preparator.wavs_meta['8k.wav'].duration == pytest.approx(0.1)
+
+    # nothing to convert
+    del converted[:]
+    preparator = _Preparator(input_dir)
+    preparator.njobs = 1
+    preparator.make_wavs(wavs_dir)
+    assert converted == []
+    assert len(preparator.wavs_meta) == 4
+
+    # a new file, a modified one and an undesired one
+    _write_wav(os.path.join(input_dir, '3.wav'), 1600)
+    _write_wav(os.path.join(input_dir, '0.wav'), 3200)
+    os.remove(os.path.join(input_dir, '2.wav'))
+    preparator.make_wavs(wavs_dir)
+    assert sorted(converted) == [
+        os.path.join(input_dir, w) for w in ('0.wav', '3.wav')]
+    assert sorted(os.listdir(wavs_dir)) == [
+        '0.wav', '1.wav', '3.wav', '8k.wav']
+    assert preparator.wavs_meta['0.wav'].duration == pytest.approx(0.2)
+    assert '2.wav' not in preparator.wavs_meta
+
+    # a broken output is converted again
+    del converted[:]
+    os.remove(os.path.join(wavs_dir, '8k.wav'))
+    with open(os.path.join(wavs_dir, '8k.wav'), 'w'):
+        pass
+    preparator.make_wavs(wavs_dir)
+    assert converted == [os.path.join(input_dir, '8k.wav')]
+
+
+def test_make_wavs_without_manifest(tmpdir, converted):
+    input_dir = str(tmpdir.mkdir('input'))
+    wavs_dir = os.path.join(str(tmpdir), 'corpus', 'wavs')
+    for i in range(3):
+        _write_wav(os.path.join(input_dir, '{}.wav'.format(i)), 1600)
+    _write_wav(os.path.join(input_dir, '8k.wav'), 800, rate=8000)
+
+    preparator = _Preparator(input_dir)
+    preparator.njobs = 1
+    preparator.make_wavs(wavs_dir)
+    meta = preparator.wavs_meta
+
+    # emulate a wavs directory prepared by a previous version, with a
+    # broken wav and a wav not converted to 16 kHz
+    os.remove(os.path.join(
+        CorpusCache(os.path.dirname(wavs_dir)).directory, 'manifest.pickle'))
+    os.remove(os.path.join(wavs_dir, '2.wav'))
+    with open(os.path.join(wavs_dir, '2.wav'), 'w') as fwav:
+        fwav.write('not a wav')
+    os.remove(os.path.join(wavs_dir, '8k.wav'))
+    _write_wav(os.path.join(wavs_dir, '8k.wav'), 800, rate=8000)
+
+    # the valid wavs are kept and recorded
+    del converted[:]
+    preparator.make_wavs(wavs_dir)
+    assert sorted(converted) == [
+        os.path.join(input_dir, w) for w in ('2.wav', '8k.wav')]
+    assert preparator.wavs_meta == meta
+
+    del converted[:]
+    preparator.make_wavs(wavs_dir)
+    assert converted == []
+    assert preparator.wavs_meta == meta
+
+
+def _count_lines(filename, offset):
+    return offset + len(open(filename, 'r').readlines())
+
+
+def test_input_files(tmpdir):
+    input_dir = tmpdir.mkdir('input')
+    input_dir.mkdir('b').join('2.txt').write('a\nb\n')
+    input_dir.join('1.txt').write('a\n')
+    input_dir.join('readme.txt').write('')
+    input_dir.join('1.wav').write('')
+
+    preparator = _Preparator(str(input_dir))
+    preparator.njobs = 2
+    files = preparator.input_files('.txt', exclude=['readme'])
+    assert files == [
+        os.path.join(os.path.realpath(str(input_dir)), f)
+        for f in ('1.txt', os.path.join('b', '2.txt'))]
+    assert len(preparator.input_files()) == 4
+
+    # the results are in the order of the files
+    assert preparator.parse_files(_count_lines, files, 10) == [11, 12]
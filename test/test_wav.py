@@ -0,0 +1,257 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.wav module"""
+
+import importlib.util
+import logging
+import os
+import shutil
+import struct
+import wave
+
+import numpy as np
+import pytest
+
+import abkhazia.utils.wav as wav
+
+
+def _write_wav(filename, nframes, rate=16000, nchannels=1, width=2):
+    with wave.open(filename, 'w') as fwav:
+        fwav.setnchannels(nchannels)
+        fwav.setsampwidth(width)
+        fwav.setframerate(rate)
+        fwav.writeframes(bytes(nframes * nchannels * width))
+
+
+def _write_wav_extensible(filename, nframes):
+    fmt = struct.pack(
+        '<HHIIHHHHI', 0xFFFE, 1, 16000, 32000, 2, 16, 22, 16, 4)
+    fmt += struct.pack('<H', 1) + bytes(14)  # PCM subformat
+    data = bytes(2 * nframes)
+    body = (b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt)) + fmt +
+            b'LIST' + struct.pack('<I', 3) + b'abc\0' +
+            b'data' + struct.pack('<I', len(data)) + data)
+    with open(filename, 'wb') as fwav:
+        fwav.write(b'RIFF' + struct.pack('<I', len(body)) + body)
+
+
+@pytest.mark.parametrize('njobs', [1, 2])
+def test_scan(tmpdir, njobs):
+    wavs = [os.path.join(str(tmpdir), w)
+            for w in ('a.wav', 'b.wav', 'c.wav', 'd.wav')]
+    _write_wav(wavs[0], 16000)
+    _write_wav(wavs[1], 8000, rate=8000, nchannels=2)
+    _write_wav_extensible(wavs[2], 1600)
+    with open(wavs[3], 'wb') as fwav:
+        fwav.write(b'not a wav')
+
+    meta = wav.scan(wavs, njobs=njobs)
+    assert meta[wavs[0]] == (
+        1, 2, 16000, 16000, 'NONE', 'not compressed', 1.0, None)
+    assert meta[wavs[1]].nbc == 2
+    assert meta[wavs[1]].rate == 8000
+    assert meta[wavs[1]].duration == 1.0
+    assert meta[wavs[2]].comptype == 'NONE'
+    assert meta[wavs[2]].duration == 0.1
+    assert 'not a RIFF/WAVE file' in meta[wavs[3]].error
+
+    with pytest.raises(IOError):
+        wav.duration(wavs[3])
+
+
+def test_scan_cache(tmpdir):
+    wav_file = os.path.join(str(tmpdir), 'a.wav')
+    _write_wav(wav_file, 16000)
+
+    cache = {}
+    assert wav.scan([wav_file], cache=cache)[wav_file].duration == 1.0
+    assert list(cache.keys()) == [wav_file]
+
+    # the wav is modified, the cache is updated
+    _write_wav(wav_file, 32000)
+    assert wav.duration(wav_file, cache=cache) == 2.0
+    assert cache[wav_file][1].duration == 2.0
+
+
+@pytest.mark.parametrize('padding', [0, 0.5])
+def test_merge(tmpdir, padding):
+    wavs = [os.path.join(str(tmpdir), w) for w in ('a.wav', 'b.wav')]
+    _write_wav(wavs[0], 16000)
+    _write_wav_extensible(wavs[1], 1600)
+    merged = os.path.join(str(tmpdir), 'merged.wav')
+
+    # small blocks to test the copy loop
+    wav.copy_block_size, block_size = 1000, wav.copy_block_size
+    try:
+        meta = wav.merge(wavs, merged, padding=padding)
+    finally:
+        wav.copy_block_size = block_size
+
+    assert meta.duration == pytest.approx(1.1 + padding)
+    assert meta == wav.scan([merged])[merged]
+    with wave.open(merged, 'r') as fwav:
+        assert fwav.getnframes() == meta.nframes
+    assert not os.stat(merged).st_mode & 0o111
+
+    # cannot merge wavs of different formats
+    _write_wav(wavs[1], 8000, rate=8000)
+    with pytest.raises(IOError):
+        wav.merge(wavs, merged)
+
+
+def test_trim(tmpdir):
+    wav_in = os.path.join(str(tmpdir), 'in.wav')
+    wav_out = os.path.join(str(tmpdir), 'out.wav')
+    _write_wav(wav_in, 16000)
+
+    meta, removed = wav.trim(
+        wav_in, wav_out, [(0.5, 0.6), (0.55, 0.7), (0.9, 2), (0.1, 0.1)])
+    assert removed == [(8000, 11200), (14400, 16000)]
+    assert meta.duration == pytest.approx(0.7)
+    assert meta == wav.scan([wav_out])[wav_out]
+    assert not os.stat(wav_out).st_mode & 0o111
+
+    meta, removed = wav.trim(wav_in, wav_out, [])
+    assert removed == []
+    assert meta.duration == 1.0
+
+
+def _sine(rate, nchannels, duration=1.0, freq=440):
+    """Return a sine as int16 frames of shape (nframes, nchannels)"""
+    t = np.arange(int(rate * duration)) / rate
+    sine = (0.5 * 32767 * np.sin(2 * np.pi * freq * t)).astype('<i2')
+    return np.repeat(sine[:, np.newaxis], nchannels, axis=1)
+
+
+def _write_sph(filename, frames, rate):
+    fields = ['sample_rate -i {}'.format(rate),
+              'channel_count -i {}'.format(frames.shape[1]),
+              'sample_count -i {}'.format(frames.shape[0]),
+              'sample_n_bytes -i 2',
+              'sample_byte_format -s2 10',
+              'sample_coding -s3 pcm',
+              'end_head']
+    header = 'NIST_1A\n   1024\n' + '\n'.join(fields) + '\n'
+    with open(filename, 'wb') as fsph:
+        fsph.write(header.encode('ascii').ljust(1024, b' '))
+        fsph.write(frames.astype('>i2').tobytes())
+
+
+def _read_wav(filename):
+    with wave.open(filename, 'r') as fwav:
+        assert (fwav.getnchannels(), fwav.getsampwidth(),
+                fwav.getframerate()) == (1, 2, 16000)
+        return np.frombuffer(
+            fwav.readframes(fwav.getnframes()), dtype='<i2')
+
+
+@pytest.mark.parametrize('rate, nchannels', [
+    (16000, 2), (8000, 1), (44100, 2)])
+def test_convert_wav(tmpdir, rate, nchannels):
+    wav_in = os.path.join(str(tmpdir), 'in.wav')
+    wav_out = os.path.join(str(tmpdir), 'out.wav')
+    with wave.open(wav_in, 'w') as fwav:
+        fwav.setnchannels(nchannels)
+        fwav.setsampwidth(2)
+        fwav.setframerate(rate)
+        fwav.writeframes(_sine(rate, nchannels).tobytes())
+
+    wav.convert([wav_in], [wav_out], 'wav')
+    data = _read_wav(wav_out)
+    assert len(data) == 16000
+
+    # compare with the expected sine, away from the borders
+    expected = _sine(16000, 1)[:, 0]
+    assert np.abs(data - expected)[100:-100].max() < 100
+
+
+def test_convert_sph(tmpdir):
+    sph = os.path.join(str(tmpdir), 'in.sph')
+    wav_out = os.path.join(str(tmpdir), 'out.wav')
+    _write_sph(sph, _sine(16000, 1), 16000)
+
+    wav.convert([sph], [wav_out], 'sph')
+    assert np.array_equal(_read_wav(wav_out), _sine(16000, 1)[:, 0])
+
+
+def test_convert_flac_fallback(tmpdir, monkeypatch, caplog):
+    # emulate a missing soundfile, and a flac tool copying its input
+    def _decode_flac(flac):
+        raise wav.UnsupportedAudio('soundfile is not installed')
+
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, 'find_spec', lambda name: (
+        None if name == 'soundfile' else find_spec(name)))
+    monkeypatch.setitem(wav.decoders, 'flac', _decode_flac)
+    monkeypatch.setitem(wav.external, 'flac', shutil.copy)
+
+    flacs = [os.path.join(str(tmpdir), f) for f in ('a.flac', 'b.flac')]
+    wavs = [os.path.join(str(tmpdir), f) for f in ('a.wav', 'b.wav')]
+    for flac in flacs:
+        _write_wav(flac, 16000)
+
+    log = logging.getLogger('test_convert_flac_fallback')
+    with caplog.at_level(logging.INFO):
+        wav.convert(flacs, wavs, 'flac', log=log)
+    assert all(os.path.isfile(w) for w in wavs)
+
+    # logged once for all the files
+    assert len([r for r in caplog.records
+                if 'soundfile is not installed' in r.getMessage()]) == 1
+
+
+def test_convert_batches(tmpdir, monkeypatch):
+    # a serial joblib recording the dispatched batches
+    import joblib
+    batches = []
+
+    class _Parallel(object):
+        def __init__(self, n_jobs=1, verbose=0):
+            pass
+
+        def __call__(self, tasks):
+            tasks = list(tasks)
+            batches.extend(args[0] for _, args, _ in tasks)
+            return [f(*args, **kwargs) for f, args, kwargs in tasks]
+
+    monkeypatch.setattr(joblib, 'Parallel', _Parallel)
+
+    wavs = [os.path.join(str(tmpdir), '{}.wav'.format(i)) for i in range(10)]
+    outputs = [os.path.join(str(tmpdir), 'out_{}.wav'.format(i))
+               for i in range(10)]
+    for w in wavs:
+        _write_wav(w, 1600, rate=8000)
+
+    # fewer files than scan_batch_size are shared among the processes
+    wav.convert(wavs, outputs, 'wav', njobs=4)
+    assert len(batches) == 4
+    assert sorted(w for batch in batches for w in batch) == wavs
+    assert all(len(_read_wav(o)) == 3200 for o in outputs)
+
+
+def test_convert_errors(tmpdir):
+    wavs = [os.path.join(str(tmpdir), w) for w in ('a.wav', 'b.wav')]
+    _write_wav(wavs[0], 8000, rate=8000)
+    with open(wavs[1], 'wb') as fwav:
+        fwav.write(b'not a wav')
+    outputs = [os.path.join(str(tmpdir), 'out_' + os.path.basename(w))
+               for w in wavs]
+
+    # the failed conversion is reported, the other one is done
+    with pytest.raises(IOError) as err:
+        wav.convert(wavs, outputs, 'wav', njobs=2)
+    assert 'failed to convert 1 files' in str(err.value)
+    assert wavs[1] in str(err.value)
+    assert len(_read_wav(outputs[0])) == 16000